@@ -298,6 +298,56 @@ class APIClient {
     if (!response.ok) throw new Error("Erro ao buscar ranking");
     return response.json();
   }
+
+  // ===== TEMPO REAL =====
+
+  /**
+   * Assinar atualizações em tempo real (Server-Sent Events)
+   * O token do login não vai na URL: cada conexão usa um token curto, válido só no /stream
+   * @param {Object} handlers - { pontos(dados), ranking(dados) }
+   * @returns {Object} chame .close() para encerrar
+   */
+  subscribe(handlers) {
+    if (!this.token) throw new Error("Não autenticado");
+    let source = null;
+    let encerrado = false;
+    const reconectar = () => {
+      if (!encerrado) setTimeout(conectar, 3000);
+    };
+    const conectar = async () => {
+      try {
+        const response = await fetch(`${API_URL}/stream/token`, {
+          method: "POST",
+          headers: this.getAuthHeader(),
+        });
+        // login expirado: não adianta insistir
+        if (response.status === 401) return;
+        if (!response.ok) throw new Error("Erro ao obter token do stream");
+        const { token } = await response.json();
+        if (encerrado) return;
+        // EventSource não envia headers; o token curto vai na query string
+        source = new EventSource(`${API_URL}/stream?token=${encodeURIComponent(token)}`);
+        for (const [evento, handler] of Object.entries(handlers)) {
+          source.addEventListener(evento, (e) => handler(JSON.parse(e.data)));
+        }
+        // o EventSource reconecta sozinho com a mesma URL; com o token já expirado a
+        // reconexão é recusada e ele desiste (CLOSED): pede um token novo
+        source.onerror = () => {
+          if (source.readyState === EventSource.CLOSED) reconectar();
+        };
+      } catch (error) {
+        console.error("Erro ao conectar ao stream:", error);
+        reconectar();
+      }
+    };
+    conectar();
+    return {
+      close() {
+        encerrado = true;
+        if (source) source.close();
+      },
+    };
+  }
 }
 
 // Exportar instância global
@@ -1,13 +1,16 @@
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
-from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi import Depends, HTTPException, Request, status
 from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from .models import UserProfile, UserPublic
-from .database import get_session
+from .database import get_session, get_async_session
+from .last_seen import last_seen
+from .metrics import medir_auth
+from .token_cache import token_cache
+from .passwords import pwd_context, hash_password, verify_password
 
 import os
 
@@ -15,26 +18,9 @@ import os
 SECRET_KEY = os.getenv("SECRET_KEY", "seu-secret-key-super-seguro-mude-em-producao-12345")  # MUDAR EM PRODUÇÃO
 ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 60 * 24))  # 24 horas por padrão
-
-pwd_context = CryptContext(schemes=["pbkdf2_sha256", "bcrypt"], deprecated="auto")
-security = HTTPBearer()
-
-
-def hash_password(password: str) -> str:
-    """Gera hash da senha (trunca em 72 bytes se necessário devido a limitação do bcrypt)"""
-    # Bcrypt tem limite de 72 bytes - truncar se necessário
-    password_bytes = password.encode('utf-8')
-    if len(password_bytes) > 72:
-        password = password_bytes[:72].decode('utf-8', errors='ignore')
-    return pwd_context.hash(password)
-
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verifica se senha corresponde ao hash (trunca em 72 bytes se necessário)"""
-    password_bytes = plain_password.encode('utf-8')
-    if len(password_bytes) > 72:
-        plain_password = password_bytes[:72].decode('utf-8', errors='ignore')
-    return pwd_context.verify(plain_password, hashed_password)
+# Token do /stream: vai na URL (logs de acesso, proxies), então vale pouco e só para essa rota
+STREAM_TOKEN_EXPIRE_SECONDS = int(os.getenv("STREAM_TOKEN_EXPIRE_SECONDS", 60))
+ESCOPO_STREAM = "stream"
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -49,10 +35,21 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
+def create_stream_token(username: str) -> str:
+    """Cria o token curto aceito apenas em `?token=` nas rotas de `QUERY_TOKEN_PATHS`"""
+    return create_access_token(
+        {"sub": username, "scope": ESCOPO_STREAM}, timedelta(seconds=STREAM_TOKEN_EXPIRE_SECONDS)
+    )
+
+
 def decode_token(token: str) -> dict:
-    """Decodifica token JWT"""
+    """Decodifica token JWT (tokens já verificados são servidos do cache)"""
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        token_cache.put(token, payload)
         return payload
     except JWTError:
         raise HTTPException(
@@ -62,32 +59,95 @@ def decode_token(token: str) -> dict:
         )
 
 
-async def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    session: Session = Depends(get_session)
-) -> UserProfile:
-    """Obtém usuário atual a partir do token"""
-    token = credentials.credentials
+# Rotas abertas pelo EventSource do navegador, que não envia headers: aceitam ?token=,
+# mas só com um token de `create_stream_token` (que, por sua vez, não vale no header)
+QUERY_TOKEN_PATHS = {"/stream"}
+
+
+def extract_token(auth_header: Optional[str]) -> Optional[str]:
+    """Extrai o token de um header Authorization (`Bearer <token>` ou token puro)"""
+    if not auth_header:
+        return None
+    return auth_header.split(" ")[1] if " " in auth_header else auth_header
+
+
+def authenticate_request(request: Request) -> dict:
+    """Valida o token da requisição uma única vez e guarda o payload em `request.state`"""
+    payload = getattr(request.state, "token_payload", None)
+    if payload is not None:
+        return payload
+    with medir_auth():
+        return _autenticar(request)
+
+
+def _autenticar(request: Request) -> dict:
+    token = extract_token(request.headers.get("authorization"))
+    escopo = None
+    if not token and request.url.path.removeprefix("/api") in QUERY_TOKEN_PATHS:
+        token = request.query_params.get("token")
+        escopo = ESCOPO_STREAM
+    if not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Authorization required",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     payload = decode_token(token)
+    if payload.get("scope") != escopo:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token inválido para esta rota",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    request.state.token_payload = payload
+    return payload
+
+
+def _username_do_token(request: Request) -> str:
+    payload = authenticate_request(request)
     username: str = payload.get("sub")
     if username is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Token inválido",
         )
-    
-    user = session.exec(select(UserProfile).where(UserProfile.username == username)).first()
+    return username
+
+
+def _autenticado(request: Request, user: Optional[UserProfile]) -> UserProfile:
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Usuário não encontrado",
         )
-    
-    # Atualizar último acesso
-    user.ultimo_acesso = datetime.utcnow()
-    session.add(user)
-    session.commit()
-    
+    request.state.user = user
+    return user
+
+
+def get_current_user(request: Request, session: Session = Depends(get_session)) -> UserProfile:
+    """Obtém usuário atual a partir do token já validado pelo middleware"""
+    user = getattr(request.state, "user", None)
+    if user is not None:
+        return user
+    with medir_auth():
+        username = _username_do_token(request)
+        user = session.exec(select(UserProfile).where(UserProfile.username == username)).first()
+        user = _autenticado(request, user)
+    last_seen.registrar(user.id)
+    return user
+
+
+async def get_current_user_async(request: Request, session: AsyncSession = Depends(get_async_session)) -> UserProfile:
+    """Versão de `get_current_user` para rotas com `AsyncSession`"""
+    user = getattr(request.state, "user", None)
+    if user is not None:
+        return user
+    with medir_auth():
+        username = _username_do_token(request)
+        user = (await session.exec(select(UserProfile).where(UserProfile.username == username))).first()
+        user = _autenticado(request, user)
+    # no event loop: um flush do buffer não pode bloquear as outras requisições
+    await last_seen.registrar_async(user.id)
     return user
 
 
@@ -0,0 +1,287 @@
+"""Coordenação dos caches em memória entre os workers do uvicorn.
+
+Ranking, estatísticas globais, rankings por período, o canal de tempo real e o
+cache de respostas vivem na memória de cada processo. Com vários workers, uma
+escrita confirmada em um deles precisa chegar aos outros. O backend é escolhido
+por `CACHE_BACKEND`:
+
+- `memory`: tudo em processo, sem comunicação (um único worker);
+- `mmap`: um arquivo mapeado em memória (`CACHE_MMAP_PATH`) compartilhado pelos
+  workers do host, com uma tabela de versões por nome e um log circular de
+  mensagens de invalidação.
+
+Os valores continuam nos caches de cada processo. O que é compartilhado são as
+versões (`versoes`/`invalidar`, usadas pelo cache de respostas) e as mensagens
+publicadas com `difundir` após o commit, que os outros workers aplicam em
+`sincronizar` antes de atender a próxima requisição. Um worker que fica para trás
+mais que `CACHE_LOG_SIZE` mensagens recarrega tudo do banco.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+from .database import DATABASE_URL
+
+CACHE_BACKEND = os.getenv(
+    "CACHE_BACKEND", "mmap" if int(os.getenv("WEB_CONCURRENCY", 1)) > 1 else "memory"
+)
+CACHE_MMAP_PATH = os.getenv(
+    "CACHE_MMAP_PATH",
+    os.path.join(
+        tempfile.gettempdir(),
+        f"penseoffline-cache-{hashlib.blake2b(DATABASE_URL.encode(), digest_size=6).hexdigest()}.bin",
+    ),
+)
+CACHE_VERSION_SLOTS = int(os.getenv("CACHE_VERSION_SLOTS", 1024))
+CACHE_LOG_SIZE = int(os.getenv("CACHE_LOG_SIZE", 4096))
+CACHE_SYNC_SECONDS = float(os.getenv("CACHE_SYNC_SECONDS", 0.5))
+
+Mensagem = Tuple[str, Sequence]
+
+
+class MensagensPerdidas(Exception):
+    """O log circular foi sobrescrito antes de o worker ler as mensagens"""
+
+
+class LayoutIncompativel(Exception):
+    """O arquivo compartilhado foi criado com outro tamanho de tabela ou de log"""
+
+
+class MemoryBackend:
+    """Versões em processo; mensagens não precisam ser entregues a ninguém"""
+
+    compartilhado = False
+
+    def __init__(self):
+        self._versoes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def versoes(self, nomes: Iterable[str]) -> Dict[str, int]:
+        with self._lock:
+            return {nome: self._versoes.get(nome, 0) for nome in nomes}
+
+    def invalidar(self, *nomes: str) -> None:
+        with self._lock:
+            for nome in nomes:
+                self._versoes[nome] = self._versoes.get(nome, 0) + 1
+
+    def publicar(self, mensagens: List[Mensagem]) -> None:
+        pass
+
+    def novidades(self) -> bool:
+        return False
+
+    def receber(self) -> List[Mensagem]:
+        return []
+
+
+# Layout do arquivo: cabeçalho (mágico, último seq) | versões (uint64 por slot) |
+# log circular de CACHE_LOG_SIZE slots (seq, pid, tamanho, JSON `[canal, dados]`)
+_MAGICO = b"POCACHE1"
+_CABECALHO = struct.Struct("<8sQ")
+_TAM_CABECALHO = 64
+_U64 = struct.Struct("<Q")
+_SLOT = struct.Struct("<QII")
+_TAM_SLOT = 256
+_TAM_MAX_DADOS = _TAM_SLOT - _SLOT.size
+# mensagem grande demais para um slot: os outros workers recarregam tudo
+_RECARREGAR = 0xFFFFFFFF
+
+
+class MmapBackend:
+    """Versões e log de mensagens em um arquivo mapeado por todos os workers do host
+
+    Escritas usam `flock` no arquivo; leituras não travam. Cada slot do log é
+    conferido pelo seq antes e depois da leitura, então um slot sobrescrito
+    durante a leitura é detectado como mensagem perdida.
+    """
+
+    compartilhado = True
+
+    def __init__(
+        self,
+        caminho: str = CACHE_MMAP_PATH,
+        slots_versao: int = CACHE_VERSION_SLOTS,
+        tamanho_log: int = CACHE_LOG_SIZE,
+    ):
+        import fcntl
+        import mmap
+
+        self._fcntl = fcntl
+        self.slots_versao = slots_versao
+        self.tamanho_log = tamanho_log
+        self._inicio_log = _TAM_CABECALHO + slots_versao * _U64.size
+        tamanho = self._inicio_log + tamanho_log * _TAM_SLOT
+        self._fd = os.open(caminho, os.O_RDWR | os.O_CREAT, 0o600)
+        self._lock = threading.Lock()
+        try:
+            with self._travado():
+                atual = os.fstat(self._fd).st_size
+                if atual == 0:
+                    # arquivo novo: nenhum outro worker o mapeou ainda
+                    os.ftruncate(self._fd, tamanho)
+                elif atual != tamanho:
+                    # encolher ou reformatar um arquivo mapeado por outros workers os derruba (SIGBUS)
+                    raise LayoutIncompativel(
+                        f"{caminho} tem {atual} bytes, esperado {tamanho}: CACHE_VERSION_SLOTS ou "
+                        f"CACHE_LOG_SIZE diferem dos outros workers; pare todos e remova o arquivo"
+                    )
+                self._mm = mmap.mmap(self._fd, tamanho)
+                magico, _ = _CABECALHO.unpack_from(self._mm, 0)
+                if magico != _MAGICO:
+                    self._mm[:tamanho] = bytes(tamanho)
+                    _CABECALHO.pack_into(self._mm, 0, _MAGICO, 0)
+        except BaseException:
+            os.close(self._fd)
+            raise
+        self._visto = self._seq()
+
+    @contextmanager
+    def _travado(self):
+        # flock vale por descrição de arquivo, então threads do mesmo processo usam o lock
+        with self._lock:
+            self._fcntl.flock(self._fd, self._fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                self._fcntl.flock(self._fd, self._fcntl.LOCK_UN)
+
+    def _seq(self) -> int:
+        return _CABECALHO.unpack_from(self._mm, 0)[1]
+
+    def _slot_versao(self, nome: str) -> int:
+        # colisões entre nomes só causam invalidações a mais
+        indice = int.from_bytes(hashlib.blake2b(nome.encode(), digest_size=8).digest(), "little")
+        return _TAM_CABECALHO + (indice % self.slots_versao) * _U64.size
+
+    def versoes(self, nomes: Iterable[str]) -> Dict[str, int]:
+        return {nome: _U64.unpack_from(self._mm, self._slot_versao(nome))[0] for nome in nomes}
+
+    def invalidar(self, *nomes: str) -> None:
+        with self._travado():
+            for nome in nomes:
+                posicao = self._slot_versao(nome)
+                _U64.pack_into(self._mm, posicao, _U64.unpack_from(self._mm, posicao)[0] + 1)
+
+    def publicar(self, mensagens: List[Mensagem]) -> None:
+        if not mensagens:
+            return
+        pid = os.getpid()
+        codificadas = [json.dumps(m, separators=(",", ":")).encode("utf-8") for m in mensagens]
+        with self._travado():
+            seq = self._seq()
+            for dados in codificadas:
+                seq += 1
+                posicao = self._inicio_log + (seq % self.tamanho_log) * _TAM_SLOT
+                tamanho = len(dados)
+                if tamanho > _TAM_MAX_DADOS:
+                    dados, tamanho = b"", _RECARREGAR
+                # seq zerado enquanto o slot é reescrito
+                _U64.pack_into(self._mm, posicao, 0)
+                self._mm[posicao + _SLOT.size:posicao + _SLOT.size + len(dados)] = dados
+                _SLOT.pack_into(self._mm, posicao, seq, pid, tamanho)
+            _CABECALHO.pack_into(self._mm, 0, _MAGICO, seq)
+
+    def novidades(self) -> bool:
+        return self._seq() != self._visto
+
+    def receber(self) -> List[Mensagem]:
+        """Mensagens de outros processos desde a última leitura
+
+        Levanta `MensagensPerdidas` se alguma não pôde ser lida.
+        """
+        atual = self._seq()
+        visto, self._visto = self._visto, atual
+        if atual - visto > self.tamanho_log:
+            raise MensagensPerdidas()
+        pid = os.getpid()
+        mensagens: List[Mensagem] = []
+        for seq in range(visto + 1, atual + 1):
+            posicao = self._inicio_log + (seq % self.tamanho_log) * _TAM_SLOT
+            seq_slot, pid_slot, tamanho = _SLOT.unpack_from(self._mm, posicao)
+            if seq_slot != seq:
+                raise MensagensPerdidas()
+            if pid_slot == pid:
+                # as próprias mensagens já foram aplicadas localmente
+                continue
+            if tamanho == _RECARREGAR:
+                raise MensagensPerdidas()
+            dados = self._mm[posicao + _SLOT.size:posicao + _SLOT.size + min(tamanho, _TAM_MAX_DADOS)]
+            if _U64.unpack_from(self._mm, posicao)[0] != seq:
+                raise MensagensPerdidas()
+            canal, valores = json.loads(dados)
+            mensagens.append((canal, valores))
+        return mensagens
+
+
+def _criar_backend():
+    if CACHE_BACKEND == "mmap":
+        try:
+            return MmapBackend()
+        except (ImportError, OSError) as e:
+            print(f"Backend de cache mmap indisponível ({e}); usando memória do processo")
+    return MemoryBackend()
+
+
+cache_backend = _criar_backend()
+
+_receptores: Dict[str, Callable[..., None]] = {}
+_recarregadores: List[Callable[[], None]] = []
+_lock_sincronizar = threading.Lock()
+
+
+def ao_receber(canal: str):
+    """Registra a função que aplica as mensagens de `canal` vindas de outros workers"""
+    def registrar(fn: Callable[..., None]) -> Callable[..., None]:
+        _receptores[canal] = fn
+        return fn
+    return registrar
+
+
+def ao_perder_mensagens(fn: Callable[[], None]) -> Callable[[], None]:
+    """Registra uma função que recarrega o estado do banco quando mensagens se perdem"""
+    _recarregadores.append(fn)
+    return fn
+
+
+def difundir(canal: str, dados: Iterable[Sequence]) -> None:
+    """Publica para os outros workers; cada item de `dados` vira uma chamada do receptor"""
+    if cache_backend.compartilhado:
+        cache_backend.publicar([(canal, list(d)) for d in dados])
+
+
+def sincronizar() -> None:
+    """Aplica as mensagens pendentes dos outros workers"""
+    with _lock_sincronizar:
+        try:
+            mensagens = cache_backend.receber()
+        except MensagensPerdidas:
+            for fn in _recarregadores:
+                fn()
+            return
+        for canal, valores in mensagens:
+            receptor = _receptores.get(canal)
+            if receptor is not None:
+                try:
+                    receptor(*valores)
+                except Exception as e:
+                    print(f"Erro ao aplicar mensagem de cache '{canal}': {e}")
+
+
+async def sincronizar_periodicamente(intervalo: float = CACHE_SYNC_SECONDS) -> None:
+    """Loop de fundo: mantém os caches atualizados mesmo sem requisições (ex.: SSE)"""
+    if not cache_backend.compartilhado:
+        return
+    while True:
+        await asyncio.sleep(intervalo)
+        if cache_backend.novidades():
+            try:
+                await asyncio.to_thread(sincronizar)
+            except Exception as e:
+                print(f"Erro ao sincronizar caches entre workers: {e}")
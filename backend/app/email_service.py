@@ -1,96 +1,239 @@
+"""Envio de emails em segundo plano (outbox assíncrono).
+
+O cadastro apenas monta a mensagem e a coloca em uma fila limitada
+(`MAIL_QUEUE_SIZE`); a entrega acontece em uma task do event loop, sem afetar a
+latência da requisição. O worker mantém uma única conexão SMTP aberta (TLS e login
+uma vez só), envia as mensagens em lotes de até `MAIL_BATCH_SIZE` e fecha a
+conexão depois de `MAIL_SMTP_IDLE_SECONDS` sem mensagens. Se o servidor derrubar a
+conexão, ela é reaberta e o envio repetido; outras falhas temporárias voltam para
+a fila com backoff exponencial, até `MAIL_MAX_RETRIES` tentativas.
+
+Sem `SMTP_HOST` nem credenciais configurados, o envio é apenas simulado (print).
+"""
+import asyncio
 import os
-from email.mime.text import MIMEText
+from email.message import Message
 from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from html import escape
+from string import Template
+from typing import List, NamedTuple, Optional
+
 import aiosmtplib
-from typing import Optional
 
 # Configurações de email (variáveis de ambiente ou valores padrão para desenvolvimento)
 SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
 SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
 SMTP_USER = os.getenv("SMTP_USER", "")
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", "")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1") == "1"
 FROM_EMAIL = os.getenv("FROM_EMAIL", "noreply@desafiopositivo.com")
 FROM_NAME = os.getenv("FROM_NAME", "Desafio Positivo")
 
-async def send_welcome_email(to_email: str, name: str, profile_id: int) -> bool:
-    """
-    Envia email de boas-vindas após criação de conta.
-    
-    Para desenvolvimento local, apenas simula o envio (retorna True).
-    Para produção, configure as variáveis de ambiente SMTP.
-    """
-    
-    # Se não houver credenciais configuradas, apenas simula o envio
-    if not SMTP_USER or not SMTP_PASSWORD:
-        print(f"[EMAIL SIMULADO] Para: {to_email}")
-        print(f"Assunto: Bem-vindo ao Desafio Positivo, {name}!")
-        print(f"Conta criada com sucesso. ID: {profile_id}")
+MAIL_QUEUE_SIZE = int(os.getenv("MAIL_QUEUE_SIZE", 10000))
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", 50))
+MAIL_MAX_RETRIES = int(os.getenv("MAIL_MAX_RETRIES", 5))
+MAIL_RETRY_BASE_SECONDS = float(os.getenv("MAIL_RETRY_BASE_SECONDS", 2))
+MAIL_SMTP_IDLE_SECONDS = float(os.getenv("MAIL_SMTP_IDLE_SECONDS", 30))
+MAIL_SMTP_TIMEOUT = float(os.getenv("MAIL_SMTP_TIMEOUT", 30))
+MAIL_SHUTDOWN_TIMEOUT = float(os.getenv("MAIL_SHUTDOWN_TIMEOUT", 10))
+
+# um servidor local (ex.: aiosmtpd) pode ser usado sem credenciais definindo SMTP_HOST
+EMAIL_SIMULADO = not (SMTP_USER and SMTP_PASSWORD) and "SMTP_HOST" not in os.environ
+
+_ATRASO_MAXIMO = 300.0
+
+_TEMPLATE_BOAS_VINDAS = Template("""\
+<html>
+<body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
+    <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
+        <h2 style="color: #007bff;">Bem-vindo ao Desafio Positivo!</h2>
+        <p>Olá <strong>$name</strong>,</p>
+        <p>Sua conta foi criada com sucesso! Estamos felizes em tê-lo(a) conosco.</p>
+
+        <div style="background: #f5f5f5; padding: 15px; border-radius: 5px; margin: 20px 0;">
+            <p style="margin: 0;"><strong>ID da sua conta:</strong> $profile_id</p>
+            <p style="margin: 5px 0;"><strong>Email:</strong> $to_email</p>
+        </div>
+
+        <p>Agora você pode:</p>
+        <ul>
+            <li>Editar suas informações de perfil</li>
+            <li>Participar de comunidades ativas</li>
+            <li>Registrar seu progresso</li>
+            <li>Engajar em desafios positivos</li>
+        </ul>
+
+        <p style="margin-top: 30px;">
+            <a href="http://127.0.0.1:8080/perfil.html?id=$profile_id"
+               style="background: #007bff; color: white; padding: 12px 30px;
+                      text-decoration: none; border-radius: 4px; display: inline-block;">
+                Acessar Meu Perfil
+            </a>
+        </p>
+
+        <hr style="margin: 30px 0; border: none; border-top: 1px solid #ddd;">
+        <p style="font-size: 12px; color: #666;">
+            Este é um email automático. Por favor, não responda.
+        </p>
+    </div>
+</body>
+</html>
+""")
+
+# falhas de conexão: reabre a conexão e tenta de novo na hora
+_ERROS_DE_CONEXAO = (aiosmtplib.SMTPServerDisconnected, aiosmtplib.SMTPConnectError, ConnectionError)
+
+
+class _Envio(NamedTuple):
+    mensagem: Message
+    tentativas: int = 0
+
+
+def montar_boas_vindas(to_email: str, name: str, profile_id: int) -> Message:
+    message = MIMEMultipart("alternative")
+    message["Subject"] = f"Bem-vindo ao Desafio Positivo, {name}!"
+    message["From"] = f"{FROM_NAME} <{FROM_EMAIL}>"
+    message["To"] = to_email
+    html_content = _TEMPLATE_BOAS_VINDAS.substitute(
+        name=escape(name), to_email=escape(to_email), profile_id=profile_id
+    )
+    message.attach(MIMEText(html_content, "html"))
+    return message
+
+
+def _permanente(erro: Exception) -> bool:
+    """Erros 5xx do servidor (destinatário recusado, mensagem rejeitada) não são repetidos"""
+    if isinstance(erro, aiosmtplib.SMTPRecipientsRefused):
         return True
-    
-    try:
-        # Criar mensagem
-        message = MIMEMultipart("alternative")
-        message["Subject"] = f"Bem-vindo ao Desafio Positivo, {name}!"
-        message["From"] = f"{FROM_NAME} <{FROM_EMAIL}>"
-        message["To"] = to_email
-        
-        # Corpo do email em HTML
-        html_content = f"""
-        <html>
-        <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-            <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
-                <h2 style="color: #007bff;">Bem-vindo ao Desafio Positivo!</h2>
-                <p>Olá <strong>{name}</strong>,</p>
-                <p>Sua conta foi criada com sucesso! Estamos felizes em tê-lo(a) conosco.</p>
-                
-                <div style="background: #f5f5f5; padding: 15px; border-radius: 5px; margin: 20px 0;">
-                    <p style="margin: 0;"><strong>ID da sua conta:</strong> {profile_id}</p>
-                    <p style="margin: 5px 0;"><strong>Email:</strong> {to_email}</p>
-                </div>
-                
-                <p>Agora você pode:</p>
-                <ul>
-                    <li>Editar suas informações de perfil</li>
-                    <li>Participar de comunidades ativas</li>
-                    <li>Registrar seu progresso</li>
-                    <li>Engajar em desafios positivos</li>
-                </ul>
-                
-                <p style="margin-top: 30px;">
-                    <a href="http://127.0.0.1:8080/perfil.html?id={profile_id}" 
-                       style="background: #007bff; color: white; padding: 12px 30px; 
-                              text-decoration: none; border-radius: 4px; display: inline-block;">
-                        Acessar Meu Perfil
-                    </a>
-                </p>
-                
-                <hr style="margin: 30px 0; border: none; border-top: 1px solid #ddd;">
-                <p style="font-size: 12px; color: #666;">
-                    Este é um email automático. Por favor, não responda.
-                </p>
-            </div>
-        </body>
-        </html>
-        """
-        
-        # Anexar HTML
-        html_part = MIMEText(html_content, "html")
-        message.attach(html_part)
-        
-        # Enviar email
-        await aiosmtplib.send(
-            message,
-            hostname=SMTP_HOST,
-            port=SMTP_PORT,
-            start_tls=True,
-            username=SMTP_USER,
-            password=SMTP_PASSWORD,
-        )
-        
-        print(f"Email enviado com sucesso para {to_email}")
+    return isinstance(erro, aiosmtplib.SMTPResponseException) and 500 <= erro.code < 600
+
+
+class MailOutbox:
+    def __init__(self, maxsize: int = MAIL_QUEUE_SIZE, lote: int = MAIL_BATCH_SIZE):
+        self.lote = lote
+        self._fila: "asyncio.Queue[_Envio]" = asyncio.Queue(maxsize=maxsize)
+        self._smtp: Optional[aiosmtplib.SMTP] = None
+        self._retentativas: "set[asyncio.Task]" = set()
+        self.enviados = 0
+        self.falhas = 0
+        self.descartados = 0
+
+    def enfileirar(self, mensagem: Message) -> bool:
+        """Agenda o envio sem bloquear; False se a fila estiver cheia"""
+        try:
+            self._fila.put_nowait(_Envio(mensagem))
+        except asyncio.QueueFull:
+            self.descartados += 1
+            print(f"Fila de emails cheia; mensagem para {mensagem['To']} descartada")
+            return False
         return True
-        
-    except Exception as e:
-        print(f"Erro ao enviar email: {e}")
-        # Não falha a criação da conta se o email falhar
-        return False
+
+    async def _conectar(self) -> aiosmtplib.SMTP:
+        if self._smtp is None or not self._smtp.is_connected:
+            smtp = aiosmtplib.SMTP(
+                hostname=SMTP_HOST, port=SMTP_PORT, start_tls=SMTP_STARTTLS, timeout=MAIL_SMTP_TIMEOUT
+            )
+            await smtp.connect()
+            if SMTP_USER and SMTP_PASSWORD:
+                await smtp.login(SMTP_USER, SMTP_PASSWORD)
+            self._smtp = smtp
+        return self._smtp
+
+    async def _desconectar(self) -> None:
+        smtp, self._smtp = self._smtp, None
+        if smtp is not None and smtp.is_connected:
+            try:
+                await smtp.quit()
+            except Exception:
+                smtp.close()
+
+    async def _enviar(self, mensagem: Message) -> None:
+        if EMAIL_SIMULADO:
+            print(f"[EMAIL SIMULADO] Para: {mensagem['To']}")
+            print(f"Assunto: {mensagem['Subject']}")
+            return
+        try:
+            await (await self._conectar()).send_message(mensagem)
+        except _ERROS_DE_CONEXAO:
+            # conexão derrubada pelo servidor (ex.: ociosa): reabre uma vez
+            await self._desconectar()
+            await (await self._conectar()).send_message(mensagem)
+
+    async def _processar_lote(self, lote: List[_Envio]) -> None:
+        for envio in lote:
+            try:
+                await self._enviar(envio.mensagem)
+                self.enviados += 1
+            except Exception as e:
+                if not isinstance(e, (aiosmtplib.SMTPResponseException, aiosmtplib.SMTPRecipientsRefused)):
+                    # estado da conexão desconhecido: a próxima mensagem reconecta
+                    await self._desconectar()
+                self._reagendar(envio, e)
+            finally:
+                self._fila.task_done()
+
+    def _reagendar(self, envio: _Envio, erro: Exception) -> None:
+        tentativas = envio.tentativas + 1
+        if tentativas >= MAIL_MAX_RETRIES or _permanente(erro):
+            self.falhas += 1
+            print(f"Erro ao enviar email para {envio.mensagem['To']}: {erro}")
+            return
+        atraso = min(MAIL_RETRY_BASE_SECONDS * 2 ** envio.tentativas, _ATRASO_MAXIMO)
+        tarefa = asyncio.create_task(self._reenfileirar(envio._replace(tentativas=tentativas), atraso))
+        self._retentativas.add(tarefa)
+        tarefa.add_done_callback(self._retentativas.discard)
+
+    async def _reenfileirar(self, envio: _Envio, atraso: float) -> None:
+        await asyncio.sleep(atraso)
+        try:
+            self._fila.put_nowait(envio)
+        except asyncio.QueueFull:
+            self.falhas += 1
+            print(f"Fila de emails cheia; reenvio para {envio.mensagem['To']} descartado")
+
+    async def executar(self) -> None:
+        while True:
+            if self._smtp is None:
+                envio = await self._fila.get()
+            else:
+                try:
+                    envio = await asyncio.wait_for(self._fila.get(), MAIL_SMTP_IDLE_SECONDS)
+                except asyncio.TimeoutError:
+                    await self._desconectar()
+                    continue
+            lote = [envio]
+            while len(lote) < self.lote and not self._fila.empty():
+                lote.append(self._fila.get_nowait())
+            await self._processar_lote(lote)
+
+    async def esvaziar(self, timeout: float = MAIL_SHUTDOWN_TIMEOUT) -> None:
+        """Aguarda a fila esvaziar (até `timeout`) e fecha a conexão; usado no shutdown"""
+        try:
+            await asyncio.wait_for(self._fila.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"{self._fila.qsize()} emails pendentes não enviados no encerramento")
+        for tarefa in list(self._retentativas):
+            tarefa.cancel()
+        await self._desconectar()
+
+    def stats(self) -> dict:
+        return {
+            "pendentes": self._fila.qsize(),
+            "enviados": self.enviados,
+            "falhas": self.falhas,
+            "descartados": self.descartados,
+        }
+
+
+mail_outbox = MailOutbox()
+
+
+def send_welcome_email(to_email: str, name: str, profile_id: int) -> bool:
+    """
+    Agenda o email de boas-vindas após criação de conta.
+
+    Retorna imediatamente; a entrega (ou simulação, sem SMTP configurado) é feita
+    pelo `mail_outbox`. Falhas de envio não afetam a criação da conta.
+    """
+    return mail_outbox.enfileirar(montar_boas_vindas(to_email, name, profile_id))
@@ -0,0 +1,106 @@
+"""Registro de último acesso com escrita adiada (write-behind).
+
+Em vez de um UPDATE em `UserProfile.ultimo_acesso` a cada requisição autenticada,
+os acessos ficam em memória (um valor por usuário) e são gravados em um único
+UPDATE em lote a cada `LAST_SEEN_FLUSH_SECONDS` segundos, quando o buffer atinge
+`LAST_SEEN_FLUSH_SIZE` usuários, ou no desligamento da aplicação.
+"""
+import asyncio
+import os
+import threading
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import bindparam, update
+from .sqlite_writer import executar_escrita
+
+LAST_SEEN_FLUSH_SECONDS = int(os.getenv("LAST_SEEN_FLUSH_SECONDS", 30))
+LAST_SEEN_FLUSH_SIZE = int(os.getenv("LAST_SEEN_FLUSH_SIZE", 500))
+
+
+class LastSeenTracker:
+    def __init__(self, flush_size: int = LAST_SEEN_FLUSH_SIZE):
+        self.flush_size = flush_size
+        self._pendentes: Dict[int, datetime] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._pendentes)
+
+    def _marcar(self, user_id: int, quando: Optional[datetime]) -> bool:
+        """Guarda o acesso no buffer; retorna True se o buffer encheu"""
+        with self._lock:
+            self._pendentes[user_id] = quando or datetime.utcnow()
+            return len(self._pendentes) >= self.flush_size
+
+    def _flush_sem_esperar(self) -> None:
+        try:
+            self.flush(bloquear=False)
+        except Exception as e:
+            print(f"Erro ao gravar último acesso: {e}")
+
+    def registrar(self, user_id: int, quando: Optional[datetime] = None) -> None:
+        """Marca o acesso do usuário; dispara um flush se o buffer estiver cheio
+
+        O flush é síncrono (UPDATE no banco): no event loop, use `registrar_async`.
+        """
+        if self._marcar(user_id, quando):
+            self._flush_sem_esperar()
+
+    async def registrar_async(self, user_id: int, quando: Optional[datetime] = None) -> None:
+        """Versão de `registrar` para o event loop: o flush roda em uma thread"""
+        if self._marcar(user_id, quando):
+            await asyncio.to_thread(self._flush_sem_esperar)
+
+    def _mesclar(self, pendentes: Dict[int, datetime]) -> None:
+        with self._lock:
+            for user_id, quando in pendentes.items():
+                atual = self._pendentes.get(user_id)
+                if atual is None or atual < quando:
+                    self._pendentes[user_id] = quando
+
+    def flush(self, bloquear: bool = True) -> int:
+        """Grava os acessos pendentes em um único UPDATE em lote; retorna quantos foram gravados"""
+        if not self._flush_lock.acquire(blocking=bloquear):
+            return 0
+        try:
+            with self._lock:
+                pendentes, self._pendentes = self._pendentes, {}
+            if not pendentes:
+                return 0
+            from .models import UserProfile
+
+            tabela = UserProfile.__table__
+            stmt = (
+                update(tabela)
+                .where(tabela.c.id == bindparam("uid"))
+                .values(ultimo_acesso=bindparam("quando"))
+            )
+            try:
+                # executemany de um UPDATE Core: usuários removidos são simplesmente ignorados
+                executar_escrita(
+                    lambda session: session.execute(
+                        stmt, [{"uid": uid, "quando": quando} for uid, quando in pendentes.items()]
+                    )
+                )
+            except Exception:
+                # devolve ao buffer para a próxima tentativa
+                self._mesclar(pendentes)
+                raise
+            return len(pendentes)
+        finally:
+            self._flush_lock.release()
+
+
+last_seen = LastSeenTracker()
+
+
+async def flush_periodicamente(intervalo: int = LAST_SEEN_FLUSH_SECONDS) -> None:
+    """Loop de fundo que grava os acessos pendentes a cada `intervalo` segundos"""
+    while True:
+        await asyncio.sleep(intervalo)
+        try:
+            await asyncio.to_thread(last_seen.flush)
+        except Exception as e:
+            print(f"Erro ao gravar último acesso: {e}")
@@ -0,0 +1,171 @@
+"""Rankings por janela de tempo (dia/semana/mês) a partir de buckets pré-agregados.
+
+Cada concessão de XP confirmada soma o valor em dois buckets em memória do usuário:
+o da hora e o do dia (UTC). O top-N de uma janela qualquer é obtido somando os
+buckets que a cobrem, dias inteiros pelos buckets diários e as bordas pelos
+horários, sem varrer o `XPHistory`. Buckets horários são mantidos por
+`LEADERBOARD_HOURLY_RETENTION` horas e os diários por `LEADERBOARD_DAILY_RETENTION`
+dias; fora da retenção horária a borda da janela é arredondada para o dia inteiro.
+
+No startup os buckets são reconstruídos a partir do `XPHistory` recente. As
+concessões confirmadas são difundidas para os buckets dos outros workers.
+"""
+import os
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session as SASession
+from sqlmodel import Session, select
+
+from .cache_backend import ao_receber, difundir
+
+LEADERBOARD_HOURLY_RETENTION = int(os.getenv("LEADERBOARD_HOURLY_RETENTION", 48))
+LEADERBOARD_DAILY_RETENTION = int(os.getenv("LEADERBOARD_DAILY_RETENTION", 35))
+
+# janelas nomeadas, em horas até o momento atual
+PERIODOS = {"dia": 24, "semana": 7 * 24, "mes": 30 * 24}
+
+_SESSION_KEY = "leaderboard_pendentes"
+_EPOCH = datetime(1970, 1, 1)
+_HORA = timedelta(hours=1)
+
+
+def _hora(quando: datetime) -> int:
+    return (quando - _EPOCH) // _HORA
+
+
+class WindowedLeaderboard:
+    def __init__(
+        self,
+        retencao_horas: int = LEADERBOARD_HOURLY_RETENTION,
+        retencao_dias: int = LEADERBOARD_DAILY_RETENTION,
+    ):
+        self.retencao_horas = retencao_horas
+        self.retencao_dias = retencao_dias
+        self._horas: Dict[int, Counter] = {}
+        self._dias: Dict[int, Counter] = {}
+        self._memo: Dict[Tuple[int, int], List[Tuple[int, int]]] = {}
+        self._lock = threading.RLock()
+        self.pronto = False
+
+    def carregar(self, lancamentos: List[Tuple[int, int, datetime]], agora: Optional[datetime] = None) -> None:
+        """Substitui os buckets por lançamentos `(user_id, xp, quando)`"""
+        with self._lock:
+            self._horas.clear()
+            self._dias.clear()
+            self._memo.clear()
+            for user_id, xp, quando in lancamentos:
+                self._somar(user_id, xp, _hora(quando))
+            self._rotacionar(_hora(agora or datetime.utcnow()))
+            self.pronto = True
+
+    def registrar(self, user_id: int, xp: int, quando: Optional[datetime] = None) -> None:
+        if not xp:
+            return
+        with self._lock:
+            self._somar(user_id, xp, _hora(quando or datetime.utcnow()))
+            self._memo.clear()
+
+    def _somar(self, user_id: int, xp: int, hora: int) -> None:
+        self._horas.setdefault(hora, Counter())[user_id] += xp
+        self._dias.setdefault(hora // 24, Counter())[user_id] += xp
+
+    def _rotacionar(self, hora_atual: int) -> None:
+        limite_hora = hora_atual - self.retencao_horas
+        for hora in [h for h in self._horas if h <= limite_hora]:
+            del self._horas[hora]
+        limite_dia = hora_atual // 24 - self.retencao_dias
+        for dia in [d for d in self._dias if d <= limite_dia]:
+            del self._dias[dia]
+
+    def remover(self, user_id: int) -> None:
+        with self._lock:
+            for bucket in (*self._horas.values(), *self._dias.values()):
+                bucket.pop(user_id, None)
+            self._memo.clear()
+
+    def _somar_janela(self, inicio: int, fim: int, primeira_hora_retida: int) -> Counter:
+        """Soma os buckets que cobrem as horas `[inicio, fim)`"""
+        total: Counter = Counter()
+        hora = inicio
+        while hora < fim:
+            dia, deslocamento = divmod(hora, 24)
+            dia_inteiro = deslocamento == 0 and hora + 24 <= fim
+            if dia_inteiro or hora < primeira_hora_retida:
+                # dia inteiro na janela, ou hora já descartada: usa o bucket diário
+                total.update(self._dias.get(dia, {}))
+                hora = (dia + 1) * 24
+                continue
+            total.update(self._horas.get(hora, {}))
+            hora += 1
+        return total
+
+    def _ordenado(self, inicio: int, fim: int, hora_atual: int) -> List[Tuple[int, int]]:
+        chave = (inicio, fim)
+        ordenado = self._memo.get(chave)
+        if ordenado is None:
+            totais = self._somar_janela(inicio, fim, hora_atual - self.retencao_horas + 1)
+            ordenado = sorted(((uid, xp) for uid, xp in totais.items() if xp > 0), key=lambda p: (-p[1], p[0]))
+            if len(self._memo) >= 32:
+                self._memo.clear()
+            self._memo[chave] = ordenado
+        return ordenado
+
+    def top(self, inicio: datetime, fim: Optional[datetime] = None, n: int = 100) -> List[Tuple[int, int]]:
+        """Top-N `(user_id, xp)` da janela `[inicio, fim]`, por xp desc e id asc"""
+        hora_atual = _hora(datetime.utcnow())
+        hora_fim = _hora(fim) + 1 if fim else hora_atual + 1  # inclui a hora corrente
+        with self._lock:
+            self._rotacionar(hora_atual)
+            return self._ordenado(_hora(inicio), hora_fim, hora_atual)[:n]
+
+    def top_periodo(self, periodo: str, n: int = 100) -> List[Tuple[int, int]]:
+        """Top-N das últimas 24 horas, 7 dias ou 30 dias (`dia`, `semana`, `mes`)"""
+        agora = datetime.utcnow()
+        # a hora corrente conta inteira; o início alinha para fechar exatamente N horas
+        return self.top(agora - timedelta(hours=PERIODOS[periodo] - 1), agora, n)
+
+
+leaderboard = WindowedLeaderboard()
+
+
+def registrar_xp(session: Session, user_id: int, xp: int) -> None:
+    """Agenda a soma do XP nos buckets para quando a transação for confirmada"""
+    if not xp:
+        return
+    session.info.setdefault(_SESSION_KEY, []).append((user_id, xp, datetime.utcnow()))
+
+
+@event.listens_for(SASession, "after_commit")
+def _aplicar_pendentes(session) -> None:
+    pendentes = session.info.pop(_SESSION_KEY, ())
+    for user_id, xp, quando in pendentes:
+        leaderboard.registrar(user_id, xp, quando)
+    difundir("leaderboard_xp", [(user_id, xp, quando.isoformat()) for user_id, xp, quando in pendentes])
+
+
+@ao_receber("leaderboard_xp")
+def _registrar_de_outro_worker(user_id: int, xp: int, quando: str) -> None:
+    leaderboard.registrar(user_id, xp, datetime.fromisoformat(quando))
+
+
+@event.listens_for(SASession, "after_rollback")
+def _descartar_pendentes(session) -> None:
+    session.info.pop(_SESSION_KEY, None)
+
+
+def reconstruir_leaderboard(session: Session) -> None:
+    """Recarrega os buckets a partir do XPHistory dentro da retenção diária"""
+    from .models import XPHistory
+
+    agora = datetime.utcnow()
+    inicio = datetime.combine(agora.date(), datetime.min.time()) - timedelta(days=leaderboard.retencao_dias)
+    stmt = (
+        select(XPHistory.user_id, XPHistory.xp_amount, XPHistory.created_at)
+        .where(XPHistory.created_at >= inicio, XPHistory.xp_amount != 0)
+        .execution_options(yield_per=1000)
+    )
+    leaderboard.carregar(session.exec(stmt), agora)
@@ -0,0 +1,214 @@
+"""Concessão atômica de pontos.
+
+Cada concessão é um único `UPDATE ... SET pontos = pontos + :n ... RETURNING`,
+com o nível calculado no próprio SQL e a linha de `XPHistory` inserida na mesma
+transação. Não há leitura antes da escrita, então concessões concorrentes para o
+mesmo usuário não se perdem. O chamador confirma a transação com `session.commit()`;
+ranking e estatísticas globais são atualizados somente após o commit.
+"""
+from datetime import datetime
+from typing import List, NamedTuple, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import func, literal, select, update
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from .database import insert_ignore
+from .leaderboard import registrar_xp
+from .models import Event, EventAttendance, UserProfile, XPHistory
+from .ranking import registrar_pontos
+from .realtime import registrar_mudanca
+from .stats import registrar_delta
+
+# A cada 100 pontos, sobe um nível (mesma regra de UserProfile.adicionar_pontos)
+PONTOS_POR_NIVEL = 100
+
+
+class Saldo(NamedTuple):
+    pontos: int
+    xp_total: int
+    nivel: int
+    tempo_sem_tela_minutos: int
+    desafios_completados: int
+
+
+# na ordem dos campos de `Saldo`
+_COLUNAS_SALDO = (
+    UserProfile.pontos,
+    UserProfile.xp_total,
+    UserProfile.nivel,
+    UserProfile.tempo_sem_tela_minutos,
+    UserProfile.desafios_completados,
+)
+
+
+def _stmt_incremento(user_id: int, pontos: int, minutos: int, desafios: int):
+    valores = {
+        "tempo_sem_tela_minutos": UserProfile.tempo_sem_tela_minutos + minutos,
+        "updated_at": datetime.utcnow(),
+    }
+    # só tempo (menos de uma hora sem tela): pontos e nível ficam fora do UPDATE
+    if pontos or desafios:
+        valores.update(
+            pontos=UserProfile.pontos + pontos,
+            xp_total=UserProfile.xp_total + pontos,
+            nivel=(UserProfile.pontos + pontos) // PONTOS_POR_NIVEL + 1,
+            desafios_completados=UserProfile.desafios_completados + desafios,
+        )
+    return (
+        update(UserProfile)
+        .where(UserProfile.id == user_id)
+        .values(**valores)
+        .returning(*_COLUNAS_SALDO)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _registrar_incremento(session: Session, user_id: int, row, pontos: int, minutos: int, desafios: int) -> Saldo:
+    if row is None:
+        raise HTTPException(status_code=404, detail="Usuário não encontrado")
+    saldo = Saldo(*row)
+    registrar_delta(session, pontos=pontos, tempo_sem_tela_minutos=minutos, desafios_completados=desafios)
+    if pontos:
+        registrar_pontos(session, user_id, saldo.pontos)
+        registrar_xp(session, user_id, pontos)
+        registrar_mudanca(session, user_id, saldo.pontos, saldo.nivel)
+    return saldo
+
+
+def _incrementar(session: Session, user_id: int, pontos: int, minutos: int = 0, desafios: int = 0) -> Saldo:
+    row = session.execute(_stmt_incremento(user_id, pontos, minutos, desafios)).one_or_none()
+    return _registrar_incremento(session, user_id, row, pontos, minutos, desafios)
+
+
+def registrar_tempo(session: Session, user_id: int, minutos: int) -> Saldo:
+    """Soma tempo sem tela sem conceder pontos: sem linha no XPHistory nem mudança no ranking"""
+    return _incrementar(session, user_id, 0, minutos=minutos)
+
+
+async def registrar_tempo_async(session: AsyncSession, user_id: int, minutos: int) -> Saldo:
+    """Versão de `registrar_tempo` para `AsyncSession`"""
+    row = (await session.execute(_stmt_incremento(user_id, 0, minutos, 0))).one_or_none()
+    return _registrar_incremento(session.sync_session, user_id, row, 0, minutos, 0)
+
+
+def conceder_pontos(
+    session: Session,
+    user_id: int,
+    pontos: int,
+    tipo: str,
+    event_id: Optional[int] = None,
+    minutos: int = 0,
+    desafios: int = 0,
+    metadata: Optional[dict] = None,
+) -> Saldo:
+    """Soma pontos (e contadores opcionais) ao usuário e registra o histórico de XP"""
+    saldo = _incrementar(session, user_id, pontos, minutos, desafios)
+    session.add(XPHistory(user_id=user_id, event_id=event_id, type=tipo, xp_amount=pontos, xp_metadata=metadata))
+    return saldo
+
+
+async def conceder_pontos_async(
+    session: AsyncSession,
+    user_id: int,
+    pontos: int,
+    tipo: str,
+    event_id: Optional[int] = None,
+    minutos: int = 0,
+    desafios: int = 0,
+    metadata: Optional[dict] = None,
+) -> Saldo:
+    """Versão de `conceder_pontos` para `AsyncSession`"""
+    row = (await session.execute(_stmt_incremento(user_id, pontos, minutos, desafios))).one_or_none()
+    # os hooks de commit (ranking/estatísticas) ficam na sessão síncrona subjacente
+    saldo = _registrar_incremento(session.sync_session, user_id, row, pontos, minutos, desafios)
+    session.add(XPHistory(user_id=user_id, event_id=event_id, type=tipo, xp_amount=pontos, xp_metadata=metadata))
+    return saldo
+
+
+class Presenca(NamedTuple):
+    xp: int
+    saldo: Saldo
+
+
+def _stmt_presenca(user_id: int, event_id: int):
+    # INSERT ... SELECT: o xp_reward vem do próprio evento, sem leitura prévia; se o
+    # evento não existe, nada é inserido; se a presença já existe, o conflito é ignorado
+    origem = select(
+        Event.id,
+        literal(user_id),
+        func.coalesce(Event.xp_reward, 0),
+        literal(datetime.utcnow()),
+    ).where(Event.id == event_id)
+    return (
+        insert_ignore(EventAttendance)
+        .from_select(["event_id", "user_id", "xp_awarded", "created_at"], origem)
+        .returning(EventAttendance.xp_awarded)
+    )
+
+
+def registrar_presenca(session: Session, user_id: int, event_id: int) -> Optional[Presenca]:
+    """Registra a presença no evento e concede o XP uma única vez
+
+    Retorna None se a presença já estava registrada ou se o evento não existe.
+    """
+    xp = session.execute(_stmt_presenca(user_id, event_id)).scalar_one_or_none()
+    if xp is None:
+        return None
+    return Presenca(xp, conceder_pontos(session, user_id, xp, "event", event_id=event_id))
+
+
+async def registrar_presenca_async(session: AsyncSession, user_id: int, event_id: int) -> Optional[Presenca]:
+    """Versão de `registrar_presenca` para `AsyncSession`"""
+    xp = (await session.execute(_stmt_presenca(user_id, event_id))).scalar_one_or_none()
+    if xp is None:
+        return None
+    return Presenca(xp, await conceder_pontos_async(session, user_id, xp, "event", event_id=event_id))
+
+
+class Lancamento(NamedTuple):
+    idempotency_key: str
+    tipo: str
+    pontos: int
+    minutos: int = 0
+    desafios: int = 0
+    metadata: Optional[dict] = None
+
+
+def conceder_lote(session: Session, user_id: int, lancamentos: List[Lancamento]) -> Tuple[Optional[Saldo], List[str]]:
+    """Aplica vários lançamentos idempotentes com um INSERT multi-linha e um único UPDATE
+
+    Lançamentos cuja `idempotency_key` já foi aplicada para o usuário são ignorados
+    pelo `ON CONFLICT DO NOTHING`. Retorna o saldo final (None se nada foi aplicado)
+    e as chaves efetivamente aplicadas.
+    """
+    if not lancamentos:
+        return None, []
+    agora = datetime.utcnow()
+    por_chave = {l.idempotency_key: l for l in lancamentos}
+    aplicadas = session.execute(
+        insert_ignore(XPHistory).returning(XPHistory.idempotency_key),
+        [
+            {
+                "user_id": user_id,
+                "type": l.tipo,
+                "xp_amount": l.pontos,
+                "xp_metadata": l.metadata,
+                "idempotency_key": l.idempotency_key,
+                "created_at": agora,
+            }
+            for l in por_chave.values()
+        ],
+    ).scalars().all()
+    if not aplicadas:
+        return None, []
+    novos = [por_chave[chave] for chave in aplicadas]
+    saldo = _incrementar(
+        session,
+        user_id,
+        sum(l.pontos for l in novos),
+        minutos=sum(l.minutos for l in novos),
+        desafios=sum(l.desafios for l in novos),
+    )
+    return saldo, list(aplicadas)
@@ -1,19 +1,40 @@
-from fastapi import FastAPI, Depends, HTTPException, Request
+from fastapi import FastAPI, Depends, HTTPException, Request, Query
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import HTMLResponse
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from pathlib import Path
 from sqlmodel import select, Session
-from typing import List
+from typing import List, Literal
 from datetime import datetime
+import asyncio
+import hmac
 import os
-
-from .database import init_db, get_session
-from .models import UserProfile, UserPublic, UserCreate, UserLogin, Token
-from .email_service import send_welcome_email
-from .auth import hash_password, verify_password, create_access_token, get_current_user, user_to_public, SECRET_KEY, decode_token
-from .routers import communities, events, users
+import time
+
+from .database import init_db, get_session, engine, async_engine, pool_metrics, SQLITE_PERFORMANCE_MODE
+from .models import UserProfile, UserPublic, UserCreate, UserLogin, Token, RankingPosition, RewardSync, LeaderboardEntry
+from .ranking import reconstruir_ranking, obter_ranking, posicao_no_ranking, rankings_comunidade, TOP_RANKING
+from .leaderboard import leaderboard, reconstruir_leaderboard
+from .pagination import NEXT_CURSOR_HEADER
+from .sqlite_writer import writer, executar_escrita
+from .ledger import conceder_lote, Lancamento, Saldo
+from .rewards import concessao_desafio, concessao_tempo, conceder, pontos_por_tempo, resposta_desafio, resposta_tempo
+from .stats import reconciliar, obter_stats, reconciliar_periodicamente
+from .last_seen import last_seen, flush_periodicamente
+from .passwords import password_hasher
+from .realtime import broker, eventos
+from .response_cache import response_cache
+from .serialization import linha_para_dict, linha_publica, linhas_para_json, linhas_publicas_por_ids, resposta_json, resposta_perfil
+from .email_service import mail_outbox
+from .cache_backend import cache_backend, ao_perder_mensagens, sincronizar, sincronizar_periodicamente
+from .metrics import METRICS_ENABLED, METRICS_TOKEN, ROTA_DESCONHECIDA, SERVER_TIMING, encerrar_requisicao, iniciar_requisicao, registro, server_timing
+from .token_cache import token_cache
+from . import sql_profiler
+from .auth import hash_password, verify_password, create_access_token, get_current_user, user_to_public, SECRET_KEY, authenticate_request
+from .auth import STREAM_TOKEN_EXPIRE_SECONDS, create_stream_token
+from .routers import async_routes, communities, events, users
 
 # Ocultar documentação OpenAPI/Swagger em ambientes públicos
 app = FastAPI(title="Pense Offline Backend", version="0.2.0", docs_url=None, redoc_url=None, openapi_url=None)
@@ -27,6 +48,16 @@ async def strip_api_prefix(request: Request, call_next):
         request.scope["path"] = path[4:]  # Remove "/api"
     return await call_next(request)
 
+async def sincronizar_caches(request: Request, call_next):
+    """Aplica as mudanças publicadas pelos outros workers antes de atender"""
+    if cache_backend.novidades():
+        await run_in_threadpool(sincronizar)
+    return await call_next(request)
+
+# com um único processo (backend `memory`) não há o que sincronizar
+if cache_backend.compartilhado:
+    app.middleware("http")(sincronizar_caches)
+
 # Configurar CORS para permitir requisições do frontend
 app.add_middleware(
     CORSMiddleware,
@@ -42,6 +73,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag", "Server-Timing"],
 )
 
 # Caminho da pasta web-files (CSS, imagens) fora do backend
@@ -55,9 +87,55 @@ _templates_dir = Path(__file__).parent / "templates"
 @app.on_event("startup")
 def on_startup():
     init_db()
+    if SQLITE_PERFORMANCE_MODE:
+        writer.iniciar()
+    with Session(engine) as session:
+        reconstruir_ranking(session)
+        reconstruir_leaderboard(session)
+        reconciliar(session)
+
+
+@ao_perder_mensagens
+def recarregar_caches():
+    """Outro worker publicou mais mudanças do que o log guarda: recarrega do banco"""
+    rankings_comunidade.limpar()
+    with Session(engine) as session:
+        reconstruir_ranking(session)
+        reconstruir_leaderboard(session)
+        reconciliar(session)
+
+
+_background_tasks: List[asyncio.Task] = []
+
+
+@app.on_event("startup")
+async def start_background_tasks():
+    _background_tasks.append(asyncio.create_task(reconciliar_periodicamente()))
+    _background_tasks.append(asyncio.create_task(flush_periodicamente()))
+    _background_tasks.append(asyncio.create_task(broker.executar()))
+    _background_tasks.append(asyncio.create_task(mail_outbox.executar()))
+    _background_tasks.append(asyncio.create_task(sincronizar_periodicamente()))
+
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    # entrega os emails pendentes antes de parar o worker
+    await mail_outbox.esvaziar()
+    for task in _background_tasks:
+        task.cancel()
+    _background_tasks.clear()
+    await asyncio.to_thread(last_seen.flush)
+    await asyncio.to_thread(writer.parar)
+    password_hasher.shutdown()
+    if async_engine is not None:
+        await async_engine.dispose()
 
 
 # Include routers
+# As variantes assíncronas vêm primeiro: com o engine assíncrono disponível, elas
+# têm precedência sobre as rotas síncronas de mesmo caminho declaradas abaixo.
+if async_engine is not None:
+    app.include_router(async_routes.router)
 app.include_router(users.router)
 app.include_router(communities.router)
 app.include_router(events.router)
@@ -66,6 +144,8 @@ app.include_router(events.router)
 # Tornar a API inacessível sem token: middleware que valida presença e validade do token
 # Permitimos acesso público somente a algumas rotas (root, health, login/register) e a arquivos estáticos.
 PUBLIC_PATHS = ["/", "/health", "/auth/login", "/auth/register", "/users/login", "/users/register"]
+# /metrics não aceita o JWT dos usuários: exige o próprio token (METRICS_TOKEN), conferido na rota
+METRICS_PATH = "/metrics"
 
 
 @app.middleware("http")
@@ -74,26 +154,138 @@ async def require_auth_for_api(request: Request, call_next):
     # permitir arquivos estáticos e rotas públicas
     if path.startswith("/static") or any(path == p or path.startswith(p + "/") for p in PUBLIC_PATHS):
         return await call_next(request)
+    if path == METRICS_PATH:
+        return await call_next(request)
 
-    auth_header = request.headers.get("authorization") or request.headers.get("Authorization")
-    if not auth_header:
-        return JSONResponse({"detail": "Authorization required"}, status_code=401)
-
-    # extrair token e validar
+    # validar o token uma única vez; o payload fica em request.state para as rotas
     try:
-        token = auth_header.split(" ")[1] if " " in auth_header else auth_header
-        decode_token(token)
-    except Exception:
-        return JSONResponse({"detail": "Invalid or expired token"}, status_code=401)
+        authenticate_request(request)
+    except HTTPException as e:
+        return JSONResponse({"detail": e.detail}, status_code=e.status_code, headers=e.headers)
 
     return await call_next(request)
 
 
+# Registrado por último para ser o middleware mais externo: o tempo inclui a autenticação
+@app.middleware("http")
+async def medir_requisicao(request: Request, call_next):
+    if not METRICS_ENABLED:
+        return await call_next(request)
+    metricas, token = iniciar_requisicao()
+    registro.em_andamento += 1
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+    finally:
+        duracao = time.perf_counter() - metricas.inicio
+        registro.em_andamento -= 1
+        encerrar_requisicao(token)
+        rota = request.scope.get("route")
+        registro.observar(
+            request.method, rota.path if rota is not None else ROTA_DESCONHECIDA, status_code, duracao, metricas
+        )
+    if SERVER_TIMING:
+        response.headers["Server-Timing"] = server_timing(duracao, metricas)
+        response.headers["Timing-Allow-Origin"] = "*"
+    return response
+
+
+async def perfilar_sql(request: Request, call_next):
+    """Modo de desenvolvimento (`SQL_PROFILE=1`): relatório das consultas da requisição"""
+    perfil, token = sql_profiler.iniciar_requisicao(request.method, request.url.path)
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+    finally:
+        sql_profiler.encerrar_requisicao(token)
+        rota = request.scope.get("route")
+        try:
+            # os EXPLAIN das consultas lentas rodam fora do contexto da requisição
+            await run_in_threadpool(
+                sql_profiler.registrar, perfil, rota.path if rota is not None else ROTA_DESCONHECIDA, status_code, engine
+            )
+        except Exception as e:
+            print(f"Erro ao gravar o perfil SQL: {e}")
+    return response
+
+
+if sql_profiler.SQL_PROFILE:
+    app.middleware("http")(perfilar_sql)
+
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
 
+@app.get("/stream")
+async def stream(request: Request):
+    """Server-Sent Events com a pontuação do usuário e mudanças no top do ranking
+
+    O EventSource não envia headers; o token pode ir em `?token=`, mas só o token
+    curto de `POST /stream/token`, nunca o token do login.
+    """
+    def carregar_usuario() -> UserProfile:
+        # sessão curta: a conexão não deve ficar presa ao pool durante o stream
+        with Session(engine) as session:
+            return get_current_user(request, session)
+
+    user = await run_in_threadpool(carregar_usuario)
+    return StreamingResponse(
+        eventos(broker.assinar(user.id)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/stream/token")
+def stream_token(current_user: UserProfile = Depends(get_current_user)):
+    """Emite o token curto para abrir o /stream (vale só nessa rota)"""
+    return {"token": create_stream_token(current_user.username), "expires_in": STREAM_TOKEN_EXPIRE_SECONDS}
+
+
+@app.get("/health/db")
+def health_db():
+    """Métricas do pool de conexões com o banco"""
+    return pool_metrics()
+
+
+@app.get(METRICS_PATH, response_class=PlainTextResponse)
+def metrics(request: Request):
+    """Métricas no formato de exposição do Prometheus
+
+    Exige `Authorization: Bearer <METRICS_TOKEN>`; sem `METRICS_TOKEN` configurado a
+    rota fica desativada (404).
+    """
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    enviado = request.headers.get("authorization", "").removeprefix("Bearer ").strip()
+    if not hmac.compare_digest(enviado.encode(), METRICS_TOKEN.encode()):
+        raise HTTPException(
+            status_code=401, detail="Token de métricas inválido", headers={"WWW-Authenticate": "Bearer"}
+        )
+    pool = pool_metrics()
+    cache = response_cache.stats()
+    tokens = token_cache.stats()
+    mail = mail_outbox.stats()
+    extras = [
+        ("db_pool_checkouts_total", "counter", "Conexões retiradas do pool", pool["checkouts"]),
+        ("db_pool_wait_seconds_total", "counter", "Tempo total aguardando conexão do pool", pool["wait_seconds_total"]),
+        ("db_pool_checked_out", "gauge", "Conexões em uso", pool.get("checked_out", 0)),
+        ("response_cache_hits_total", "counter", "Acertos do cache de respostas", cache["hits"]),
+        ("response_cache_misses_total", "counter", "Faltas do cache de respostas", cache["misses"]),
+        ("token_cache_hits_total", "counter", "Acertos do cache de tokens", tokens["hits"]),
+        ("token_cache_misses_total", "counter", "Faltas do cache de tokens", tokens["misses"]),
+        ("sse_connections", "gauge", "Conexões abertas em /stream", broker.conexoes()),
+        ("mail_queue_pending", "gauge", "Emails aguardando envio", mail["pendentes"]),
+        ("mail_sent_total", "counter", "Emails enviados", mail["enviados"]),
+        ("mail_failed_total", "counter", "Emails que falharam após as novas tentativas", mail["falhas"]),
+    ]
+    return PlainTextResponse(registro.exportar(extras), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.get("/", response_class=HTMLResponse)
 def root():
     index_file = _templates_dir / "index.html"
@@ -110,34 +302,68 @@ def root():
 @app.get("/profiles/ranking", response_model=List[UserPublic])
 def get_ranking(session: Session = Depends(get_session), current_user: UserProfile = Depends(get_current_user)):
     """Retorna ranking de usuários por pontos"""
-    users = session.exec(
-        select(UserProfile).order_by(UserProfile.pontos.desc()).limit(100)
-    ).all()
-    return [user_to_public(u) for u in users]
+    ids = [user_id for user_id, _ in obter_ranking(session).top(TOP_RANKING)]
+    return resposta_json(linhas_para_json(linhas_publicas_por_ids(session, ids)))
+
+
+@app.get("/profiles/ranking/me", response_model=RankingPosition)
+def get_my_ranking(
+    raio: int = Query(5, ge=0, le=50),
+    session: Session = Depends(get_session),
+    current_user: UserProfile = Depends(get_current_user)
+):
+    """Retorna a posição do usuário autenticado e os vizinhos ao redor dele"""
+    return _posicao_no_ranking(session, current_user.id, raio)
+
+
+@app.get("/profiles/ranking/{periodo}", response_model=List[LeaderboardEntry])
+def get_ranking_periodo(
+    periodo: Literal["dia", "semana", "mes"],
+    limit: int = Query(100, ge=1, le=100),
+    session: Session = Depends(get_session),
+    current_user: UserProfile = Depends(get_current_user)
+):
+    """Ranking por XP ganho nas últimas 24 horas, 7 dias ou 30 dias"""
+    if not leaderboard.pronto:
+        reconstruir_leaderboard(session)
+    pares = leaderboard.top_periodo(periodo, limit)
+    perfis = {linha[0]: linha for linha in linhas_publicas_por_ids(session, [uid for uid, _ in pares])}
+    return [
+        LeaderboardEntry(posicao=pos, xp_periodo=xp, **linha_para_dict(perfis[uid]))
+        for pos, (uid, xp) in enumerate(pares, start=1) if uid in perfis
+    ]
+
+
+@app.get("/profiles/{profile_id}/posicao", response_model=RankingPosition)
+def get_profile_ranking(
+    profile_id: int,
+    raio: int = Query(0, ge=0, le=50),
+    session: Session = Depends(get_session),
+    current_user: UserProfile = Depends(get_current_user)
+):
+    """Retorna a posição de um usuário no ranking"""
+    return _posicao_no_ranking(session, profile_id, raio)
+
+
+def _posicao_no_ranking(session: Session, user_id: int, raio: int) -> RankingPosition:
+    resultado = posicao_no_ranking(session, obter_ranking(session), user_id, raio)
+    if resultado is None:
+        raise HTTPException(status_code=404, detail="Perfil não encontrado")
+    return resultado
 
 
 @app.get("/profiles/{profile_id}", response_model=UserPublic)
 def get_profile(profile_id: int, session: Session = Depends(get_session), current_user: UserProfile = Depends(get_current_user)):
     """Retorna perfil público de um usuário"""
-    profile = session.get(UserProfile, profile_id)
-    if not profile:
-        raise HTTPException(status_code=404, detail="Perfil não encontrado")
-    return user_to_public(profile)
+    return resposta_perfil(linha_publica(session, profile_id))
 
 
 @app.put("/profiles/me", response_model=UserPublic)
 def update_my_profile(data: dict, current_user: UserProfile = Depends(get_current_user), session: Session = Depends(get_session)):
     """Atualiza perfil do usuário autenticado"""
     allowed_fields = ["name", "email", "phone"]
-    for field in allowed_fields:
-        if field in data and data[field] is not None:
-            setattr(current_user, field, data[field])
-    
-    current_user.touch()
-    session.add(current_user)
-    session.commit()
-    session.refresh(current_user)
-    return user_to_public(current_user)
+    campos = {field: data[field] for field in allowed_fields if data.get(field) is not None}
+    return users.atualizar_dados(session, current_user.id, campos)
 
 
 # ===== RECOMPENSAS =====
@@ -149,24 +375,8 @@ def add_screen_free_time(
     session: Session = Depends(get_session)
 ):
     """Adiciona tempo sem tela e concede pontos (10 pontos por hora)"""
-    minutos = data.get("minutos", 0)
-    if minutos <= 0:
-        raise HTTPException(status_code=400, detail="Minutos deve ser maior que zero")
-    
-    current_user.tempo_sem_tela_minutos += minutos
-    pontos_ganhos = (minutos // 60) * 10  # 10 pontos por hora completa
-    current_user.adicionar_pontos(pontos_ganhos)
-    
-    session.add(current_user)
-    session.commit()
-    session.refresh(current_user)
-    
-    return {
-        "message": f"Você adicionou {minutos} minutos sem tela!",
-        "pontos_ganhos": pontos_ganhos,
-        "pontos_totais": current_user.pontos,
-        "nivel": current_user.nivel
-    }
+    concessao = concessao_tempo(data)
+    return resposta_tempo(concessao, conceder(session, current_user.id, concessao))
 
 
 @app.post("/rewards/complete-challenge")
@@ -176,25 +386,65 @@ def complete_challenge(
     session: Session = Depends(get_session)
 ):
     """Marca desafio como completo e concede pontos"""
-    pontos = data.get("pontos", 0)
-    nome_desafio = data.get("nome_desafio", "Desafio")
-    
-    if pontos <= 0:
-        raise HTTPException(status_code=400, detail="Pontos deve ser maior que zero")
-    
-    current_user.desafios_completados += 1
-    current_user.adicionar_pontos(pontos)
-    
-    session.add(current_user)
-    session.commit()
-    session.refresh(current_user)
-    
+    concessao = concessao_desafio(data)
+    return resposta_desafio(concessao, conceder(session, current_user.id, concessao))
+
+
+MAX_ENTRADAS_SYNC = 500
+
+
+@app.post("/rewards/sync")
+def sync_rewards(
+    data: RewardSync,
+    current_user: UserProfile = Depends(get_current_user),
+    session: Session = Depends(get_session)
+):
+    """Aplica em lote sessões sem tela e desafios registrados offline (idempotente por chave)"""
+    if len(data.entradas) > MAX_ENTRADAS_SYNC:
+        raise HTTPException(status_code=400, detail=f"Máximo de {MAX_ENTRADAS_SYNC} entradas por sincronização")
+
+    lancamentos = []
+    for i, entrada in enumerate(data.entradas):
+        metadata = {"registrado_em": entrada.registrado_em.isoformat()} if entrada.registrado_em else {}
+        if entrada.tipo == "tempo":
+            if entrada.minutos <= 0:
+                raise HTTPException(status_code=400, detail=f"Entrada {i}: minutos deve ser maior que zero")
+            metadata["minutos"] = entrada.minutos
+            # com 0 pontos a linha do XPHistory fica só como recibo da chave de
+            # idempotência: não entra no histórico nem nos rankings por período
+            lancamentos.append(Lancamento(
+                entrada.idempotency_key, "tempo_sem_tela", pontos_por_tempo(entrada.minutos),
+                minutos=entrada.minutos, metadata=metadata
+            ))
+        elif entrada.tipo == "desafio":
+            if entrada.pontos <= 0:
+                raise HTTPException(status_code=400, detail=f"Entrada {i}: pontos deve ser maior que zero")
+            metadata["nome_desafio"] = entrada.nome_desafio or "Desafio"
+            lancamentos.append(Lancamento(
+                entrada.idempotency_key, "desafio", entrada.pontos,
+                desafios=1, metadata=metadata
+            ))
+        else:
+            raise HTTPException(status_code=400, detail=f"Entrada {i}: tipo deve ser 'tempo' ou 'desafio'")
+
+    saldo, aplicadas = executar_escrita(lambda s: conceder_lote(s, current_user.id, lancamentos), session)
+    if saldo is None:
+        # tudo já havia sido sincronizado antes
+        saldo = Saldo(
+            current_user.pontos, current_user.xp_total, current_user.nivel,
+            current_user.tempo_sem_tela_minutos, current_user.desafios_completados
+        )
+
+    # como em `conceder_lote`, uma chave repetida no lote vale pela última entrada
+    por_chave = {l.idempotency_key: l for l in lancamentos}
     return {
-        "message": f"Desafio '{nome_desafio}' completado!",
-        "pontos_ganhos": pontos,
-        "pontos_totais": current_user.pontos,
-        "nivel": current_user.nivel,
-        "desafios_completados": current_user.desafios_completados
+        "aplicadas": len(aplicadas),
+        "ignoradas": len(data.entradas) - len(aplicadas),
+        "pontos_ganhos": sum(por_chave[chave].pontos for chave in aplicadas),
+        "pontos_totais": saldo.pontos,
+        "nivel": saldo.nivel,
+        "tempo_sem_tela_minutos": saldo.tempo_sem_tela_minutos,
+        "desafios_completados": saldo.desafios_completados
     }
 
 
@@ -202,20 +452,15 @@ def complete_challenge(
 
 @app.get("/stats/global")
 def get_global_stats(session: Session = Depends(get_session)):
-    """Retorna estatísticas globais da plataforma"""
-    total_users = session.exec(select(UserProfile)).all()
-    
-    if not total_users:
-        return {
-            "total_usuarios": 0,
-            "total_pontos": 0,
-            "total_tempo_sem_tela_horas": 0,
-            "total_desafios": 0
-        }
-    
+    """Retorna estatísticas globais da plataforma
+
+    Fora do cache de respostas: os totais já ficam em memória (ver stats.py) e
+    mudam a cada concessão de pontos, então o cache quase nunca acertaria.
+    """
+    totais = obter_stats(session)
     return {
-        "total_usuarios": len(total_users),
-        "total_pontos": sum(u.pontos for u in total_users),
-        "total_tempo_sem_tela_horas": sum(u.tempo_sem_tela_minutos for u in total_users) // 60,
-        "total_desafios": sum(u.desafios_completados for u in total_users)
+        "total_usuarios": totais["usuarios"],
+        "total_pontos": totais["pontos"],
+        "total_tempo_sem_tela_horas": totais["tempo_sem_tela_minutos"] // 60,
+        "total_desafios": totais["desafios_completados"]
     }
@@ -0,0 +1,184 @@
+"""Instrumentação das requisições: latência por rota, consultas ao banco e autenticação.
+
+Um middleware abre um `MetricasRequisicao` em uma `ContextVar` para cada
+requisição. Os eventos `before/after_cursor_execute` dos engines (registrados em
+`database.py`) somam quantidade e tempo das consultas, e a autenticação soma o
+próprio tempo com `medir_auth`. A `ContextVar` acompanha a requisição no threadpool,
+nas tasks e na thread escritora do SQLite.
+
+Ao final, os valores entram nos histogramas por rota (o template, ex.
+`/profiles/{profile_id}`, e não o caminho real) expostos em formato Prometheus em
+`GET /metrics`, e voltam ao cliente no header `Server-Timing`. Os números são por
+processo: com vários workers, cada scrape vê o worker que atendeu.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, List, Optional, Tuple
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+SERVER_TIMING = os.getenv("SERVER_TIMING", "1") == "1"
+
+# limites (segundos) no padrão dos clientes Prometheus
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_CONSULTAS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+ROTA_DESCONHECIDA = "sem_rota"
+
+
+class MetricasRequisicao:
+    __slots__ = ("inicio", "db_consultas", "db_segundos", "auth_segundos", "_auth_profundidade")
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.db_consultas = 0
+        self.db_segundos = 0.0
+        self.auth_segundos = 0.0
+        self._auth_profundidade = 0
+
+
+_atual: ContextVar[Optional[MetricasRequisicao]] = ContextVar("metricas_requisicao", default=None)
+
+
+def iniciar_requisicao():
+    """Abre as métricas da requisição; devolve (métricas, token para `encerrar_requisicao`)"""
+    metricas = MetricasRequisicao()
+    return metricas, _atual.set(metricas)
+
+
+def encerrar_requisicao(token) -> None:
+    _atual.reset(token)
+
+
+def antes_da_consulta(conn, cursor, statement, parameters, context, executemany) -> None:
+    if context is not None and _atual.get() is not None:
+        context._metricas_inicio = time.perf_counter()
+
+
+def depois_da_consulta(conn, cursor, statement, parameters, context, executemany) -> None:
+    metricas = _atual.get()
+    inicio = getattr(context, "_metricas_inicio", None)
+    if metricas is not None and inicio is not None:
+        metricas.db_consultas += 1
+        metricas.db_segundos += time.perf_counter() - inicio
+
+
+@contextmanager
+def medir_auth():
+    """Soma o tempo do bloco à autenticação da requisição (blocos aninhados contam uma vez)"""
+    metricas = _atual.get()
+    if metricas is None:
+        yield
+        return
+    metricas._auth_profundidade += 1
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        metricas._auth_profundidade -= 1
+        if metricas._auth_profundidade == 0:
+            metricas.auth_segundos += time.perf_counter() - inicio
+
+
+class Histograma:
+    def __init__(self, limites: Tuple[float, ...]):
+        self.limites = limites
+        self.contagens = [0] * len(limites)
+        self.soma = 0.0
+        self.total = 0
+
+    def observar(self, valor: float) -> None:
+        for i, limite in enumerate(self.limites):
+            if valor <= limite:
+                self.contagens[i] += 1
+                break
+        self.soma += valor
+        self.total += 1
+
+
+_FAMILIAS = (
+    ("http_request_duration_seconds", "Latência das requisições HTTP", BUCKETS_SEGUNDOS),
+    ("http_request_db_queries", "Consultas ao banco por requisição", BUCKETS_CONSULTAS),
+    ("http_request_db_seconds", "Tempo em consultas ao banco por requisição", BUCKETS_SEGUNDOS),
+    ("http_request_auth_seconds", "Tempo de autenticação por requisição", BUCKETS_SEGUNDOS),
+)
+
+
+def _rotulos(**rotulos: str) -> str:
+    def escapar(valor: str) -> str:
+        return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{nome}="{escapar(valor)}"' for nome, valor in rotulos.items())
+
+
+def _numero(valor: float) -> str:
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class Registro:
+    """Histogramas e contadores por (método, rota)"""
+
+    def __init__(self):
+        self._histogramas: Dict[str, Dict[Tuple[str, str], Histograma]] = {nome: {} for nome, _, _ in _FAMILIAS}
+        self._requisicoes: Dict[Tuple[str, str, int], int] = {}
+        self._lock = threading.Lock()
+        self.em_andamento = 0
+
+    def observar(self, metodo: str, rota: str, status: int, duracao: float, metricas: MetricasRequisicao) -> None:
+        chave = (metodo, rota)
+        valores = (duracao, metricas.db_consultas, metricas.db_segundos, metricas.auth_segundos)
+        with self._lock:
+            for (nome, _, limites), valor in zip(_FAMILIAS, valores):
+                por_rota = self._histogramas[nome]
+                histograma = por_rota.get(chave)
+                if histograma is None:
+                    histograma = por_rota[chave] = Histograma(limites)
+                histograma.observar(valor)
+            self._requisicoes[(metodo, rota, status)] = self._requisicoes.get((metodo, rota, status), 0) + 1
+
+    def exportar(self, extras: Iterable[Tuple[str, str, str, float]] = ()) -> str:
+        """Texto no formato de exposição do Prometheus (0.0.4)
+
+        `extras` são valores avulsos de outros componentes: `(nome, tipo, ajuda, valor)`.
+        """
+        linhas: List[str] = []
+        with self._lock:
+            linhas.append("# HELP http_requests_total Requisições HTTP atendidas")
+            linhas.append("# TYPE http_requests_total counter")
+            for (metodo, rota, status), total in sorted(self._requisicoes.items()):
+                linhas.append(f"http_requests_total{{{_rotulos(method=metodo, route=rota, status=status)}}} {total}")
+            for nome, ajuda, _ in _FAMILIAS:
+                linhas.append(f"# HELP {nome} {ajuda}")
+                linhas.append(f"# TYPE {nome} histogram")
+                for (metodo, rota), h in sorted(self._histogramas[nome].items()):
+                    base = _rotulos(method=metodo, route=rota)
+                    acumulado = 0
+                    for limite, contagem in zip(h.limites, h.contagens):
+                        acumulado += contagem
+                        linhas.append(f'{nome}_bucket{{{base},le="{_numero(limite)}"}} {acumulado}')
+                    linhas.append(f'{nome}_bucket{{{base},le="+Inf"}} {h.total}')
+                    linhas.append(f"{nome}_sum{{{base}}} {_numero(h.soma)}")
+                    linhas.append(f"{nome}_count{{{base}}} {h.total}")
+            em_andamento = self.em_andamento
+        linhas.append("# HELP http_requests_in_progress Requisições HTTP em andamento")
+        linhas.append("# TYPE http_requests_in_progress gauge")
+        linhas.append(f"http_requests_in_progress {em_andamento}")
+        for nome, tipo, ajuda, valor in extras:
+            linhas.append(f"# HELP {nome} {ajuda}")
+            linhas.append(f"# TYPE {nome} {tipo}")
+            linhas.append(f"{nome} {_numero(valor)}")
+        return "\n".join(linhas) + "\n"
+
+
+registro = Registro()
+
+
+def server_timing(duracao: float, metricas: MetricasRequisicao) -> str:
+    """Valor do header `Server-Timing` (durações em milissegundos)"""
+    return (
+        f"app;dur={duracao * 1000:.1f}, "
+        f'db;dur={metricas.db_segundos * 1000:.1f};desc="{metricas.db_consultas} queries", '
+        f"auth;dur={metricas.auth_segundos * 1000:.1f}"
+    )
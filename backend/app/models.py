@@ -2,11 +2,15 @@ from datetime import datetime
 from typing import Optional
 from sqlmodel import SQLModel, Field, Relationship
 from typing import List
-from sqlalchemy import JSON, Column
+from sqlalchemy import JSON, Column, Index, func
 import json
 
 
 class CommunityMembership(SQLModel, table=True):
+    __table_args__ = (
+        Index("ux_communitymembership_community_user", "community_id", "user_id", unique=True),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     community_id: int = Field(foreign_key="community.id")
     user_id: int = Field(foreign_key="userprofile.id")
@@ -21,10 +25,26 @@ class Community(SQLModel, table=True):
     description: Optional[str] = None
     visibility: str = Field(default="public")
     owner_id: Optional[int] = Field(default=None, foreign_key="userprofile.id")
+    # contador desnormalizado, mantido por UPDATE atômico no join/leave
+    member_count: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
 
+class CommunityItem(SQLModel):
+    """Comunidade na listagem, com a indicação se o usuário autenticado é membro"""
+    id: int
+    slug: str
+    name: str
+    description: Optional[str] = None
+    visibility: str
+    owner_id: Optional[int] = None
+    member_count: int
+    created_at: datetime
+    updated_at: datetime
+    is_member: bool
+
+
 class Event(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     community_id: Optional[int] = Field(default=None, foreign_key="community.id")
@@ -38,13 +58,32 @@ class Event(SQLModel, table=True):
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
 
+class EventAttendance(SQLModel, table=True):
+    """Presença de um usuário em um evento (no máximo uma por par evento/usuário)"""
+    __table_args__ = (
+        Index("ux_eventattendance_event_user", "event_id", "user_id", unique=True),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    event_id: int = Field(foreign_key="event.id")
+    user_id: int = Field(foreign_key="userprofile.id")
+    xp_awarded: int = Field(default=0)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
 class XPHistory(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_xphistory_user_created", "user_id", "created_at", "id"),
+        Index("ux_xphistory_user_idempotency", "user_id", "idempotency_key", unique=True),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="userprofile.id")
     event_id: Optional[int] = Field(default=None, foreign_key="event.id")
     type: str = Field(default="manual")
     xp_amount: int = Field(default=0)
     xp_metadata: Optional[dict] = Field(default=None, sa_type=JSON, sa_column_kwargs={"name": "metadata"})
+    idempotency_key: Optional[str] = Field(default=None, max_length=100)
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 
@@ -80,6 +119,13 @@ class UserProfile(SQLModel, table=True):
         self.touch()
 
 
+# Índices funcionais para buscas case-insensitive (Postgres e SQLite >= 3.9)
+Index("ix_userprofile_username_lower", func.lower(UserProfile.username), unique=True)
+Index("ix_userprofile_email_lower", func.lower(UserProfile.email), unique=True)
+# Índice coberto para o ranking: (pontos, id) são lidos direto do índice, já ordenados
+Index("ix_userprofile_pontos_id", UserProfile.pontos.desc(), UserProfile.id)
+
+
 class UserPublic(SQLModel):
     id: int
     username: str
@@ -94,6 +140,21 @@ class UserPublic(SQLModel):
     created_at: datetime
 
 
+class RankingEntry(UserPublic):
+    posicao: int
+
+
+class LeaderboardEntry(UserPublic):
+    posicao: int
+    xp_periodo: int
+
+
+class RankingPosition(SQLModel):
+    posicao: int
+    total: int
+    vizinhos: List[RankingEntry]
+
+
 class UserCreate(SQLModel):
     username: str
     email: str
@@ -102,6 +163,19 @@ class UserCreate(SQLModel):
     phone: Optional[str] = None
 
 
+class RewardEntry(SQLModel):
+    idempotency_key: str = Field(min_length=1, max_length=100)
+    tipo: str  # "tempo" ou "desafio"
+    minutos: int = 0
+    pontos: int = 0
+    nome_desafio: Optional[str] = None
+    registrado_em: Optional[datetime] = None
+
+
+class RewardSync(SQLModel):
+    entradas: List[RewardEntry]
+
+
 class UserLogin(SQLModel):
     username: str
     password: str
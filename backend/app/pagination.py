@@ -0,0 +1,138 @@
+"""Paginação por cursor (keyset) compartilhada pelos routers de listagem.
+
+O cursor é opaco para o cliente: codifica em base64 a chave de ordenação e o id do
+último item da página. A próxima página é buscada com `WHERE (chave, id) > cursor`,
+então o custo independe da profundidade da página. O corpo da resposta continua
+sendo uma lista; o cursor da próxima página vai no header `X-Next-Cursor`.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Tuple, Type
+
+from fastapi import HTTPException, Query, Response
+from sqlalchemy import and_, or_
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(chave: Any, item_id: int) -> str:
+    if isinstance(chave, datetime):
+        payload = ["dt", chave.isoformat(), item_id]
+    else:
+        payload = ["v", chave, item_id]
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _coagir(chave: Any, tipo_chave: Type) -> Any:
+    """Converte a chave do cursor para o tipo da coluna de ordenação"""
+    if tipo_chave is datetime:
+        return chave if isinstance(chave, datetime) else datetime.fromisoformat(chave)
+    if tipo_chave is int:
+        if isinstance(chave, bool) or not isinstance(chave, int):
+            raise ValueError(f"chave de cursor não inteira: {chave!r}")
+        return chave
+    return tipo_chave(chave)
+
+
+def decode_cursor(cursor: str, tipo_chave: Optional[Type] = None) -> Tuple[Any, int]:
+    """Decodifica o cursor; com `tipo_chave`, a chave precisa ser desse tipo (senão 400)"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        tipo, chave, item_id = json.loads(raw)
+        if tipo == "dt":
+            chave = datetime.fromisoformat(chave)
+        if tipo_chave is not None:
+            chave = _coagir(chave, tipo_chave)
+        if isinstance(item_id, bool):
+            raise ValueError("id de cursor inválido")
+        return chave, int(item_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+
+class PageParams:
+    """Dependência com os parâmetros `cursor` e `limit` de uma listagem"""
+
+    def __init__(
+        self,
+        cursor: Optional[str] = Query(None),
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    ):
+        self.cursor = cursor
+        self.limit = limit
+
+    def posicao(self, tipo_chave: Optional[Type] = None) -> Optional[Tuple[Any, int]]:
+        """Chave e id do cursor; `tipo_chave` é o tipo esperado da chave (ex.: int, datetime)"""
+        return decode_cursor(self.cursor, tipo_chave) if self.cursor else None
+
+
+def _stmt_pagina(stmt, id_col, page: PageParams, sort_col, descending: bool, id_descending: bool):
+    posicao = page.posicao(sort_col.type.python_type if sort_col is not None else None)
+    if posicao is not None:
+        chave, ultimo_id = posicao
+        depois_id = id_col < ultimo_id if id_descending else id_col > ultimo_id
+        if sort_col is None:
+            stmt = stmt.where(depois_id)
+        else:
+            depois_chave = sort_col < chave if descending else sort_col > chave
+            stmt = stmt.where(or_(depois_chave, and_(sort_col == chave, depois_id)))
+
+    ordem = []
+    if sort_col is not None:
+        ordem.append(sort_col.desc() if descending else sort_col.asc())
+    ordem.append(id_col.desc() if id_descending else id_col.asc())
+    return stmt.order_by(*ordem).limit(page.limit + 1)
+
+
+def _fechar_pagina(itens: List[Any], id_col, page: PageParams, response: Response, sort_col) -> List[Any]:
+    if len(itens) > page.limit:
+        itens = itens[:page.limit]
+        ultimo = itens[-1]
+        chave = getattr(ultimo, sort_col.key) if sort_col is not None else None
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(chave, getattr(ultimo, id_col.key))
+    return itens
+
+
+def paginar(
+    session: Session,
+    stmt,
+    id_col,
+    page: PageParams,
+    response: Response,
+    sort_col=None,
+    descending: bool = False,
+    id_descending: Optional[bool] = None,
+) -> List[Any]:
+    """Aplica ordenação estável `(sort_col, id_col)` e o filtro de keyset a `stmt`
+
+    Sem `sort_col`, a paginação usa apenas o id. `id_descending` permite desempatar
+    em direção diferente da chave principal (ex.: pontos desc, id asc).
+    """
+    if id_descending is None:
+        id_descending = descending
+    stmt = _stmt_pagina(stmt, id_col, page, sort_col, descending, id_descending)
+    return _fechar_pagina(session.exec(stmt).all(), id_col, page, response, sort_col)
+
+
+async def paginar_async(
+    session: AsyncSession,
+    stmt,
+    id_col,
+    page: PageParams,
+    response: Response,
+    sort_col=None,
+    descending: bool = False,
+    id_descending: Optional[bool] = None,
+) -> List[Any]:
+    """Versão de `paginar` para `AsyncSession`"""
+    if id_descending is None:
+        id_descending = descending
+    stmt = _stmt_pagina(stmt, id_col, page, sort_col, descending, id_descending)
+    itens = (await session.exec(stmt)).all()
+    return _fechar_pagina(itens, id_col, page, response, sort_col)
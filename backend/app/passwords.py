@@ -0,0 +1,98 @@
+"""Hash e verificação de senhas fora do threadpool das rotas.
+
+pbkdf2/bcrypt são propositalmente caros em CPU. Para que um pico de logins não
+trave as demais rotas, o trabalho roda em um pool de processos dedicado (fora do
+GIL), com limite de tarefas pendentes: acima do limite a API responde 503.
+Este módulo só depende do passlib para que os processos filhos sejam leves.
+"""
+import asyncio
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", min(4, os.cpu_count() or 1)))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", 64))
+
+pwd_context = CryptContext(schemes=["pbkdf2_sha256", "bcrypt"], deprecated="auto")
+
+
+def _truncar(password: str) -> str:
+    # Bcrypt tem limite de 72 bytes - truncar se necessário
+    password_bytes = password.encode('utf-8')
+    if len(password_bytes) > 72:
+        password = password_bytes[:72].decode('utf-8', errors='ignore')
+    return password
+
+
+def hash_password(password: str) -> str:
+    """Gera hash da senha (trunca em 72 bytes se necessário devido a limitação do bcrypt)"""
+    return pwd_context.hash(_truncar(password))
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Verifica se senha corresponde ao hash (trunca em 72 bytes se necessário)"""
+    return pwd_context.verify(_truncar(plain_password), hashed_password)
+
+
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verifica a senha e, se o hash usa parâmetros antigos, retorna um novo hash"""
+    return pwd_context.verify_and_update(_truncar(plain_password), hashed_password)
+
+
+class PasswordHasher:
+    """Serviço assíncrono de hash de senhas com fila limitada"""
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pendentes = 0
+        self._executor: Optional[Executor] = None
+
+    def _obter_executor(self) -> Executor:
+        if self._executor is None:
+            try:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            except (OSError, NotImplementedError):
+                # ambientes sem suporte a multiprocessing (ex.: alguns serverless)
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        return self._executor
+
+    async def _executar(self, fn, *args):
+        if self.pendentes >= self.max_pending:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Servidor ocupado, tente novamente em instantes",
+                headers={"Retry-After": "1"},
+            )
+        self.pendentes += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._obter_executor(), fn, *args)
+        except BrokenProcessPool:
+            # um processo filho morreu; recria o pool na próxima chamada
+            self.shutdown()
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Servidor ocupado, tente novamente em instantes",
+                headers={"Retry-After": "1"},
+            )
+        finally:
+            self.pendentes -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._executar(hash_password, password)
+
+    async def verify_and_update(self, plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        return await self._executar(verify_and_update_password, plain_password, hashed_password)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher()
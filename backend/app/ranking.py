@@ -0,0 +1,293 @@
+"""Índice de ranking em memória mantido incrementalmente.
+
+Evita `ORDER BY pontos DESC` sobre a tabela inteira a cada requisição: o índice é
+carregado do banco uma vez (startup ou primeiro uso) e atualizado a cada
+concessão de pontos. Cada comunidade tem o próprio índice, carregado no primeiro
+acesso e mantido pelas concessões de pontos dos membros e pelas entradas/saídas.
+As mudanças confirmadas são difundidas para os índices dos outros workers.
+"""
+import threading
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from sortedcontainers import SortedList
+from sqlalchemy import event
+from sqlalchemy.orm import Session as SASession
+from sqlmodel import Session, select
+
+from .cache_backend import ao_receber, difundir
+
+# tamanho do ranking global devolvido por GET /profiles/ranking
+TOP_RANKING = 100
+
+_SESSION_KEY = "ranking_pendentes"
+_SESSION_KEY_MEMBROS = "ranking_membros_pendentes"
+
+
+class RankingIndex:
+    """Índice ordenado por pontos (desc) com desempate por id (asc).
+
+    As chaves são tuplas `(-pontos, id)` em uma `SortedList`, de modo que a ordem
+    natural já é a ordem do ranking. Inserções e remoções custam O(log n) (sem o
+    deslocamento O(n) de uma lista comum); consultas de top-N, posição e vizinhos
+    usam busca binária.
+    `versao` aumenta a cada mudança (carga, pontos, inserção ou remoção).
+    """
+
+    def __init__(self):
+        self._chaves: SortedList = SortedList()
+        self._pontos: Dict[int, int] = {}
+        self._lock = threading.RLock()
+        self.pronto = False
+        self.versao = 0
+
+    def __len__(self) -> int:
+        return len(self._chaves)
+
+    def carregar(self, pares) -> None:
+        """Substitui o conteúdo do índice por pares (user_id, pontos)"""
+        pontos = {user_id: pts or 0 for user_id, pts in pares}
+        chaves = SortedList((-pts, user_id) for user_id, pts in pontos.items())
+        with self._lock:
+            self._pontos = pontos
+            self._chaves = chaves
+            self.pronto = True
+            self.versao += 1
+
+    def atualizar(self, user_id: int, pontos: int, somente_aumento: bool = False) -> None:
+        """Insere ou move o usuário para a posição correspondente aos novos pontos
+
+        Com `somente_aumento`, valores menores que o atual são ignorados (commits
+        concorrentes podem chegar fora de ordem).
+        """
+        with self._lock:
+            anterior = self._pontos.get(user_id)
+            if anterior == pontos or (somente_aumento and anterior is not None and pontos < anterior):
+                return
+            if anterior is not None:
+                self._chaves.discard((-anterior, user_id))
+            self._pontos[user_id] = pontos
+            self._chaves.add((-pontos, user_id))
+            self.versao += 1
+
+    def remover(self, user_id: int) -> None:
+        with self._lock:
+            anterior = self._pontos.pop(user_id, None)
+            if anterior is not None:
+                self._chaves.discard((-anterior, user_id))
+                self.versao += 1
+
+    def pontos(self, user_id: int) -> Optional[int]:
+        return self._pontos.get(user_id)
+
+    def usuarios(self) -> List[int]:
+        with self._lock:
+            return list(self._pontos)
+
+    def top(self, n: int, offset: int = 0) -> List[Tuple[int, int]]:
+        """Retorna [(user_id, pontos)] das posições offset+1 .. offset+n"""
+        with self._lock:
+            fatia = self._chaves[offset:offset + n]
+        return [(user_id, -neg) for neg, user_id in fatia]
+
+    def apos(self, pontos: int, user_id: int, n: int) -> List[Tuple[int, int]]:
+        """Retorna [(user_id, pontos)] dos n itens seguintes à chave (pontos, user_id)"""
+        with self._lock:
+            i = self._chaves.bisect_right((-pontos, user_id))
+            fatia = self._chaves[i:i + n]
+        return [(uid, -neg) for neg, uid in fatia]
+
+    def posicao(self, user_id: int) -> Optional[int]:
+        """Posição (1-based) do usuário no ranking, ou None se não indexado"""
+        with self._lock:
+            pts = self._pontos.get(user_id)
+            if pts is None:
+                return None
+            return self._chaves.bisect_left((-pts, user_id)) + 1
+
+    def vizinhos(self, user_id: int, raio: int = 5) -> List[Tuple[int, int, int]]:
+        """Retorna [(posicao, user_id, pontos)] ao redor do usuário (raio para cada lado)"""
+        with self._lock:
+            pts = self._pontos.get(user_id)
+            if pts is None:
+                return []
+            i = self._chaves.bisect_left((-pts, user_id))
+            inicio = max(0, i - raio)
+            fatia = self._chaves[inicio:i + raio + 1]
+        return [(inicio + k + 1, uid, -neg) for k, (neg, uid) in enumerate(fatia)]
+
+
+ranking = RankingIndex()
+
+
+class CommunityRankings:
+    """Índices de ranking por comunidade, carregados sob demanda
+
+    Mantém também o mapa usuário -> comunidades carregadas, para propagar uma
+    concessão de pontos só para os índices onde o usuário aparece.
+    """
+
+    def __init__(self):
+        self._indices: Dict[int, RankingIndex] = {}
+        self._comunidades: Dict[int, Set[int]] = {}
+        self._lock = threading.RLock()
+
+    def obter(self, community_id: int, carregar: Callable[[], List[Tuple[int, int]]]) -> RankingIndex:
+        """Retorna o índice da comunidade, carregando com `carregar()` no primeiro acesso"""
+        indice = self._indices.get(community_id)
+        if indice is not None:
+            return indice
+        with self._lock:
+            # o lock fica retido durante a carga para que atualizações concorrentes
+            # sejam aplicadas depois dela, e não perdidas
+            indice = self._indices.get(community_id)
+            if indice is None:
+                indice = RankingIndex()
+                indice.carregar(carregar())
+                for user_id in indice.usuarios():
+                    self._comunidades.setdefault(user_id, set()).add(community_id)
+                self._indices[community_id] = indice
+            return indice
+
+    def atualizar_pontos(self, user_id: int, pontos: int) -> None:
+        with self._lock:
+            for community_id in self._comunidades.get(user_id, ()):
+                self._indices[community_id].atualizar(user_id, pontos, somente_aumento=True)
+
+    def entrou(self, community_id: int, user_id: int) -> None:
+        with self._lock:
+            indice = self._indices.get(community_id)
+            if indice is None:
+                return
+            pontos = ranking.pontos(user_id)
+            if pontos is None:
+                # pontuação desconhecida: descarta o índice para recarregar no próximo acesso
+                self.descartar(community_id)
+                return
+            indice.atualizar(user_id, pontos)
+            self._comunidades.setdefault(user_id, set()).add(community_id)
+
+    def saiu(self, community_id: int, user_id: int) -> None:
+        with self._lock:
+            indice = self._indices.get(community_id)
+            if indice is not None:
+                indice.remover(user_id)
+            self._comunidades.get(user_id, set()).discard(community_id)
+
+    def remover_usuario(self, user_id: int) -> None:
+        with self._lock:
+            for community_id in self._comunidades.pop(user_id, ()):
+                self._indices[community_id].remover(user_id)
+
+    def descartar(self, community_id: int) -> None:
+        with self._lock:
+            indice = self._indices.pop(community_id, None)
+            if indice is None:
+                return
+            for user_id in indice.usuarios():
+                comunidades = self._comunidades.get(user_id)
+                if comunidades is not None:
+                    comunidades.discard(community_id)
+
+    def limpar(self) -> None:
+        """Descarta todos os índices; cada um é recarregado no próximo acesso"""
+        with self._lock:
+            self._indices.clear()
+            self._comunidades.clear()
+
+
+rankings_comunidade = CommunityRankings()
+
+
+def registrar_pontos(session: Session, user_id: int, pontos: int) -> None:
+    """Agenda a atualização do índice para quando a transação da sessão for confirmada
+
+    Usado pelas concessões de pontos, que só aumentam a pontuação.
+    """
+    session.info.setdefault(_SESSION_KEY, {})[user_id] = pontos
+
+
+def registrar_membro(session: Session, community_id: int, user_id: int, entrou: bool) -> None:
+    """Agenda a entrada/saída do usuário no índice da comunidade para após o commit"""
+    session.info.setdefault(_SESSION_KEY_MEMBROS, []).append((community_id, user_id, entrou))
+
+
+@event.listens_for(SASession, "after_commit")
+def _aplicar_pendentes(session) -> None:
+    pontos = session.info.pop(_SESSION_KEY, {})
+    for user_id, pts in pontos.items():
+        _aplicar_pontos(user_id, pts)
+    membros = session.info.pop(_SESSION_KEY_MEMBROS, ())
+    for community_id, user_id, entrou in membros:
+        _aplicar_membro(community_id, user_id, entrou)
+    difundir("ranking_pontos", pontos.items())
+    difundir("ranking_membro", membros)
+
+
+@ao_receber("ranking_pontos")
+def _aplicar_pontos(user_id: int, pontos: int) -> None:
+    ranking.atualizar(user_id, pontos, somente_aumento=True)
+    rankings_comunidade.atualizar_pontos(user_id, pontos)
+
+
+@ao_receber("ranking_membro")
+def _aplicar_membro(community_id: int, user_id: int, entrou: bool) -> None:
+    if entrou:
+        rankings_comunidade.entrou(community_id, user_id)
+    else:
+        rankings_comunidade.saiu(community_id, user_id)
+
+
+@event.listens_for(SASession, "after_rollback")
+def _descartar_pendentes(session) -> None:
+    session.info.pop(_SESSION_KEY, None)
+    session.info.pop(_SESSION_KEY_MEMBROS, None)
+
+
+def reconstruir_ranking(session: Session) -> None:
+    """Recarrega o índice global a partir do banco"""
+    from .models import UserProfile
+
+    stmt = select(UserProfile.id, UserProfile.pontos).order_by(UserProfile.pontos.desc(), UserProfile.id)
+    ranking.carregar(session.exec(stmt).all())
+
+
+def obter_ranking_comunidade(session: Session, community_id: int) -> RankingIndex:
+    """Retorna o índice da comunidade, carregando (membro, pontos) do banco no primeiro acesso"""
+    from .models import CommunityMembership, UserProfile
+
+    def carregar() -> List[Tuple[int, int]]:
+        stmt = (
+            select(UserProfile.id, UserProfile.pontos)
+            .join(CommunityMembership, CommunityMembership.user_id == UserProfile.id)
+            .where(CommunityMembership.community_id == community_id)
+        )
+        return session.exec(stmt).all()
+
+    return rankings_comunidade.obter(community_id, carregar)
+
+
+def obter_ranking(session: Session) -> RankingIndex:
+    """Retorna o índice global, carregando-o do banco se ainda não foi construído"""
+    if not ranking.pronto:
+        reconstruir_ranking(session)
+    return ranking
+
+
+def posicao_no_ranking(session: Session, indice: RankingIndex, user_id: int, raio: int):
+    """Monta a `RankingPosition` do usuário no índice, ou None se ele não está indexado"""
+    from .models import RankingEntry, RankingPosition
+    from .serialization import linha_para_dict, linhas_publicas_por_ids
+
+    posicao = indice.posicao(user_id)
+    if posicao is None:
+        return None
+    vizinhos = indice.vizinhos(user_id, raio)
+    perfis = {linha[0]: linha for linha in linhas_publicas_por_ids(session, [uid for _, uid, _ in vizinhos])}
+    return RankingPosition(
+        posicao=posicao,
+        total=len(indice),
+        vizinhos=[
+            RankingEntry(posicao=pos, **linha_para_dict(perfis[uid]))
+            for pos, uid, _ in vizinhos if uid in perfis
+        ],
+    )
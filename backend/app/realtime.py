@@ -0,0 +1,212 @@
+"""Canal de push (Server-Sent Events) com pontos e ranking em tempo real.
+
+As concessões de pontos confirmadas (recompensas, presença em eventos, sync
+offline) publicam a nova pontuação do usuário no broker. A publicação só grava
+o último valor por usuário em um dicionário protegido por lock, então várias
+concessões seguidas viram uma única mensagem. A cada `STREAM_TICK_SECONDS` o
+broker entrega:
+
+- `pontos`: a pontuação atual, apenas para as conexões do próprio usuário;
+- `ranking`: as linhas do top-N que mudaram desde o último tick, já com os
+  campos exibidos na tabela do ranking, para o cliente atualizar só essas linhas.
+  O top-N é recalculado sempre que o índice global muda (pontos, cadastro,
+  remoção ou recarga), não só após concessões de pontos.
+
+Com vários workers, as publicações são difundidas para os brokers dos outros
+processos, que entregam às conexões abertas neles.
+
+Cada conexão tem uma fila limitada (`STREAM_QUEUE_SIZE`). Um cliente lento que
+deixa a fila encher é desconectado; o EventSource do navegador reconecta sozinho
+e recebe o snapshot completo do ranking.
+"""
+import asyncio
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session as SASession
+from sqlmodel import Session, select
+
+from .cache_backend import ao_receber, difundir
+from .database import engine
+from .models import UserProfile
+from .ranking import ranking
+from .serialization import linha_para_dict
+
+STREAM_TICK_SECONDS = float(os.getenv("STREAM_TICK_SECONDS", 1))
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", 32))
+STREAM_HEARTBEAT_SECONDS = float(os.getenv("STREAM_HEARTBEAT_SECONDS", 15))
+STREAM_TOP_N = int(os.getenv("STREAM_TOP_N", 100))
+
+_SESSION_KEY = "realtime_pendentes"
+
+# colunas de cada linha do evento `ranking` (as mesmas exibidas em ranking.html)
+CAMPOS_RANKING = ("id", "username", "name", "pontos", "nivel", "tempo_sem_tela_minutos", "desafios_completados")
+
+
+def formatar_evento(evento: str, dados: dict) -> str:
+    return f"event: {evento}\ndata: {json.dumps(dados, separators=(',', ':'))}\n\n"
+
+
+def carregar_perfis(ids: List[int]) -> Dict[int, dict]:
+    """Campos de `CAMPOS_RANKING` dos usuários `ids`, por id (consulta bloqueante)"""
+    if not ids:
+        return {}
+    colunas = [getattr(UserProfile, campo) for campo in CAMPOS_RANKING]
+    with Session(engine) as session:
+        linhas = session.exec(select(*colunas).where(UserProfile.id.in_(ids))).all()
+    return {linha[0]: linha_para_dict(linha, CAMPOS_RANKING) for linha in linhas}
+
+
+class Assinante:
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.fila: "asyncio.Queue[Optional[str]]" = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+
+
+class Broker:
+    """Fan-out em processo das mudanças de pontos e do top-N do ranking
+
+    `publicar_pontos` pode ser chamado de qualquer thread; assinaturas, ticks e
+    entregas acontecem no event loop. Só a leitura dos perfis das linhas alteradas
+    do ranking roda em uma thread.
+    """
+
+    def __init__(self, top_n: int = STREAM_TOP_N):
+        self.top_n = top_n
+        self._assinantes: Dict[int, Set[Assinante]] = {}
+        self._pendentes: Dict[int, Tuple[int, int]] = {}
+        self._lock = threading.Lock()
+        self._top: List[Tuple[int, int]] = []
+        self._perfis: Dict[int, dict] = {}
+        # `ranking.versao` do último top-N calculado
+        self._versao_top = -1
+        self.desconectados_por_atraso = 0
+
+    def publicar_pontos(self, user_id: int, pontos: int, nivel: int) -> None:
+        with self._lock:
+            self._pendentes[user_id] = (pontos, nivel)
+
+    def assinar(self, user_id: int) -> Assinante:
+        assinante = Assinante(user_id)
+        self._assinantes.setdefault(user_id, set()).add(assinante)
+        # snapshot: o top-N do último tick, com todas as linhas
+        self._entregar(assinante, self._mensagem_ranking(enumerate((uid for uid, _ in self._top), start=1)))
+        return assinante
+
+    def _mensagem_ranking(self, posicoes) -> str:
+        alterados = [{"posicao": pos, **self._perfis[uid]} for pos, uid in posicoes if uid in self._perfis]
+        return formatar_evento("ranking", {"alterados": alterados, "tamanho": len(self._top)})
+
+    def cancelar(self, assinante: Assinante) -> None:
+        assinantes = self._assinantes.get(assinante.user_id)
+        if assinantes is not None:
+            assinantes.discard(assinante)
+            if not assinantes:
+                del self._assinantes[assinante.user_id]
+
+    def _entregar(self, assinante: Assinante, mensagem: str) -> None:
+        try:
+            assinante.fila.put_nowait(mensagem)
+        except asyncio.QueueFull:
+            # cliente lento: descarta o que está na fila e encerra a conexão
+            while not assinante.fila.empty():
+                assinante.fila.get_nowait()
+            assinante.fila.put_nowait(None)
+            self.cancelar(assinante)
+            self.desconectados_por_atraso += 1
+
+    def _recalcular_top(self) -> Tuple[int, List[Tuple[int, int]], List[Tuple[int, int]], Dict[int, dict]]:
+        """Versão do índice, top-N atual, as (posição, user_id) que mudaram e os perfis dessas linhas
+
+        Roda fora do event loop por causa da consulta dos perfis.
+        """
+        # lida antes do top: uma mudança concorrente deixa a versão para trás e é recalculada no próximo tick
+        versao = ranking.versao
+        top = ranking.top(self.top_n)
+        anterior = self._top
+        alterados = [
+            (pos, uid)
+            for pos, (uid, pts) in enumerate(top, start=1)
+            if pos > len(anterior) or anterior[pos - 1] != (uid, pts)
+        ]
+        return versao, top, alterados, carregar_perfis([uid for _, uid in alterados])
+
+    async def tick(self) -> None:
+        with self._lock:
+            pendentes, self._pendentes = self._pendentes, {}
+
+        for user_id, (pontos, nivel) in pendentes.items():
+            assinantes = self._assinantes.get(user_id)
+            if assinantes:
+                mensagem = formatar_evento("pontos", {"user_id": user_id, "pontos": pontos, "nivel": nivel})
+                for assinante in list(assinantes):
+                    self._entregar(assinante, mensagem)
+
+        if ranking.versao == self._versao_top:
+            return
+        self._versao_top, top, alterados, perfis = await asyncio.to_thread(self._recalcular_top)
+        tamanho_anterior, self._top = len(self._top), top
+        # guarda só os perfis das linhas do top (os recém-lidos substituem os anteriores)
+        perfis = {**self._perfis, **perfis}
+        self._perfis = {uid: perfis[uid] for uid, _ in top if uid in perfis}
+        if (alterados or tamanho_anterior != len(top)) and self._assinantes:
+            mensagem = self._mensagem_ranking(alterados)
+            for assinantes in list(self._assinantes.values()):
+                for assinante in list(assinantes):
+                    self._entregar(assinante, mensagem)
+
+    async def executar(self) -> None:
+        while True:
+            await asyncio.sleep(STREAM_TICK_SECONDS)
+            try:
+                await self.tick()
+            except Exception as e:
+                print(f"Erro ao publicar atualizações em tempo real: {e}")
+
+    def conexoes(self) -> int:
+        return sum(len(a) for a in self._assinantes.values())
+
+
+broker = Broker()
+
+
+def registrar_mudanca(session: Session, user_id: int, pontos: int, nivel: int) -> None:
+    """Agenda a publicação da nova pontuação para quando a transação for confirmada"""
+    session.info.setdefault(_SESSION_KEY, {})[user_id] = (pontos, nivel)
+
+
+@event.listens_for(SASession, "after_commit")
+def _publicar_pendentes(session) -> None:
+    pendentes = session.info.pop(_SESSION_KEY, {})
+    for user_id, (pontos, nivel) in pendentes.items():
+        broker.publicar_pontos(user_id, pontos, nivel)
+    difundir("realtime_pontos", [(user_id, pontos, nivel) for user_id, (pontos, nivel) in pendentes.items()])
+
+
+ao_receber("realtime_pontos")(broker.publicar_pontos)
+
+
+@event.listens_for(SASession, "after_rollback")
+def _descartar_pendentes(session) -> None:
+    session.info.pop(_SESSION_KEY, None)
+
+
+async def eventos(assinante: Assinante):
+    """Gerador do corpo `text/event-stream` de uma conexão"""
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                mensagem = await asyncio.wait_for(assinante.fila.get(), STREAM_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                # comentário SSE: mantém a conexão viva em proxies
+                yield ": ping\n\n"
+                continue
+            if mensagem is None:
+                return
+            yield mensagem
+    finally:
+        broker.cancelar(assinante)
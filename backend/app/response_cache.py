@@ -0,0 +1,141 @@
+"""Cache em memória (TTL + LRU) das respostas de leitura pública.
+
+Cada entrada guarda o corpo JSON já serializado (bytes), o ETag calculado sobre ele
+e os headers relevantes (ex.: cursor da próxima página). A chave é o caminho da
+rota mais a query string normalizada.
+
+A invalidação é por tag: cada entrada registra a geração das suas tags no momento
+em que a consulta começou, e os handlers que alteram os dados chamam `invalidar`
+após o commit, incrementando a geração. Entradas com geração antiga deixam de ser
+servidas e acabam removidas pelo LRU; uma consulta iniciada antes da invalidação
+também não sobrescreve o cache com dados antigos. As gerações ficam no
+`cache_backend`, então uma invalidação em um worker vale para todos.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, NamedTuple, Optional, Tuple
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+from .cache_backend import cache_backend
+from .serialization import dumps
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 1000))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 60))
+
+# headers da resposta original que não fazem sentido guardar
+_HEADERS_IGNORADOS = {"content-length", "content-type"}
+
+
+class CachedResponse(NamedTuple):
+    corpo: bytes
+    etag: str
+    headers: Dict[str, str]
+
+
+class ResponseCache:
+    def __init__(self, maxsize: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entradas: "OrderedDict[str, Tuple[float, Dict[str, int], CachedResponse]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def geracoes(self, tags: Iterable[str]) -> Dict[str, int]:
+        return cache_backend.versoes(tags)
+
+    def _valida(self, geracoes: Dict[str, int]) -> bool:
+        return cache_backend.versoes(geracoes) == geracoes
+
+    def get(self, chave: str) -> Optional[CachedResponse]:
+        agora = time.monotonic()
+        with self._lock:
+            item = self._entradas.get(chave)
+            if item is None or item[0] <= agora or not self._valida(item[1]):
+                if item is not None:
+                    del self._entradas[chave]
+                self.misses += 1
+                return None
+            self._entradas.move_to_end(chave)
+            self.hits += 1
+            return item[2]
+
+    def put(self, chave: str, geracoes: Dict[str, int], entrada: CachedResponse) -> None:
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+        with self._lock:
+            if not self._valida(geracoes):
+                # os dados mudaram enquanto a resposta era montada
+                return
+            self._entradas[chave] = (time.monotonic() + self.ttl, geracoes, entrada)
+            self._entradas.move_to_end(chave)
+            while len(self._entradas) > self.maxsize:
+                self._entradas.popitem(last=False)
+
+    def invalidar(self, *tags: str) -> None:
+        cache_backend.invalidar(*tags)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entradas.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._entradas), "hits": self.hits, "misses": self.misses}
+
+
+response_cache = ResponseCache()
+
+
+def _chave(request: Request, usuario_id: Optional[int]) -> str:
+    query = sorted(request.query_params.multi_items())
+    chave = request.url.path + "?" + "&".join(f"{k}={v}" for k, v in query)
+    return chave if usuario_id is None else f"{chave}#u{usuario_id}"
+
+
+def _etag(corpo: bytes) -> str:
+    return '"' + hashlib.blake2b(corpo, digest_size=16).hexdigest() + '"'
+
+
+def _etag_confere(request: Request, etag: str) -> bool:
+    valor = request.headers.get("if-none-match")
+    if not valor:
+        return False
+    if valor.strip() == "*":
+        return True
+    candidatos = (c.strip() for c in valor.split(","))
+    return any(c[2:] == etag if c.startswith("W/") else c == etag for c in candidatos)
+
+
+def resposta_em_cache(
+    request: Request,
+    tags: Tuple[str, ...],
+    produzir: Callable[[Response], Any],
+    usuario_id: Optional[int] = None,
+) -> Response:
+    """Serve a resposta do cache ou monta com `produzir(response)` e guarda
+
+    `produzir` recebe uma `Response` temporária onde pode definir headers (como o
+    cursor da paginação), que são guardados junto com o corpo. Respostas que
+    dependem do usuário autenticado informam `usuario_id`, que entra na chave.
+    Responde 304 sem corpo quando o `If-None-Match` do cliente confere com o ETag.
+    """
+    chave = _chave(request, usuario_id)
+    entrada = response_cache.get(chave)
+    if entrada is None:
+        geracoes = response_cache.geracoes(tags)
+        temporaria = Response()
+        corpo = dumps(jsonable_encoder(produzir(temporaria)))
+        headers = {k: v for k, v in temporaria.headers.items() if k not in _HEADERS_IGNORADOS}
+        entrada = CachedResponse(corpo, _etag(corpo), headers)
+        response_cache.put(chave, geracoes, entrada)
+
+    headers = {**entrada.headers, "ETag": entrada.etag, "Cache-Control": "private, no-cache"}
+    if _etag_confere(request, entrada.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entrada.corpo, media_type="application/json", headers=headers)
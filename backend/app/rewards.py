@@ -0,0 +1,143 @@
+"""Regras das rotas de recompensas e presença, comuns aos caminhos síncrono e assíncrono.
+
+As rotas com `Session` (`main.py`, `routers/events.py`) e as variantes com
+`AsyncSession` (`routers/async_routes.py`) só diferem no acesso ao banco. A
+validação do pedido, o cálculo dos pontos, a transação de escrita e o corpo da
+resposta ficam aqui para que as duas versões não divirjam.
+"""
+import asyncio
+from typing import NamedTuple, Optional
+
+from fastapi import HTTPException
+from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from .ledger import (
+    Presenca, Saldo, conceder_pontos, conceder_pontos_async, registrar_presenca, registrar_presenca_async,
+    registrar_tempo, registrar_tempo_async,
+)
+from .models import UserProfile, XPHistory
+from .sqlite_writer import executar_escrita, writer
+
+PONTOS_POR_HORA = 10
+
+
+class Concessao(NamedTuple):
+    pontos: int
+    tipo: str
+    minutos: int = 0
+    desafios: int = 0
+    metadata: Optional[dict] = None
+
+
+def pontos_por_tempo(minutos: int) -> int:
+    """10 pontos por hora completa sem tela"""
+    return (minutos // 60) * PONTOS_POR_HORA
+
+
+def concessao_tempo(data: dict) -> Concessao:
+    minutos = data.get("minutos", 0)
+    if minutos <= 0:
+        raise HTTPException(status_code=400, detail="Minutos deve ser maior que zero")
+    return Concessao(pontos_por_tempo(minutos), "tempo_sem_tela", minutos=minutos, metadata={"minutos": minutos})
+
+
+def resposta_tempo(concessao: Concessao, saldo: Saldo) -> dict:
+    return {
+        "message": f"Você adicionou {concessao.minutos} minutos sem tela!",
+        "pontos_ganhos": concessao.pontos,
+        "pontos_totais": saldo.pontos,
+        "nivel": saldo.nivel
+    }
+
+
+def concessao_desafio(data: dict) -> Concessao:
+    pontos = data.get("pontos", 0)
+    nome_desafio = data.get("nome_desafio", "Desafio")
+    if pontos <= 0:
+        raise HTTPException(status_code=400, detail="Pontos deve ser maior que zero")
+    return Concessao(pontos, "desafio", desafios=1, metadata={"nome_desafio": nome_desafio})
+
+
+def resposta_desafio(concessao: Concessao, saldo: Saldo) -> dict:
+    return {
+        "message": f"Desafio '{concessao.metadata['nome_desafio']}' completado!",
+        "pontos_ganhos": concessao.pontos,
+        "pontos_totais": saldo.pontos,
+        "nivel": saldo.nivel,
+        "desafios_completados": saldo.desafios_completados
+    }
+
+
+def _aplicar(session: Session, user_id: int, concessao: Concessao) -> Saldo:
+    if not concessao.pontos:
+        # menos de uma hora: só o tempo muda; nada de XPHistory com 0 XP nem ranking
+        return registrar_tempo(session, user_id, concessao.minutos)
+    return conceder_pontos(
+        session, user_id, concessao.pontos, concessao.tipo,
+        minutos=concessao.minutos, desafios=concessao.desafios, metadata=concessao.metadata
+    )
+
+
+def conceder(session: Session, user_id: int, concessao: Concessao) -> Saldo:
+    """Aplica a concessão e faz o commit (pela thread escritora, se ativa)"""
+    return executar_escrita(lambda s: _aplicar(s, user_id, concessao), session)
+
+
+async def conceder_async(session: AsyncSession, user_id: int, concessao: Concessao) -> Saldo:
+    """Versão de `conceder` para `AsyncSession`
+
+    Com o escritor do SQLite ativo, a transação vai para a thread escritora como
+    nas rotas síncronas; caso contrário, roda direto na sessão assíncrona.
+    """
+    if writer.ativo:
+        return await asyncio.to_thread(executar_escrita, lambda s: _aplicar(s, user_id, concessao))
+    if not concessao.pontos:
+        saldo = await registrar_tempo_async(session, user_id, concessao.minutos)
+        await session.commit()
+        return saldo
+    saldo = await conceder_pontos_async(
+        session, user_id, concessao.pontos, concessao.tipo,
+        minutos=concessao.minutos, desafios=concessao.desafios, metadata=concessao.metadata
+    )
+    await session.commit()
+    return saldo
+
+
+def marcar_presenca(session: Session, user_id: int, event_id: int) -> Optional[Presenca]:
+    """Registra a presença e concede o xp do evento uma única vez; repetições não pontuam
+
+    Retorna None se a presença já existia ou se o evento não existe.
+    """
+    # o evento em si não muda (a presença fica em EventAttendance): nada a invalidar no cache
+    return executar_escrita(lambda s: registrar_presenca(s, user_id, event_id), session)
+
+
+async def marcar_presenca_async(session: AsyncSession, user_id: int, event_id: int) -> Optional[Presenca]:
+    """Versão de `marcar_presenca` para `AsyncSession`"""
+    if writer.ativo:
+        presenca = await asyncio.to_thread(executar_escrita, lambda s: registrar_presenca(s, user_id, event_id))
+    else:
+        presenca = await registrar_presenca_async(session, user_id, event_id)
+        await session.commit()
+    return presenca
+
+
+def resposta_presenca(presenca: Optional[Presenca], user: UserProfile) -> dict:
+    """Corpo da resposta; `presenca` None significa presença já registrada"""
+    if presenca is None:
+        return {"message": "Already attended", "xp_awarded": 0, "total_xp": user.xp_total}
+    return {"message": "Event marked as attended", "xp_awarded": presenca.xp, "total_xp": presenca.saldo.xp_total}
+
+
+def select_historico_xp(user_id: int):
+    """Histórico de XP do usuário; a ordem vem de `ORDEM_HISTORICO_XP` na paginação
+
+    Linhas com 0 XP (recibos de idempotência do /rewards/sync para menos de uma
+    hora, ou antigas concessões de tempo sem pontos) não aparecem.
+    """
+    return select(XPHistory).where(XPHistory.user_id == user_id, XPHistory.xp_amount != 0)
+
+
+# argumentos de `paginar`/`paginar_async`: mais recentes primeiro
+ORDEM_HISTORICO_XP = {"sort_col": XPHistory.created_at, "descending": True}
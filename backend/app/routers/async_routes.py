@@ -0,0 +1,95 @@
+"""Variantes assíncronas das rotas mais acessadas.
+
+Usam `AsyncSession` (asyncpg no Postgres, aiosqlite no SQLite), sem ocupar uma
+thread do threadpool enquanto esperam o banco. Só são registradas quando o engine
+assíncrono está disponível; nesse caso o `main` inclui este router antes dos
+demais, e estas rotas têm precedência sobre as versões síncronas de mesmo caminho.
+"""
+from typing import List
+
+from fastapi import APIRouter, Depends, HTTPException, Response
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from ..auth import get_current_user_async
+from ..database import get_async_session
+from ..models import Event, UserProfile, UserPublic, XPHistory
+from ..pagination import PageParams, paginar_async
+from ..ranking import TOP_RANKING, ranking, reconstruir_ranking
+from ..rewards import (
+    ORDEM_HISTORICO_XP, concessao_desafio, concessao_tempo, conceder_async, marcar_presenca_async,
+    resposta_desafio, resposta_presenca, resposta_tempo, select_historico_xp,
+)
+from ..serialization import linhas_para_json, ordenar_por_ids, resposta_json, resposta_perfil, select_publico
+
+router = APIRouter(tags=["async"])
+
+
+@router.get("/profiles/ranking", response_model=List[UserPublic])
+async def get_ranking(
+    session: AsyncSession = Depends(get_async_session),
+    current_user: UserProfile = Depends(get_current_user_async)
+):
+    """Retorna ranking de usuários por pontos"""
+    if not ranking.pronto:
+        await session.run_sync(reconstruir_ranking)
+    ids = [user_id for user_id, _ in ranking.top(TOP_RANKING)]
+    linhas = []
+    if ids:
+        resultado = await session.exec(select_publico(UserProfile.id.in_(ids)))
+        linhas = ordenar_por_ids(resultado.all(), ids)
+    return resposta_json(linhas_para_json(linhas))
+
+
+@router.get("/profiles/{profile_id}", response_model=UserPublic)
+async def get_profile(
+    profile_id: int,
+    session: AsyncSession = Depends(get_async_session),
+    current_user: UserProfile = Depends(get_current_user_async)
+):
+    """Retorna perfil público de um usuário"""
+    return resposta_perfil((await session.exec(select_publico(UserProfile.id == profile_id))).first())
+
+
+@router.post("/rewards/add-time")
+async def add_screen_free_time(
+    data: dict,
+    current_user: UserProfile = Depends(get_current_user_async),
+    session: AsyncSession = Depends(get_async_session)
+):
+    """Adiciona tempo sem tela e concede pontos (10 pontos por hora)"""
+    concessao = concessao_tempo(data)
+    return resposta_tempo(concessao, await conceder_async(session, current_user.id, concessao))
+
+
+@router.post("/rewards/complete-challenge")
+async def complete_challenge(
+    data: dict,
+    current_user: UserProfile = Depends(get_current_user_async),
+    session: AsyncSession = Depends(get_async_session)
+):
+    """Marca desafio como completo e concede pontos"""
+    concessao = concessao_desafio(data)
+    return resposta_desafio(concessao, await conceder_async(session, current_user.id, concessao))
+
+
+@router.post("/events/{event_id}/attend")
+async def attend_event(
+    event_id: int,
+    current_user: UserProfile = Depends(get_current_user_async),
+    session: AsyncSession = Depends(get_async_session)
+):
+    presenca = await marcar_presenca_async(session, current_user.id, event_id)
+    if presenca is None and await session.get(Event, event_id) is None:
+        raise HTTPException(status_code=404, detail="Event not found")
+    return resposta_presenca(presenca, current_user)
+
+
+@router.get("/users/me/xp_history", response_model=List[XPHistory])
+async def xp_history(
+    response: Response,
+    page: PageParams = Depends(),
+    current_user: UserProfile = Depends(get_current_user_async),
+    session: AsyncSession = Depends(get_async_session)
+):
+    stmt = select_historico_xp(current_user.id)
+    return await paginar_async(session, stmt, XPHistory.id, page, response, **ORDEM_HISTORICO_XP)
@@ -1,57 +1,184 @@
-from fastapi import APIRouter, Depends, HTTPException
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import and_, delete, literal, update
 from sqlmodel import Session, select
-from typing import List
+from typing import Iterable, List, Optional
 
-from ..database import get_session
-from ..models import Community, CommunityMembership, UserProfile
+from ..database import get_session, insert_ignore
+from ..models import Community, CommunityItem, CommunityMembership, RankingEntry, RankingPosition, UserProfile
 from ..auth import get_current_user
+from ..pagination import PageParams, paginar, encode_cursor, NEXT_CURSOR_HEADER
+from ..ranking import RankingIndex, obter_ranking_comunidade, posicao_no_ranking, registrar_membro
+from ..serialization import dumps, linha_para_dict, linhas_publicas_por_ids, resposta_json
+from ..sqlite_writer import executar_escrita
+from ..response_cache import response_cache, resposta_em_cache
 
 router = APIRouter(prefix="/communities", tags=["communities"])
 
 
-@router.get("/", response_model=List[Community])
-def list_communities(session: Session = Depends(get_session)):
-    return session.exec(select(Community)).all()
+# Tags do cache de respostas. "communities" vale para as listagens de todos e só é
+# invalidada quando uma comunidade é criada; entrar/sair invalida apenas a própria
+# comunidade e as listagens de quem entrou ou saiu. Nas listagens dos outros
+# usuários, o member_count dessa comunidade pode atrasar até RESPONSE_CACHE_TTL.
+def _tag_comunidade(community_id: int) -> str:
+    return f"community:{community_id}"
+
+
+def _tag_listagem(user_id: int) -> str:
+    return f"communities:u{user_id}"
+
+
+def invalidar_comunidades(community_ids: Iterable[int], user_id: Optional[int] = None) -> None:
+    """Invalida as respostas das comunidades e, com `user_id`, as listagens desse usuário"""
+    tags = [_tag_comunidade(community_id) for community_id in community_ids]
+    if user_id is not None:
+        tags.append(_tag_listagem(user_id))
+    if tags:
+        response_cache.invalidar(*tags)
+
+
+@router.get("/", response_model=List[CommunityItem])
+def list_communities(
+    request: Request,
+    page: PageParams = Depends(),
+    current_user: UserProfile = Depends(get_current_user),
+    session: Session = Depends(get_session)
+):
+    # contagem desnormalizada e flag de membro na mesma consulta (LEFT JOIN pelo índice único);
+    # como a resposta depende do usuário, a entrada de cache é por usuário
+    membro = and_(CommunityMembership.community_id == Community.id, CommunityMembership.user_id == current_user.id)
+    stmt = (
+        select(*Community.__table__.columns, CommunityMembership.id.is_not(None).label("is_member"))
+        .outerjoin(CommunityMembership, membro)
+    )
+
+    def listar(response: Response) -> list:
+        linhas = paginar(session, stmt, Community.id, page, response)
+        return [dict(linha._mapping) for linha in linhas]
+
+    return resposta_em_cache(
+        request, ("communities", _tag_listagem(current_user.id)), listar, usuario_id=current_user.id
+    )
 
 
 @router.post("/", response_model=Community)
 def create_community(data: Community, current_user: UserProfile = Depends(get_current_user), session: Session = Depends(get_session)):
     data.owner_id = current_user.id
-    session.add(data)
-    session.commit()
-    session.refresh(data)
-    return data
+    data.member_count = 0
+
+    def criar(s: Session) -> Community:
+        s.add(data)
+        s.flush()
+        return data
+
+    community = executar_escrita(criar, session)
+    response_cache.invalidar("communities")
+    return community
 
 
 @router.get("/{community_id}", response_model=Community)
-def get_community(community_id: int, session: Session = Depends(get_session)):
-    comm = session.get(Community, community_id)
-    if not comm:
-        raise HTTPException(status_code=404, detail="Community not found")
-    return comm
+def get_community(community_id: int, request: Request, session: Session = Depends(get_session)):
+    def carregar(response: Response) -> Community:
+        comm = session.get(Community, community_id)
+        if not comm:
+            raise HTTPException(status_code=404, detail="Community not found")
+        return comm
+
+    return resposta_em_cache(request, (_tag_comunidade(community_id),), carregar)
+
+
+def _entrar(s: Session, community_id: int, user_id: int) -> Optional[int]:
+    """Insere a membership e incrementa o contador; None se já era membro ou a comunidade não existe"""
+    origem = select(Community.id, literal(user_id), literal("member"), literal(datetime.utcnow())).where(Community.id == community_id)
+    membership_id = s.execute(
+        insert_ignore(CommunityMembership)
+        .from_select(["community_id", "user_id", "role", "joined_at"], origem)
+        .returning(CommunityMembership.id)
+    ).scalar_one_or_none()
+    if membership_id is not None:
+        s.execute(update(Community).where(Community.id == community_id).values(member_count=Community.member_count + 1))
+        registrar_membro(s, community_id, user_id, entrou=True)
+    return membership_id
+
+
+def _sair(s: Session, community_id: int, user_id: int) -> bool:
+    removida = s.execute(
+        delete(CommunityMembership)
+        .where(CommunityMembership.community_id == community_id, CommunityMembership.user_id == user_id)
+        .returning(CommunityMembership.id)
+    ).scalar_one_or_none()
+    if removida is None:
+        return False
+    s.execute(update(Community).where(Community.id == community_id).values(member_count=Community.member_count - 1))
+    registrar_membro(s, community_id, user_id, entrou=False)
+    return True
 
 
 @router.post("/{community_id}/join")
 def join_community(community_id: int, current_user: UserProfile = Depends(get_current_user), session: Session = Depends(get_session)):
-    comm = session.get(Community, community_id)
-    if not comm:
-        raise HTTPException(status_code=404, detail="Community not found")
-    # Check existing membership
-    existing = session.exec(select(CommunityMembership).where(CommunityMembership.community_id == community_id, CommunityMembership.user_id == current_user.id)).first()
-    if existing:
+    membership_id = executar_escrita(lambda s: _entrar(s, community_id, current_user.id), session)
+    if membership_id is None:
+        if session.get(Community, community_id) is None:
+            raise HTTPException(status_code=404, detail="Community not found")
         return {"message": "Already member"}
-    membership = CommunityMembership(community_id=community_id, user_id=current_user.id)
-    session.add(membership)
-    session.commit()
-    session.refresh(membership)
-    return {"message": "Joined", "membership_id": membership.id}
+    invalidar_comunidades([community_id], current_user.id)
+    return {"message": "Joined", "membership_id": membership_id}
 
 
 @router.post("/{community_id}/leave")
 def leave_community(community_id: int, current_user: UserProfile = Depends(get_current_user), session: Session = Depends(get_session)):
-    membership = session.exec(select(CommunityMembership).where(CommunityMembership.community_id == community_id, CommunityMembership.user_id == current_user.id)).first()
-    if not membership:
+    if not executar_escrita(lambda s: _sair(s, community_id, current_user.id), session):
         raise HTTPException(status_code=404, detail="Not a member")
-    session.delete(membership)
-    session.commit()
+    invalidar_comunidades([community_id], current_user.id)
     return {"message": "Left"}
+
+
+def _ranking_da_comunidade(session: Session, community_id: int) -> RankingIndex:
+    if session.get(Community, community_id) is None:
+        raise HTTPException(status_code=404, detail="Community not found")
+    return obter_ranking_comunidade(session, community_id)
+
+
+@router.get("/{community_id}/ranking", response_model=List[RankingEntry])
+def community_ranking(
+    community_id: int,
+    page: PageParams = Depends(),
+    current_user: UserProfile = Depends(get_current_user),
+    session: Session = Depends(get_session)
+):
+    """Ranking dos membros da comunidade por pontos, paginado por cursor"""
+    indice = _ranking_da_comunidade(session, community_id)
+    posicao = page.posicao(int)
+    if posicao is None:
+        pares = indice.top(page.limit + 1)
+    else:
+        pontos, ultimo_id = posicao
+        pares = indice.apos(pontos, ultimo_id, page.limit + 1)
+    headers = {}
+    if len(pares) > page.limit:
+        pares = pares[:page.limit]
+        ultimo_id, pontos = pares[-1]
+        headers[NEXT_CURSOR_HEADER] = encode_cursor(pontos, ultimo_id)
+    if not pares:
+        return resposta_json(dumps([]), headers)
+    primeira = indice.posicao(pares[0][0])
+    perfis = {linha[0]: linha for linha in linhas_publicas_por_ids(session, [uid for uid, _ in pares])}
+    entradas = [
+        {"posicao": primeira + k, **linha_para_dict(perfis[uid])}
+        for k, (uid, _) in enumerate(pares) if uid in perfis
+    ]
+    return resposta_json(dumps(entradas), headers)
+
+
+@router.get("/{community_id}/ranking/me", response_model=RankingPosition)
+def my_community_ranking(
+    community_id: int,
+    raio: int = Query(5, ge=0, le=50),
+    current_user: UserProfile = Depends(get_current_user),
+    session: Session = Depends(get_session)
+):
+    """Posição do usuário autenticado no ranking da comunidade e os vizinhos"""
+    resultado = posicao_no_ranking(session, _ranking_da_comunidade(session, community_id), current_user.id, raio)
+    if resultado is None:
+        raise HTTPException(status_code=404, detail="Not a member")
+    return resultado
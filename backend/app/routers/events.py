@@ -1,47 +1,54 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from sqlmodel import Session, select
 from typing import List
 
 from ..database import get_session
-from ..models import Event, XPHistory, UserProfile
+from ..models import Event, UserProfile
 from ..auth import get_current_user
+from ..pagination import PageParams, paginar
+from ..sqlite_writer import executar_escrita
+from ..rewards import marcar_presenca, resposta_presenca
+from ..response_cache import response_cache, resposta_em_cache
 
 router = APIRouter(prefix="/events", tags=["events"])
 
 
 @router.get("/", response_model=List[Event])
-def list_events(session: Session = Depends(get_session)):
-    return session.exec(select(Event)).all()
+def list_events(request: Request, page: PageParams = Depends(), session: Session = Depends(get_session)):
+    return resposta_em_cache(
+        request, ("events",),
+        lambda response: paginar(session, select(Event), Event.id, page, response),
+    )
 
 
 @router.post("/", response_model=Event)
 def create_event(data: Event, current_user: UserProfile = Depends(get_current_user), session: Session = Depends(get_session)):
     data.creator_id = current_user.id
-    session.add(data)
-    session.commit()
-    session.refresh(data)
-    return data
 
+    def criar(s: Session) -> Event:
+        s.add(data)
+        s.flush()
+        return data
 
-@router.get("/{event_id}", response_model=Event)
-def get_event(event_id: int, session: Session = Depends(get_session)):
-    event = session.get(Event, event_id)
-    if not event:
-        raise HTTPException(status_code=404, detail="Event not found")
+    event = executar_escrita(criar, session)
+    response_cache.invalidar("events")
     return event
 
 
+@router.get("/{event_id}", response_model=Event)
+def get_event(event_id: int, request: Request, session: Session = Depends(get_session)):
+    def carregar(response: Response) -> Event:
+        event = session.get(Event, event_id)
+        if not event:
+            raise HTTPException(status_code=404, detail="Event not found")
+        return event
+
+    return resposta_em_cache(request, ("events",), carregar)
+
+
 @router.post("/{event_id}/attend")
 def attend_event(event_id: int, current_user: UserProfile = Depends(get_current_user), session: Session = Depends(get_session)):
-    event = session.get(Event, event_id)
-    if not event:
+    presenca = marcar_presenca(session, current_user.id, event_id)
+    if presenca is None and session.get(Event, event_id) is None:
         raise HTTPException(status_code=404, detail="Event not found")
-    # award xp
-    xp = event.xp_reward or 0
-    current_user.adicionar_pontos(xp)
-    session.add(current_user)
-    history = XPHistory(user_id=current_user.id, event_id=event.id, type="event", xp_amount=xp)
-    session.add(history)
-    session.commit()
-    session.refresh(current_user)
-    return {"message": "Event marked as attended", "xp_awarded": xp, "total_xp": current_user.xp_total}
+    return resposta_presenca(presenca, current_user)
@@ -1,11 +1,30 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Body
+from fastapi import APIRouter, Depends, HTTPException, status, Body, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete, func, or_, update
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import Session, select
-from typing import List, Optional
+from typing import List, Optional, Tuple
 import re
 
 from ..database import get_session
-from ..models import UserProfile, UserPublic, UserCreate, UserLogin, Token, XPHistory
-from ..auth import get_current_user, hash_password, verify_password, create_access_token, user_to_public
+from ..models import (
+    Community, CommunityMembership, Event, EventAttendance, UserProfile, UserPublic, UserCreate, UserLogin, Token,
+    XPHistory
+)
+from ..auth import get_current_user, create_access_token, user_to_public
+from ..passwords import password_hasher
+from ..ranking import ranking, rankings_comunidade, obter_ranking, registrar_pontos
+from ..leaderboard import leaderboard
+from ..stats import registrar_delta
+from ..last_seen import last_seen
+from ..sqlite_writer import executar_escrita
+from ..email_service import send_welcome_email
+from ..cache_backend import ao_receber, difundir
+from ..response_cache import response_cache
+from ..pagination import PageParams, paginar, encode_cursor, NEXT_CURSOR_HEADER
+from ..serialization import dumps, linha_para_dict, linha_publica, linhas_para_json, linhas_publicas_por_ids, resposta_json
+from ..rewards import ORDEM_HISTORICO_XP, select_historico_xp
+from .communities import invalidar_comunidades
 
 router = APIRouter(prefix="/users", tags=["users"])
 
@@ -34,21 +53,37 @@ def me(current_user: UserProfile = Depends(get_current_user)):
 
 @router.get("/{user_id}", response_model=UserPublic)
 def get_user(user_id: int, session: Session = Depends(get_session)):
-    user = session.get(UserProfile, user_id)
-    if not user:
+    linha = linha_publica(session, user_id)
+    if linha is None:
         raise HTTPException(status_code=404, detail="User not found")
-    return user_to_public(user)
+    return resposta_json(dumps(linha_para_dict(linha)))
 
 
 @router.get("", response_model=List[UserPublic])
-def list_users(current_user: UserProfile = Depends(get_current_user), session: Session = Depends(get_session)):
-    """Listar todos os usuários para ranking (requer autenticação)"""
-    users = session.exec(select(UserProfile).order_by(UserProfile.pontos.desc())).all()
-    return [user_to_public(user) for user in users]
+def list_users(
+    page: PageParams = Depends(),
+    current_user: UserProfile = Depends(get_current_user),
+    session: Session = Depends(get_session)
+):
+    """Listar usuários na ordem do ranking, paginado por cursor (requer autenticação)"""
+    indice = obter_ranking(session)
+    posicao = page.posicao(int)
+    if posicao is None:
+        pares = indice.top(page.limit + 1)
+    else:
+        pontos, ultimo_id = posicao
+        pares = indice.apos(pontos, ultimo_id, page.limit + 1)
+    headers = {}
+    if len(pares) > page.limit:
+        pares = pares[:page.limit]
+        ultimo_id, pontos = pares[-1]
+        headers[NEXT_CURSOR_HEADER] = encode_cursor(pontos, ultimo_id)
+    ids = [user_id for user_id, _ in pares]
+    return resposta_json(linhas_para_json(linhas_publicas_por_ids(session, ids)), headers)
 
 
 @router.post("/register", response_model=Token, status_code=201)
-def register(user_data: UserCreate, session: Session = Depends(get_session)):
+async def register(user_data: UserCreate, session: Session = Depends(get_session)):
     # Validar username (como @instagram)
     valid, msg = validate_username(user_data.username)
     if not valid:
@@ -59,60 +94,101 @@ def register(user_data: UserCreate, session: Session = Depends(get_session)):
     if not valid:
         raise HTTPException(status_code=400, detail=msg)
     
-    # Verificar username único (case-insensitive)
-    existing_user = session.exec(
-        select(UserProfile).where(UserProfile.username.ilike(user_data.username))
-    ).first()
-    if existing_user:
+    # Acesso ao banco roda no threadpool; o hash da senha roda no pool de processos
+    await run_in_threadpool(_verificar_disponibilidade, session, user_data)
+    password_hash = await password_hasher.hash(user_data.password)
+    user = await run_in_threadpool(_criar_usuario, session, user_data, password_hash)
+    # apenas enfileira; a entrega acontece em segundo plano
+    send_welcome_email(user.email, user.name, user.id)
+    
+    token = create_access_token({"sub": user.username})
+    return Token(access_token=token, token_type="bearer", user=user)
+
+
+def _verificar_disponibilidade(session: Session, user_data: UserCreate) -> None:
+    """Verifica username e email (case-insensitive) em uma única consulta indexada"""
+    username_lower = func.lower(UserProfile.username) == user_data.username.lower()
+    email_lower = func.lower(UserProfile.email) == user_data.email.lower()
+    conflitos = session.exec(
+        select(username_lower, email_lower).where(or_(username_lower, email_lower)).limit(2)
+    ).all()
+    if any(username_em_uso for username_em_uso, _ in conflitos):
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail=f"Username '@{user_data.username}' já está em uso"
         )
-    
-    # Verificar email único (case-insensitive)
-    existing_email = session.exec(
-        select(UserProfile).where(UserProfile.email.ilike(user_data.email))
-    ).first()
-    if existing_email:
+    if conflitos:
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail="Email já está cadastrado"
         )
-    
-    # Criar novo usuário
-    user = UserProfile(
-        username=user_data.username,
-        name=user_data.name,
-        email=user_data.email,
-        phone=user_data.phone,
-        password_hash=hash_password(user_data.password)
-    )
-    session.add(user)
-    session.commit()
-    session.refresh(user)
-    
-    token = create_access_token({"sub": user.username})
-    return Token(access_token=token, token_type="bearer", user=user_to_public(user))
 
 
+def _criar_usuario(session: Session, user_data: UserCreate, password_hash: str) -> UserPublic:
+    def criar(s: Session) -> UserProfile:
+        user = UserProfile(
+            username=user_data.username,
+            name=user_data.name,
+            email=user_data.email,
+            phone=user_data.phone,
+            password_hash=password_hash
+        )
+        s.add(user)
+        s.flush()
+        registrar_delta(s, usuarios=1, pontos=user.pontos)
+        registrar_pontos(s, user.id, user.pontos)
+        return user
+
+    try:
+        user = executar_escrita(criar, session)
+    except IntegrityError:
+        # outro cadastro com o mesmo username/email foi confirmado durante o hash da senha
+        session.rollback()
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Username ou email já está em uso")
+    return user_to_public(user)
 
 
 @router.post("/login", response_model=Token)
-def login(credentials: UserLogin, session: Session = Depends(get_session)):
-    user = session.exec(select(UserProfile).where(UserProfile.username.ilike(credentials.username))).first()
-    if not user or not verify_password(credentials.password, user.password_hash):
+async def login(credentials: UserLogin, session: Session = Depends(get_session)):
+    user = await run_in_threadpool(
+        lambda: session.exec(
+            select(UserProfile).where(func.lower(UserProfile.username) == credentials.username.lower())
+        ).first()
+    )
+    if not user:
         raise HTTPException(status_code=401, detail="Username ou senha incorretos")
-    from datetime import datetime
-    user.ultimo_acesso = datetime.utcnow()
-    session.add(user)
-    session.commit()
-    token = create_access_token({"sub": user.username})
-    return Token(access_token=token, token_type="bearer", user=user_to_public(user))
+    valid, new_hash = await password_hasher.verify_and_update(credentials.password, user.password_hash)
+    if not valid:
+        raise HTTPException(status_code=401, detail="Username ou senha incorretos")
+    publico = user_to_public(user)
+    if new_hash:
+        # hash com parâmetros antigos: regravar com os parâmetros atuais
+        await run_in_threadpool(_atualizar_hash, session, user.id, new_hash)
+    # pode disparar o flush do buffer (UPDATE no banco): fora do event loop
+    await run_in_threadpool(last_seen.registrar, publico.id)
+    token = create_access_token({"sub": publico.username})
+    return Token(access_token=token, token_type="bearer", user=publico)
+
+
+def _atualizar_hash(session: Session, user_id: int, new_hash: str) -> None:
+    executar_escrita(
+        lambda s: s.execute(
+            update(UserProfile).where(UserProfile.id == user_id).values(password_hash=new_hash)
+            .execution_options(synchronize_session=False)
+        ),
+        session,
+    )
 
 
 @router.get("/me/xp_history", response_model=List[XPHistory])
-def xp_history(current_user: UserProfile = Depends(get_current_user), session: Session = Depends(get_session)):
-    return session.exec(select(XPHistory).where(XPHistory.user_id == current_user.id).order_by(XPHistory.created_at.desc())).all()
+def xp_history(
+    response: Response,
+    page: PageParams = Depends(),
+    current_user: UserProfile = Depends(get_current_user),
+    session: Session = Depends(get_session)
+):
+    stmt = select_historico_xp(current_user.id)
+    return paginar(session, stmt, XPHistory.id, page, response, **ORDEM_HISTORICO_XP)
 
 
 @router.put("/me", response_model=UserPublic)
@@ -124,35 +200,96 @@ def update_current_user(
     session: Session = Depends(get_session)
 ):
     """Atualizar dados do usuário atual"""
-    if name is not None:
-        current_user.name = name
+    campos = {"name": name, "email": email, "phone": phone}
+    return atualizar_dados(session, current_user.id, {k: v for k, v in campos.items() if v is not None})
+
+
+def atualizar_dados(session: Session, user_id: int, campos: dict) -> UserPublic:
+    """Grava name/email/phone do usuário (PUT /users/me e PUT /profiles/me)
+
+    O email é validado e conferido sem diferenciar maiúsculas. Se outra conta
+    confirmar o mesmo email entre a verificação e o commit, o índice único em
+    `lower(email)` recusa a escrita e a resposta também é 409.
+    """
+    email = campos.get("email")
     if email is not None:
-        # Validar email
-        valid, msg = validate_email(email)
+        valid, msg = validate_email(email) if isinstance(email, str) else (False, "Email inválido")
         if not valid:
             raise HTTPException(status_code=400, detail=msg)
-        # Verificar se email já existe (exceto o dele)
-        existing_email = session.exec(
-            select(UserProfile).where(
-                UserProfile.email.ilike(email),
-                UserProfile.id != current_user.id
-            )
+        em_uso = session.exec(
+            select(UserProfile.id).where(func.lower(UserProfile.email) == email.lower(), UserProfile.id != user_id)
         ).first()
-        if existing_email:
-            raise HTTPException(status_code=409, detail="Email já está em uso")
-        current_user.email = email
-    if phone is not None:
-        current_user.phone = phone
-    
-    session.add(current_user)
-    session.commit()
-    session.refresh(current_user)
-    return user_to_public(current_user)
+        if em_uso is not None:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Email já está em uso")
+
+    def atualizar(s: Session) -> UserProfile:
+        user = s.get(UserProfile, user_id)
+        for campo, valor in campos.items():
+            setattr(user, campo, valor)
+        user.touch()
+        s.add(user)
+        return user
+
+    try:
+        user = executar_escrita(atualizar, session)
+    except IntegrityError:
+        session.rollback()
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Email já está em uso")
+    return user_to_public(user)
 
 
 @router.delete("/me", status_code=204)
 def delete_current_user(current_user: UserProfile = Depends(get_current_user), session: Session = Depends(get_session)):
     """Deletar usuário atual"""
-    session.delete(current_user)
-    session.commit()
+    user_id = current_user.id
+
+    def remover(s: Session) -> Tuple[List[int], List[int]]:
+        user = s.get(UserProfile, user_id)
+        registrar_delta(
+            s,
+            usuarios=-1,
+            pontos=-user.pontos,
+            tempo_sem_tela_minutos=-user.tempo_sem_tela_minutos,
+            desafios_completados=-user.desafios_completados,
+        )
+        # dependentes primeiro: sem ON DELETE CASCADE (tabelas do create_all) o Postgres recusaria o DELETE
+        comunidades = s.execute(
+            delete(CommunityMembership)
+            .where(CommunityMembership.user_id == user_id)
+            .returning(CommunityMembership.community_id)
+        ).scalars().all()
+        if comunidades:
+            s.execute(
+                update(Community)
+                .where(Community.id.in_(comunidades))
+                .values(member_count=Community.member_count - 1)
+            )
+        sem_dono = s.execute(
+            update(Community).where(Community.owner_id == user_id).values(owner_id=None).returning(Community.id)
+        ).scalars().all()
+        # os eventos criados pelo usuário saem com as presenças; o XP que os participantes
+        # ganharam neles continua no histórico deles, sem a referência ao evento
+        eventos = select(Event.id).where(Event.creator_id == user_id)
+        s.execute(delete(EventAttendance).where(
+            or_(EventAttendance.user_id == user_id, EventAttendance.event_id.in_(eventos))
+        ))
+        s.execute(delete(XPHistory).where(XPHistory.user_id == user_id))
+        s.execute(update(XPHistory).where(XPHistory.event_id.in_(eventos)).values(event_id=None))
+        eventos_removidos = s.execute(delete(Event).where(Event.creator_id == user_id).returning(Event.id)).scalars().all()
+        s.delete(user)
+        return sorted(set(comunidades) | set(sem_dono)), eventos_removidos
+
+    comunidades, eventos = executar_escrita(remover, session)
+    invalidar_comunidades(comunidades)
+    if eventos:
+        response_cache.invalidar("events")
+    _remover_dos_indices(user_id)
+    difundir("usuario_removido", [(user_id,)])
     return None
+
+
+@ao_receber("usuario_removido")
+def _remover_dos_indices(user_id: int) -> None:
+    ranking.remover(user_id)
+    rankings_comunidade.remover_usuario(user_id)
+    leaderboard.remover(user_id)
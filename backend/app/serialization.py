@@ -0,0 +1,81 @@
+"""Projeção e serialização rápida de perfis públicos direto para JSON.
+
+As leituras públicas de usuários selecionam apenas as colunas de `UserPublic`
+(tuplas, sem `password_hash`/`phone` e sem montar entidades no identity map do ORM)
+e convertem as linhas em bytes JSON de uma vez, com orjson quando disponível. A
+resposta é devolvida pronta, sem passar de novo pela validação do
+`response_model`. O formato é o mesmo produzido pelo FastAPI.
+"""
+import json
+from datetime import date, datetime
+from typing import Any, Iterable, List, Optional, Sequence
+
+from fastapi import HTTPException, Response
+from sqlmodel import Session, select
+
+from .models import UserProfile, UserPublic
+
+try:
+    import orjson
+except ImportError:  # fallback para o json da biblioteca padrão
+    orjson = None
+
+CAMPOS_PUBLICOS = tuple(UserPublic.model_fields)
+COLUNAS_PUBLICAS = tuple(getattr(UserProfile, campo) for campo in CAMPOS_PUBLICOS)
+
+
+def _padrao(valor: Any) -> Any:
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    raise TypeError(f"Tipo não serializável: {type(valor).__name__}")
+
+
+def dumps(conteudo: Any) -> bytes:
+    """Serializa tipos nativos (dict, list, str, números, datetime) para JSON"""
+    if orjson is not None:
+        return orjson.dumps(conteudo)
+    return json.dumps(conteudo, ensure_ascii=False, separators=(",", ":"), default=_padrao).encode("utf-8")
+
+
+def select_publico(*filtros):
+    """SELECT apenas das colunas públicas de `UserProfile`"""
+    return select(*COLUNAS_PUBLICAS).where(*filtros)
+
+
+def linha_para_dict(linha: Sequence[Any], campos: Sequence[str] = CAMPOS_PUBLICOS) -> dict:
+    return dict(zip(campos, linha))
+
+
+def linhas_para_json(linhas: Iterable[Sequence[Any]], campos: Sequence[str] = CAMPOS_PUBLICOS) -> bytes:
+    """Converte linhas (tuplas na ordem de `campos`) em um array JSON de objetos"""
+    return dumps([linha_para_dict(linha, campos) for linha in linhas])
+
+
+def linha_publica(session: Session, user_id: int) -> Optional[Sequence[Any]]:
+    """Colunas públicas de um perfil, ou None se não existir"""
+    return session.exec(select_publico(UserProfile.id == user_id)).first()
+
+
+def resposta_perfil(linha: Optional[Sequence[Any]]) -> Response:
+    """Resposta JSON de um perfil público; 404 se a linha não existe"""
+    if linha is None:
+        raise HTTPException(status_code=404, detail="Perfil não encontrado")
+    return resposta_json(dumps(linha_para_dict(linha)))
+
+
+def linhas_publicas_por_ids(session: Session, ids: List[int]) -> list:
+    """Carrega as colunas públicas dos perfis em uma consulta, na ordem de `ids`"""
+    if not ids:
+        return []
+    linhas = session.exec(select_publico(UserProfile.id.in_(ids))).all()
+    return ordenar_por_ids(linhas, ids)
+
+
+def ordenar_por_ids(linhas: Iterable[Sequence[Any]], ids: List[int]) -> list:
+    # `id` é sempre a primeira coluna de CAMPOS_PUBLICOS
+    por_id = {linha[0]: linha for linha in linhas}
+    return [por_id[i] for i in ids if i in por_id]
+
+
+def resposta_json(corpo: bytes, headers: dict = None) -> Response:
+    return Response(content=corpo, media_type="application/json", headers=headers)
@@ -0,0 +1,207 @@
+"""Perfil das consultas SQL por requisição (modo de desenvolvimento).
+
+Com `SQL_PROFILE=1`, cada requisição guarda todas as instruções executadas com o
+tempo de cada uma. Ao final:
+
+- formas repetidas (mesmo SQL com parâmetros diferentes, executado pelo menos
+  `SQL_PROFILE_REPEAT` vezes) são marcadas como possível N+1;
+- instruções acima de `SQL_PROFILE_SLOW_MS` são logadas com o plano (`EXPLAIN
+  QUERY PLAN` no SQLite, `EXPLAIN` no Postgres, sem executar a instrução);
+- um relatório JSON da requisição é anexado a `SQL_PROFILE_DIR/sql-profile-<pid>.jsonl`.
+
+`python -m app.sql_profiler <arquivos.jsonl>` agrega os relatórios por rota em um
+resumo estável (ordenado, sem tempos individuais) para comparar entre versões.
+Fora desse modo nenhum listener é registrado.
+"""
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+
+SQL_PROFILE = os.getenv("SQL_PROFILE", "0") == "1"
+SQL_PROFILE_SLOW_MS = float(os.getenv("SQL_PROFILE_SLOW_MS", 100))
+SQL_PROFILE_REPEAT = int(os.getenv("SQL_PROFILE_REPEAT", 3))
+SQL_PROFILE_DIR = os.getenv("SQL_PROFILE_DIR", "./sql-profile")
+
+_INSTRUCOES_COM_PLANO = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+# placeholders dos drivers: ? (sqlite), %(nome)s/%s (psycopg2), $1 (asyncpg)
+_PARAMETRO = re.compile(r"%\(\w+\)s|%s|\$\d+")
+_LISTA_DE_PARAMETROS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_ESPACOS = re.compile(r"\s+")
+
+
+def forma(statement: str) -> str:
+    """Normaliza a instrução para agrupar execuções que só mudam os valores"""
+    sql = _ESPACOS.sub(" ", statement).strip()
+    sql = _LITERAL.sub("?", _PARAMETRO.sub("?", sql))
+    # IN com quantidades diferentes de valores é a mesma forma
+    return _LISTA_DE_PARAMETROS.sub("(?, ...)", sql)
+
+
+class Consulta:
+    __slots__ = ("statement", "parametros", "duracao", "dialeto")
+
+    def __init__(self, statement: str, parametros, duracao: float, dialeto: str):
+        self.statement = statement
+        self.parametros = parametros
+        self.duracao = duracao
+        self.dialeto = dialeto
+
+
+class PerfilRequisicao:
+    def __init__(self, metodo: str, caminho: str):
+        self.metodo = metodo
+        self.caminho = caminho
+        self.inicio = time.perf_counter()
+        self.consultas: List[Consulta] = []
+
+
+_atual: ContextVar[Optional[PerfilRequisicao]] = ContextVar("perfil_sql", default=None)
+
+
+def iniciar_requisicao(metodo: str, caminho: str):
+    perfil = PerfilRequisicao(metodo, caminho)
+    return perfil, _atual.set(perfil)
+
+
+def encerrar_requisicao(token) -> None:
+    _atual.reset(token)
+
+
+def antes_da_consulta(conn, cursor, statement, parameters, context, executemany) -> None:
+    if context is not None and _atual.get() is not None:
+        context._perfil_inicio = time.perf_counter()
+
+
+def depois_da_consulta(conn, cursor, statement, parameters, context, executemany) -> None:
+    perfil = _atual.get()
+    inicio = getattr(context, "_perfil_inicio", None)
+    if perfil is None or inicio is None:
+        return
+    if executemany and parameters:
+        parameters = parameters[0]
+    perfil.consultas.append(Consulta(statement, parameters, time.perf_counter() - inicio, conn.dialect.name))
+
+
+def instrumentar(engine) -> None:
+    """Registra os listeners no engine (síncrono, ou `sync_engine` de um assíncrono)"""
+    event.listen(engine, "before_cursor_execute", antes_da_consulta)
+    event.listen(engine, "after_cursor_execute", depois_da_consulta)
+
+
+def _plano(engine, consulta: Consulta) -> List[str]:
+    """Plano da instrução sem executá-la (não usa EXPLAIN ANALYZE)"""
+    if not consulta.statement.lstrip().upper().startswith(_INSTRUCOES_COM_PLANO):
+        return []
+    if consulta.dialeto == "sqlite":
+        prefixo = "EXPLAIN QUERY PLAN "
+    elif consulta.dialeto == "postgresql":
+        prefixo = "EXPLAIN "
+    else:
+        return []
+    try:
+        with engine.connect() as conn:
+            linhas = conn.exec_driver_sql(prefixo + consulta.statement, consulta.parametros or ()).all()
+    except Exception as e:
+        # ex.: parâmetros no estilo do asyncpg ($1) não servem ao driver síncrono
+        return [f"EXPLAIN indisponível: {e}"]
+    if consulta.dialeto == "sqlite":
+        # (id, parent, notused, detail)
+        return [linha[-1] for linha in linhas]
+    return [linha[0] for linha in linhas]
+
+
+def montar_relatorio(perfil: PerfilRequisicao, rota: str, status: int, engine) -> dict:
+    formas: Dict[str, List[Consulta]] = defaultdict(list)
+    for consulta in perfil.consultas:
+        formas[forma(consulta.statement)].append(consulta)
+
+    repetidas = [
+        {"sql": sql, "vezes": len(consultas), "ms": round(sum(c.duracao for c in consultas) * 1000, 3)}
+        for sql, consultas in formas.items()
+        if len(consultas) >= SQL_PROFILE_REPEAT
+    ]
+    lentas = [
+        {"sql": c.statement, "ms": round(c.duracao * 1000, 3), "plano": _plano(engine, c)}
+        for c in perfil.consultas
+        if c.duracao * 1000 >= SQL_PROFILE_SLOW_MS
+    ]
+    return {
+        "quando": datetime.utcnow().isoformat(timespec="seconds"),
+        "metodo": perfil.metodo,
+        "rota": rota,
+        "caminho": perfil.caminho,
+        "status": status,
+        "ms": round((time.perf_counter() - perfil.inicio) * 1000, 3),
+        "consultas": len(perfil.consultas),
+        "db_ms": round(sum(c.duracao for c in perfil.consultas) * 1000, 3),
+        "formas": [
+            {"sql": sql, "vezes": len(consultas), "ms": round(sum(c.duracao for c in consultas) * 1000, 3)}
+            for sql, consultas in formas.items()
+        ],
+        "repetidas": repetidas,
+        "lentas": lentas,
+    }
+
+
+_lock_arquivo = threading.Lock()
+
+
+def registrar(perfil: PerfilRequisicao, rota: str, status: int, engine) -> dict:
+    """Monta o relatório, loga N+1 e consultas lentas e anexa ao arquivo do processo"""
+    relatorio = montar_relatorio(perfil, rota, status, engine)
+    for item in relatorio["repetidas"]:
+        print(f"[SQL N+1] {perfil.metodo} {rota}: {item['vezes']}x ({item['ms']} ms) {item['sql']}")
+    for item in relatorio["lentas"]:
+        plano = "\n    ".join(item["plano"])
+        print(f"[SQL LENTA] {perfil.metodo} {rota}: {item['ms']} ms {item['sql']}\n    {plano}")
+    os.makedirs(SQL_PROFILE_DIR, exist_ok=True)
+    caminho = os.path.join(SQL_PROFILE_DIR, f"sql-profile-{os.getpid()}.jsonl")
+    linha = json.dumps(relatorio, ensure_ascii=False, sort_keys=True)
+    with _lock_arquivo, open(caminho, "a", encoding="utf-8") as arquivo:
+        arquivo.write(linha + "\n")
+    return relatorio
+
+
+def resumir(caminhos: List[str]) -> dict:
+    """Agrega relatórios por rota: requisições, consultas (média e máximo) e formas de SQL"""
+    rotas: Dict[str, dict] = {}
+    for caminho in caminhos:
+        with open(caminho, encoding="utf-8") as arquivo:
+            for linha in arquivo:
+                relatorio = json.loads(linha)
+                chave = f"{relatorio['metodo']} {relatorio['rota']}"
+                rota = rotas.setdefault(chave, {"requisicoes": 0, "consultas": 0, "max_consultas": 0, "formas": {}, "n_mais_1": set()})
+                rota["requisicoes"] += 1
+                rota["consultas"] += relatorio["consultas"]
+                rota["max_consultas"] = max(rota["max_consultas"], relatorio["consultas"])
+                for item in relatorio["formas"]:
+                    rota["formas"][item["sql"]] = max(rota["formas"].get(item["sql"], 0), item["vezes"])
+                rota["n_mais_1"].update(item["sql"] for item in relatorio["repetidas"])
+    return {
+        chave: {
+            "requisicoes": rota["requisicoes"],
+            "media_consultas": round(rota["consultas"] / rota["requisicoes"], 2),
+            "max_consultas": rota["max_consultas"],
+            "formas": dict(sorted(rota["formas"].items())),
+            "n_mais_1": sorted(rota["n_mais_1"]),
+        }
+        for chave, rota in sorted(rotas.items())
+    }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Uso: python -m app.sql_profiler <sql-profile-*.jsonl> [...]")
+        sys.exit(1)
+    print(json.dumps(resumir(sys.argv[1:]), ensure_ascii=False, indent=2))
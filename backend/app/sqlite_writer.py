@@ -0,0 +1,159 @@
+"""Escritor único para SQLite com group commit.
+
+O SQLite aceita um único escritor por vez; com várias threads do threadpool
+disputando o lock o resultado é "database is locked". No modo de performance
+(`SQLITE_PERFORMANCE_MODE`), toda escrita passa por `executar_escrita`, que
+enfileira a transação para uma thread dedicada. Essa thread executa as transações
+enfileiradas em lote, na mesma conexão, e confirma todas com um único commit.
+Leituras continuam concorrentes nas conexões do pool (WAL).
+
+Fora desse modo (ex.: Postgres), `executar_escrita` simplesmente executa a
+função na sessão da requisição e faz o commit.
+"""
+import contextvars
+import functools
+import os
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Callable, List, Optional, Tuple, TypeVar
+
+from sqlmodel import Session
+
+from .database import engine
+
+T = TypeVar("T")
+
+SQLITE_WRITER_BATCH = int(os.getenv("SQLITE_WRITER_BATCH", 64))
+SQLITE_WRITER_TIMEOUT = float(os.getenv("SQLITE_WRITER_TIMEOUT", 30))
+
+_PARAR = object()
+
+
+class SQLiteWriter:
+    def __init__(self, max_lote: int = SQLITE_WRITER_BATCH, engine=engine):
+        self.max_lote = max_lote
+        self.engine = engine
+        self._fila: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self.lotes = 0
+        self.transacoes = 0
+
+    @property
+    def ativo(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def iniciar(self) -> None:
+        if self.ativo:
+            return
+        self._thread = threading.Thread(target=self._loop, name="sqlite-writer", daemon=True)
+        self._thread.start()
+
+    def parar(self) -> None:
+        if not self.ativo:
+            return
+        self._fila.put(_PARAR)
+        self._thread.join()
+        self._thread = None
+
+    def submeter(self, fn: Callable[[Session], T]) -> T:
+        """Enfileira a transação e aguarda o commit do lote que a contém
+
+        Depois de `SQLITE_WRITER_TIMEOUT` segundos na fila, a transação é cancelada
+        e `TimeoutError` é levantado. Se a thread escritora já a tiver pegado, não
+        há como desistir sem mentir para o cliente: espera o resultado real.
+        """
+        if threading.current_thread() is self._thread:
+            # chamada reentrante a partir de uma transação em execução
+            raise RuntimeError("executar_escrita chamada de dentro da thread escritora")
+        future: Future = Future()
+        # roda no contexto de quem submeteu (ex.: métricas da requisição)
+        fn = functools.partial(contextvars.copy_context().run, fn)
+        self._fila.put((fn, future))
+        try:
+            return future.result(timeout=SQLITE_WRITER_TIMEOUT)
+        except FutureTimeoutError:
+            if future.cancel():
+                # ainda na fila: a thread escritora vai descartá-la
+                raise
+        return future.result()
+
+    def _loop(self) -> None:
+        while True:
+            item = self._fila.get()
+            if item is _PARAR:
+                return
+            lote = [item]
+            parar = False
+            while len(lote) < self.max_lote:
+                try:
+                    item = self._fila.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _PARAR:
+                    parar = True
+                    break
+                lote.append(item)
+            self._executar_lote(lote)
+            if parar:
+                return
+
+    def _executar_lote(self, lote: List[Tuple[Callable, Future]]) -> None:
+        # descarta as canceladas por timeout; as demais não podem mais ser canceladas
+        lote = [(fn, future) for fn, future in lote if future.set_running_or_notify_cancel()]
+        if not lote:
+            return
+        self.lotes += 1
+        self.transacoes += len(lote)
+        resultados = []
+        with Session(self.engine, expire_on_commit=False) as session:
+            try:
+                for fn, future in lote:
+                    resultados.append((future, fn(session)))
+                session.commit()
+            except Exception:
+                # uma transação do lote falhou: desfaz tudo e executa uma a uma
+                session.rollback()
+                self._executar_individualmente(lote)
+                return
+        for future, resultado in resultados:
+            future.set_result(resultado)
+
+    def _executar_individualmente(self, lote: List[Tuple[Callable, Future]]) -> None:
+        for fn, future in lote:
+            with Session(self.engine, expire_on_commit=False) as session:
+                try:
+                    resultado = fn(session)
+                    session.commit()
+                except Exception as e:
+                    session.rollback()
+                    future.set_exception(e)
+                else:
+                    future.set_result(resultado)
+
+
+writer = SQLiteWriter()
+
+
+def executar_escrita(fn: Callable[[Session], T], session: Optional[Session] = None) -> T:
+    """Executa `fn(session)` em uma transação de escrita e faz o commit
+
+    Com o escritor do SQLite ativo, a transação vai para a thread escritora;
+    caso contrário, usa a sessão informada (ou uma nova). Nos dois casos os
+    objetos retornados por `fn` continuam carregados após o commit.
+    """
+    if writer.ativo:
+        return writer.submeter(fn)
+    if session is None:
+        with Session(engine, expire_on_commit=False) as nova:
+            resultado = fn(nova)
+            nova.commit()
+            return resultado
+    expire_on_commit = session.expire_on_commit
+    session.expire_on_commit = False
+    try:
+        resultado = fn(session)
+        session.commit()
+    finally:
+        session.expire_on_commit = expire_on_commit
+    return resultado
@@ -0,0 +1,116 @@
+"""Contadores globais da plataforma mantidos em memória.
+
+Os totais são ajustados por deltas registrados na sessão e aplicados somente após
+o commit da transação (descartados em rollback). Periodicamente os valores são
+reconciliados com um `COUNT/SUM` no banco para corrigir qualquer divergência.
+Os deltas confirmados também são difundidos para os outros workers.
+"""
+import asyncio
+import os
+import threading
+from collections import Counter
+from typing import Dict
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session as SASession
+from sqlmodel import Session, select
+
+from .cache_backend import ao_receber, difundir
+from .database import engine
+
+STATS_RECONCILE_SECONDS = int(os.getenv("STATS_RECONCILE_SECONDS", 300))
+
+CAMPOS = ("usuarios", "pontos", "tempo_sem_tela_minutos", "desafios_completados")
+
+_SESSION_KEY = "stats_deltas"
+
+
+class GlobalStats:
+    """Totais globais (usuários, pontos, minutos sem tela, desafios)"""
+
+    def __init__(self):
+        self._totais: Dict[str, int] = dict.fromkeys(CAMPOS, 0)
+        self._lock = threading.Lock()
+        self.pronto = False
+
+    def carregar(self, **totais: int) -> None:
+        with self._lock:
+            self._totais = {campo: int(totais.get(campo) or 0) for campo in CAMPOS}
+            self.pronto = True
+
+    def aplicar(self, deltas: Dict[str, int]) -> None:
+        with self._lock:
+            for campo, valor in deltas.items():
+                self._totais[campo] += valor
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._totais)
+
+
+global_stats = GlobalStats()
+
+
+def registrar_delta(session: Session, **deltas: int) -> None:
+    """Agenda um ajuste nos totais para quando a transação da sessão for confirmada"""
+    pendentes = session.info.setdefault(_SESSION_KEY, Counter())
+    pendentes.update(deltas)
+
+
+@event.listens_for(SASession, "after_commit")
+def _aplicar_deltas(session) -> None:
+    pendentes = session.info.pop(_SESSION_KEY, None)
+    if pendentes:
+        global_stats.aplicar(pendentes)
+        difundir("stats", [(dict(pendentes),)])
+
+
+@ao_receber("stats")
+def _aplicar_deltas_de_outro_worker(deltas: Dict[str, int]) -> None:
+    global_stats.aplicar(deltas)
+
+
+@event.listens_for(SASession, "after_rollback")
+def _descartar_deltas(session) -> None:
+    session.info.pop(_SESSION_KEY, None)
+
+
+def reconciliar(session: Session) -> None:
+    """Recalcula os totais diretamente no banco"""
+    from .models import UserProfile
+
+    usuarios, pontos, tempo, desafios = session.exec(
+        select(
+            func.count(UserProfile.id),
+            func.coalesce(func.sum(UserProfile.pontos), 0),
+            func.coalesce(func.sum(UserProfile.tempo_sem_tela_minutos), 0),
+            func.coalesce(func.sum(UserProfile.desafios_completados), 0),
+        )
+    ).one()
+    global_stats.carregar(
+        usuarios=usuarios,
+        pontos=pontos,
+        tempo_sem_tela_minutos=tempo,
+        desafios_completados=desafios,
+    )
+
+
+def obter_stats(session: Session) -> Dict[str, int]:
+    if not global_stats.pronto:
+        reconciliar(session)
+    return global_stats.snapshot()
+
+
+def _reconciliar_com_nova_sessao() -> None:
+    with Session(engine) as session:
+        reconciliar(session)
+
+
+async def reconciliar_periodicamente(intervalo: int = STATS_RECONCILE_SECONDS) -> None:
+    """Loop de fundo que reconcilia os totais a cada `intervalo` segundos"""
+    while True:
+        await asyncio.sleep(intervalo)
+        try:
+            await asyncio.to_thread(_reconciliar_com_nova_sessao)
+        except Exception as e:
+            print(f"Erro ao reconciliar estatísticas globais: {e}")
@@ -0,0 +1,79 @@
+"""Cache LRU de tokens JWT já verificados.
+
+Chaveado pelo SHA-256 do token (o token em si não fica em memória). Cada entrada
+expira junto com o `exp` do token, então um token expirado nunca é servido do
+cache. Seguro para acesso concorrente a partir do threadpool.
+"""
+import hashlib
+import heapq
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 10000))
+
+
+class TokenCache:
+    def __init__(self, maxsize: int = TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entradas: "OrderedDict[bytes, Tuple[float, dict]]" = OrderedDict()
+        self._expiracoes: List[Tuple[float, bytes]] = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _digest(token: str) -> bytes:
+        return hashlib.sha256(token.encode("utf-8")).digest()
+
+    def get(self, token: str) -> Optional[dict]:
+        chave = self._digest(token)
+        agora = time.time()
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is None or entrada[0] <= agora:
+                if entrada is not None:
+                    del self._entradas[chave]
+                self.misses += 1
+                return None
+            self._entradas.move_to_end(chave)
+            self.hits += 1
+            return dict(entrada[1])
+
+    def put(self, token: str, payload: dict) -> None:
+        exp = payload.get("exp")
+        if exp is None or self.maxsize <= 0:
+            return
+        chave = self._digest(token)
+        with self._lock:
+            self._entradas[chave] = (float(exp), dict(payload))
+            self._entradas.move_to_end(chave)
+            heapq.heappush(self._expiracoes, (float(exp), chave))
+            self._remover_expirados(time.time())
+            while len(self._entradas) > self.maxsize:
+                self._entradas.popitem(last=False)
+            # o heap pode acumular chaves já removidas pelo LRU; reconstruir quando crescer demais
+            if len(self._expiracoes) > 2 * self.maxsize:
+                self._expiracoes = [(e[0], k) for k, e in self._entradas.items()]
+                heapq.heapify(self._expiracoes)
+
+    def _remover_expirados(self, agora: float) -> None:
+        while self._expiracoes and self._expiracoes[0][0] <= agora:
+            exp, chave = heapq.heappop(self._expiracoes)
+            entrada = self._entradas.get(chave)
+            if entrada is not None and entrada[0] <= agora:
+                del self._entradas[chave]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entradas.clear()
+            self._expiracoes.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._entradas), "hits": self.hits, "misses": self.misses}
+
+
+token_cache = TokenCache()
@@ -0,0 +1,83 @@
+"""Benchmark da serialização da listagem de usuários.
+
+Compara o caminho antigo (entidades do ORM -> `user_to_public` -> validação do
+`response_model` -> JSON) com o caminho rápido (tuplas de colunas -> bytes JSON).
+Usa um banco SQLite temporário; não toca no `app.db`.
+
+Uso: python bench_serialization.py [quantidade_de_usuarios] [repeticoes]
+"""
+import os
+import sys
+import tempfile
+import time
+from typing import List
+
+_tmp = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp}/bench.db"
+os.environ.setdefault("SQLITE_PERFORMANCE_MODE", "0")
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+from sqlmodel import Session, select  # noqa: E402
+
+from app.auth import user_to_public  # noqa: E402
+from app.database import engine, init_db  # noqa: E402
+from app.models import UserProfile, UserPublic  # noqa: E402
+from app.serialization import COLUNAS_PUBLICAS, dumps, linhas_para_json, orjson  # noqa: E402
+
+
+def popular(quantidade: int) -> None:
+    init_db()
+    linhas = [
+        {
+            "username": f"user{i}",
+            "name": f"Usuário {i}",
+            "email": f"user{i}@example.com",
+            "password_hash": "x",
+            "pontos": i * 7 % 1000,
+        }
+        for i in range(quantidade)
+    ]
+    with Session(engine) as session:
+        session.execute(insert(UserProfile), linhas)
+        session.commit()
+
+
+def caminho_antigo(session: Session, adapter: TypeAdapter) -> bytes:
+    publicos = [user_to_public(u) for u in session.exec(select(UserProfile)).all()]
+    # o FastAPI valida de novo contra o response_model antes de serializar
+    validados = adapter.validate_python(publicos, from_attributes=True)
+    return dumps(jsonable_encoder(adapter.dump_python(validados, mode="json")))
+
+
+def caminho_rapido(session: Session) -> bytes:
+    return linhas_para_json(session.exec(select(*COLUNAS_PUBLICAS)).all())
+
+
+def medir(nome: str, fn, quantidade: int, repeticoes: int) -> float:
+    fn()  # aquecimento
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        fn()
+    duracao = time.perf_counter() - inicio
+    por_segundo = quantidade * repeticoes / duracao
+    print(f"{nome:<10} {por_segundo:>12,.0f} linhas/s  ({duracao / repeticoes * 1000:.1f} ms por listagem)")
+    return por_segundo
+
+
+def main() -> None:
+    quantidade = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    repeticoes = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    popular(quantidade)
+    adapter = TypeAdapter(List[UserPublic])
+    print(f"{quantidade} usuários, {repeticoes} repetições, serializador: {'orjson' if orjson else 'json'}")
+    with Session(engine) as session:
+        antigo = medir("antigo", lambda: caminho_antigo(session, adapter), quantidade, repeticoes)
+        rapido = medir("rápido", lambda: caminho_rapido(session), quantidade, repeticoes)
+        assert caminho_antigo(session, adapter) == caminho_rapido(session), "saídas diferentes"
+    print(f"ganho: {rapido / antigo:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
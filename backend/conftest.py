@@ -0,0 +1,56 @@
+"""Configuração comum dos testes: banco SQLite temporário e cliente da API.
+
+O `DATABASE_URL` precisa estar definido antes do primeiro import de `app`, que
+cria o engine na importação.
+"""
+import itertools
+import os
+import tempfile
+
+_DIRETORIO = tempfile.mkdtemp(prefix="penseoffline-testes-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_DIRETORIO, 'testes.db')}"
+
+import pytest
+from sqlalchemy import event
+
+from app import database
+
+
+def _chaves_estrangeiras(dbapi_connection, connection_record):
+    # o SQLite só confere as FKs com este pragma: os testes cobram o mesmo que o Postgres
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+event.listen(database.engine, "connect", _chaves_estrangeiras)
+if database.async_engine is not None:
+    event.listen(database.async_engine.sync_engine, "connect", _chaves_estrangeiras)
+
+_numeros = itertools.count(1)
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    # o `with` roda startup/shutdown (init_db, thread escritora, tarefas de fundo)
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def novo_usuario(client):
+    """Cadastra um usuário novo; devolve (perfil, headers com o token)"""
+
+    def criar(prefixo: str = "user"):
+        username = f"{prefixo}{next(_numeros)}"
+        r = client.post("/users/register", json={
+            "username": username, "email": f"{username}@example.com", "password": "senha123", "name": username.title(),
+        })
+        assert r.status_code == 201, r.text
+        dados = r.json()
+        return dados["user"], {"Authorization": f"Bearer {dados['access_token']}"}
+
+    return criar
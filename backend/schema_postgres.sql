@@ -28,6 +28,7 @@ CREATE TABLE IF NOT EXISTS community (
     description TEXT,
     visibility VARCHAR(20) NOT NULL DEFAULT 'public',
     owner_id INTEGER REFERENCES userprofile(id) ON DELETE SET NULL,
+    member_count INTEGER NOT NULL DEFAULT 0,
     created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
     updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
 );
@@ -56,6 +57,15 @@ CREATE TABLE IF NOT EXISTS event (
     updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
 );
 
+-- Event attendance (uma presença por usuário/evento)
+CREATE TABLE IF NOT EXISTS eventattendance (
+    id SERIAL PRIMARY KEY,
+    event_id INTEGER NOT NULL REFERENCES event(id) ON DELETE CASCADE,
+    user_id INTEGER NOT NULL REFERENCES userprofile(id) ON DELETE CASCADE,
+    xp_awarded INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
+
 -- XP history
 CREATE TABLE IF NOT EXISTS xphistory (
     id SERIAL PRIMARY KEY,
@@ -64,10 +74,21 @@ CREATE TABLE IF NOT EXISTS xphistory (
     type VARCHAR(50) NOT NULL DEFAULT 'manual',
     xp_amount INTEGER NOT NULL DEFAULT 0,
     metadata JSONB,
+    idempotency_key VARCHAR(100),
     created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
 );
 
+-- Colunas adicionadas depois da criação inicial (bancos já existentes)
+ALTER TABLE xphistory ADD COLUMN IF NOT EXISTS idempotency_key VARCHAR(100);
+ALTER TABLE community ADD COLUMN IF NOT EXISTS member_count INTEGER NOT NULL DEFAULT 0;
+
 -- Useful indexes (uniques above already create indexes)
 CREATE INDEX IF NOT EXISTS idx_userprofile_username ON userprofile(username);
 CREATE INDEX IF NOT EXISTS idx_userprofile_email ON userprofile(email);
 CREATE INDEX IF NOT EXISTS idx_community_slug ON community(slug);
+CREATE UNIQUE INDEX IF NOT EXISTS ix_userprofile_username_lower ON userprofile(lower(username));
+CREATE UNIQUE INDEX IF NOT EXISTS ix_userprofile_email_lower ON userprofile(lower(email));
+CREATE INDEX IF NOT EXISTS ix_userprofile_pontos_id ON userprofile(pontos DESC, id);
+CREATE INDEX IF NOT EXISTS ix_xphistory_user_created ON xphistory(user_id, created_at, id);
+CREATE UNIQUE INDEX IF NOT EXISTS ux_xphistory_user_idempotency ON xphistory(user_id, idempotency_key);
+CREATE UNIQUE INDEX IF NOT EXISTS ux_eventattendance_event_user ON eventattendance(event_id, user_id);
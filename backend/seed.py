@@ -2,6 +2,7 @@ from sqlmodel import Session
 from app.database import engine, init_db
 from app.models import UserProfile, Community, CommunityMembership, Event, XPHistory
 from app.auth import hash_password
+from app.ranking import registrar_pontos
 
 
 def seed():
@@ -48,6 +49,9 @@ def seed():
         # Atualizar pontos/xp totals
         alice.adicionar_pontos(20)
         bob.adicionar_pontos(20)
+        # o índice do ranking só é atualizado se a transação for confirmada
+        registrar_pontos(session, alice.id, alice.pontos)
+        registrar_pontos(session, bob.id, bob.pontos)
 
         session.commit()
 
@@ -0,0 +1,42 @@
+"""Testes das comunidades: contador de membros e invalidação do cache de respostas.
+
+Rodar a partir de `backend/`: `python -m pytest test_communities.py`
+"""
+
+
+def _na_listagem(client, headers, community_id: int) -> dict:
+    r = client.get("/communities/", params={"limit": 200}, headers=headers)
+    assert r.status_code == 200, r.text
+    return next(c for c in r.json() if c["id"] == community_id)
+
+
+def test_entrar_invalida_so_a_comunidade_e_o_usuario(client, novo_usuario):
+    dono, h_dono = novo_usuario("comunidade")
+    _, h_membro = novo_usuario("comunidade")
+    comunidade = client.post("/communities/", json={"slug": f"k-{dono['id']}", "name": "K"}, headers=h_dono).json()
+
+    assert _na_listagem(client, h_membro, comunidade["id"])["is_member"] is False
+    etag_dono = client.get("/communities/", params={"limit": 200}, headers=h_dono).headers["ETag"]
+    assert client.get(f"/communities/{comunidade['id']}", headers=h_membro).json()["member_count"] == 0
+
+    assert client.post(f"/communities/{comunidade['id']}/join", headers=h_membro).json()["message"] == "Joined"
+
+    # a listagem de quem entrou e o detalhe da comunidade mudam na hora
+    assert _na_listagem(client, h_membro, comunidade["id"])["is_member"] is True
+    assert client.get(f"/communities/{comunidade['id']}", headers=h_membro).json()["member_count"] == 1
+    # a listagem dos outros usuários continua servida do cache
+    r = client.get("/communities/", params={"limit": 200}, headers={**h_dono, "If-None-Match": etag_dono})
+    assert r.status_code == 304
+
+    assert client.post(f"/communities/{comunidade['id']}/leave", headers=h_membro).status_code == 200
+    assert _na_listagem(client, h_membro, comunidade["id"])["is_member"] is False
+    assert client.get(f"/communities/{comunidade['id']}", headers=h_membro).json()["member_count"] == 0
+
+
+def test_estatisticas_globais_acompanham_as_concessoes(client, novo_usuario):
+    _, headers = novo_usuario("stats")
+    antes = client.get("/stats/global", headers=headers).json()
+    client.post("/rewards/complete-challenge", json={"pontos": 12}, headers=headers)
+    depois = client.get("/stats/global", headers=headers).json()
+    assert depois["total_pontos"] == antes["total_pontos"] + 12
+    assert depois["total_desafios"] == antes["total_desafios"] + 1
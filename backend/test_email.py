@@ -0,0 +1,114 @@
+"""Testes do outbox de emails contra um servidor SMTP local (aiosmtpd).
+
+Rodar a partir de `backend/`: `python -m pytest test_email.py`
+"""
+import asyncio
+import socket
+
+import pytest
+from aiosmtpd.controller import Controller
+
+from app import email_service
+from app.email_service import MailOutbox, montar_boas_vindas
+
+
+class Caixa:
+    """Handler do aiosmtpd que guarda os destinatários recebidos"""
+
+    def __init__(self):
+        self.destinatarios = []
+        self.sessoes = set()
+
+    async def handle_DATA(self, server, session, envelope):
+        self.destinatarios.extend(envelope.rcpt_tos)
+        self.sessoes.add(id(session))
+        return "250 OK"
+
+
+def _porta_livre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def porta(monkeypatch):
+    porta = _porta_livre()
+    monkeypatch.setattr(email_service, "EMAIL_SIMULADO", False)
+    monkeypatch.setattr(email_service, "SMTP_HOST", "127.0.0.1")
+    monkeypatch.setattr(email_service, "SMTP_PORT", porta)
+    monkeypatch.setattr(email_service, "SMTP_STARTTLS", False)
+    monkeypatch.setattr(email_service, "SMTP_USER", "")
+    monkeypatch.setattr(email_service, "MAIL_RETRY_BASE_SECONDS", 0.05)
+    return porta
+
+
+@pytest.fixture
+def servidor(porta):
+    caixa = Caixa()
+    controller = Controller(caixa, hostname="127.0.0.1", port=porta)
+    controller.start()
+    yield caixa
+    controller.stop()
+
+
+def test_entrega_em_uma_conexao(servidor):
+    async def cenario():
+        outbox = MailOutbox()
+        worker = asyncio.create_task(outbox.executar())
+        for i in range(20):
+            assert outbox.enfileirar(montar_boas_vindas(f"u{i}@x.com", "Ana", i))
+        await asyncio.wait_for(outbox._fila.join(), 5)
+        worker.cancel()
+        await outbox.esvaziar(1)
+        return outbox.stats()
+
+    stats = asyncio.run(cenario())
+    assert sorted(servidor.destinatarios) == sorted(f"u{i}@x.com" for i in range(20))
+    assert len(servidor.sessoes) == 1
+    assert stats == {"pendentes": 0, "enviados": 20, "falhas": 0, "descartados": 0}
+
+
+def test_nova_tentativa_depois_de_conexao_recusada(porta):
+    caixa = Caixa()
+    controller = Controller(caixa, hostname="127.0.0.1", port=porta)
+
+    async def cenario():
+        outbox = MailOutbox()
+        worker = asyncio.create_task(outbox.executar())
+        # nada escutando na porta: a conexão é recusada e o envio vai para o backoff
+        outbox.enfileirar(montar_boas_vindas("retry@x.com", "Ana", 1))
+        await asyncio.wait_for(outbox._fila.join(), 5)
+        assert outbox.enviados == 0 and outbox._retentativas
+        controller.start()
+        try:
+            for _ in range(100):
+                if outbox.enviados:
+                    break
+                await asyncio.sleep(0.05)
+        finally:
+            worker.cancel()
+            await outbox.esvaziar(1)
+            controller.stop()
+        return outbox.stats()
+
+    stats = asyncio.run(cenario())
+    assert caixa.destinatarios == ["retry@x.com"]
+    assert stats["enviados"] == 1 and stats["falhas"] == 0
+
+
+def test_esvaziar_entrega_a_fila_no_encerramento(servidor):
+    async def cenario():
+        outbox = MailOutbox()
+        for i in range(10):
+            outbox.enfileirar(montar_boas_vindas(f"fim{i}@x.com", "Ana", i))
+        # o worker começa junto com o encerramento, como num shutdown logo após o cadastro
+        worker = asyncio.create_task(outbox.executar())
+        await outbox.esvaziar(5)
+        worker.cancel()
+        return outbox
+
+    outbox = asyncio.run(cenario())
+    assert len(servidor.destinatarios) == 10
+    assert outbox.stats()["pendentes"] == 0
+    assert outbox._smtp is None
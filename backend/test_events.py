@@ -0,0 +1,102 @@
+"""Testes da presença em eventos e do backfill de `eventattendance` no init_db.
+
+Rodar a partir de `backend/`: `python -m pytest test_events.py`
+"""
+import threading
+
+from sqlalchemy import text
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from app import database
+from app.database import engine
+from app.ledger import registrar_presenca
+from app.models import Community, CommunityMembership, Event, EventAttendance, UserProfile, XPHistory
+
+
+def _criar_evento(client, headers, xp: int = 40) -> dict:
+    r = client.post("/events/", json={"title": "Caminhada", "xp_reward": xp}, headers=headers)
+    assert r.status_code == 200, r.text
+    return r.json()
+
+
+def test_presenca_repetida_concede_xp_uma_vez(client, novo_usuario):
+    user, headers = novo_usuario("presenca")
+    evento = _criar_evento(client, headers)
+
+    primeira = client.post(f"/events/{evento['id']}/attend", headers=headers).json()
+    segunda = client.post(f"/events/{evento['id']}/attend", headers=headers).json()
+    assert (primeira["xp_awarded"], primeira["total_xp"]) == (40, 40)
+    assert (segunda["message"], segunda["xp_awarded"], segunda["total_xp"]) == ("Already attended", 0, 40)
+
+    # pedidos simultâneos do mesmo usuário: só um insere a presença
+    outro, _ = novo_usuario("presenca")
+    resultados = []
+
+    def marcar():
+        with Session(engine) as session:
+            resultados.append(registrar_presenca(session, outro["id"], evento["id"]))
+            session.commit()
+
+    threads = [threading.Thread(target=marcar) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sum(r is not None for r in resultados) == 1
+
+    with Session(engine) as session:
+        for user_id in (user["id"], outro["id"]):
+            assert session.get(UserProfile, user_id).xp_total == 40
+            presencas = session.exec(select(EventAttendance).where(EventAttendance.user_id == user_id)).all()
+            assert [p.xp_awarded for p in presencas] == [40]
+            historico = session.exec(select(XPHistory).where(XPHistory.user_id == user_id)).all()
+            assert [(h.type, h.event_id) for h in historico] == [("event", evento["id"])]
+
+
+def test_presenca_em_evento_inexistente_responde_404(client, novo_usuario):
+    user, headers = novo_usuario("presenca")
+    r = client.post("/events/999999/attend", headers=headers)
+    assert r.status_code == 404
+    assert client.get("/users/me", headers=headers).json()["xp_total"] == 0
+
+
+def test_init_db_preenche_presencas_e_membros_de_banco_antigo(tmp_path, monkeypatch):
+    antigo = create_engine(f"sqlite:///{tmp_path / 'antigo.db'}")
+    SQLModel.metadata.create_all(antigo)
+    with Session(antigo) as session:
+        a = UserProfile(username="ana", email="ana@x.com", password_hash="x", name="Ana")
+        b = UserProfile(username="bia", email="bia@x.com", password_hash="x", name="Bia")
+        session.add_all([a, b])
+        session.flush()
+        comunidade = Community(slug="clube", name="Clube", owner_id=a.id)
+        evento = Event(creator_id=a.id, title="Trilha", xp_reward=30)
+        session.add_all([comunidade, evento])
+        session.flush()
+        session.add_all([
+            CommunityMembership(community_id=comunidade.id, user_id=a.id),
+            CommunityMembership(community_id=comunidade.id, user_id=b.id),
+            # presença contada duas vezes pelo código antigo
+            XPHistory(user_id=a.id, event_id=evento.id, type="event", xp_amount=30),
+            XPHistory(user_id=a.id, event_id=evento.id, type="event", xp_amount=30),
+            XPHistory(user_id=b.id, event_id=evento.id, type="event", xp_amount=30),
+            XPHistory(user_id=b.id, type="desafio", xp_amount=15),
+        ])
+        session.commit()
+        ids = (a.id, b.id, comunidade.id, evento.id)
+    # o esquema de antes: sem a tabela de presenças e sem o contador de membros
+    with antigo.begin() as conn:
+        conn.execute(text("DROP TABLE eventattendance"))
+        conn.execute(text("ALTER TABLE community DROP COLUMN member_count"))
+
+    monkeypatch.setattr(database, "engine", antigo)
+    database.init_db()
+    # rodar de novo (próximo deploy) não duplica nada
+    database.init_db()
+
+    a_id, b_id, comunidade_id, evento_id = ids
+    with antigo.connect() as conn:
+        presencas = conn.execute(text("SELECT event_id, user_id, xp_awarded FROM eventattendance ORDER BY user_id")).all()
+        membros = conn.execute(text("SELECT member_count FROM community WHERE id = :id"), {"id": comunidade_id}).scalar_one()
+    assert [tuple(p) for p in presencas] == [(evento_id, a_id, 30), (evento_id, b_id, 30)]
+    assert membros == 2
+    antigo.dispose()
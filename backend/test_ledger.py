@@ -0,0 +1,81 @@
+"""Testes da concessão atômica de pontos (ledger) e do tempo sem tela sem pontos.
+
+Rodar a partir de `backend/`: `python -m pytest test_ledger.py`
+"""
+import threading
+
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from app.database import engine
+from app.ledger import PONTOS_POR_NIVEL, conceder_pontos
+from app.models import UserProfile, XPHistory
+
+
+def _historico(user_id: int) -> list:
+    with Session(engine) as session:
+        return session.exec(select(XPHistory).where(XPHistory.user_id == user_id)).all()
+
+
+def test_menos_de_uma_hora_nao_grava_historico(client, novo_usuario):
+    user, headers = novo_usuario("tempo")
+
+    r = client.post("/rewards/add-time", json={"minutos": 45}, headers=headers)
+    assert r.status_code == 200, r.text
+    assert r.json()["pontos_ganhos"] == 0
+
+    assert _historico(user["id"]) == []
+    assert client.get("/users/me/xp_history", headers=headers).json() == []
+    perfil = client.get("/users/me", headers=headers).json()
+    assert (perfil["tempo_sem_tela_minutos"], perfil["pontos"], perfil["xp_total"]) == (45, 0, 0)
+
+    # completando a hora, a concessão seguinte pontua normalmente
+    r = client.post("/rewards/add-time", json={"minutos": 60}, headers=headers)
+    assert r.json()["pontos_ganhos"] == 10
+    assert [h.xp_amount for h in _historico(user["id"])] == [10]
+
+
+def test_concessoes_concorrentes_somam_exatamente(client, novo_usuario):
+    user, _ = novo_usuario("concorrente")
+    n_threads, por_thread, pontos = 8, 25, 3
+    erros = []
+
+    def conceder():
+        try:
+            for _ in range(por_thread):
+                # uma sessão e um commit por concessão, sem a thread escritora
+                with Session(engine) as session:
+                    conceder_pontos(session, user["id"], pontos, "desafio", desafios=1)
+                    session.commit()
+        except Exception as e:
+            erros.append(e)
+
+    threads = [threading.Thread(target=conceder) for _ in range(n_threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert erros == []
+    total = n_threads * por_thread * pontos
+    with Session(engine) as session:
+        perfil = session.get(UserProfile, user["id"])
+        assert (perfil.pontos, perfil.xp_total, perfil.desafios_completados) == (total, total, n_threads * por_thread)
+        assert perfil.nivel == total // PONTOS_POR_NIVEL + 1
+        linhas, soma = session.exec(
+            select(func.count(XPHistory.id), func.sum(XPHistory.xp_amount)).where(XPHistory.user_id == user["id"])
+        ).one()
+        assert (linhas, soma) == (n_threads * por_thread, total)
+
+
+def test_nivel_acompanha_os_pontos(client, novo_usuario):
+    user, _ = novo_usuario("nivel")
+    acumulado = 0
+    for pontos in (40, 59, 1, 99, 250, 7):
+        acumulado += pontos
+        with Session(engine) as session:
+            saldo = conceder_pontos(session, user["id"], pontos, "desafio")
+            session.commit()
+            perfil = session.get(UserProfile, user["id"])
+        assert saldo.pontos == perfil.pontos == acumulado
+        assert saldo.nivel == perfil.nivel == acumulado // PONTOS_POR_NIVEL + 1
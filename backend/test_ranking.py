@@ -0,0 +1,36 @@
+"""Testes do índice de ranking em memória.
+
+Rodar a partir de `backend/`: `python -m pytest test_ranking.py`
+"""
+from app.ranking import RankingIndex
+
+
+def test_ordem_posicao_e_vizinhos():
+    indice = RankingIndex()
+    indice.carregar([(1, 50), (2, 80), (3, 50), (4, 10)])
+    # pontos desc, empate pelo menor id
+    assert indice.top(10) == [(2, 80), (1, 50), (3, 50), (4, 10)]
+    assert indice.top(2, offset=1) == [(1, 50), (3, 50)]
+    assert indice.apos(50, 1, 10) == [(3, 50), (4, 10)]
+    assert [indice.posicao(uid) for uid in (2, 1, 3, 4, 99)] == [1, 2, 3, 4, None]
+    assert indice.vizinhos(3, raio=1) == [(2, 1, 50), (3, 3, 50), (4, 4, 10)]
+
+
+def test_atualizar_remover_e_versao():
+    indice = RankingIndex()
+    indice.carregar([(1, 50), (2, 80)])
+    versao = indice.versao
+
+    indice.atualizar(1, 90)
+    indice.atualizar(3, 0)
+    assert indice.top(10) == [(1, 90), (2, 80), (3, 0)]
+    # commit fora de ordem: um valor menor é ignorado
+    indice.atualizar(1, 60, somente_aumento=True)
+    assert indice.pontos(1) == 90
+    assert indice.versao == versao + 2
+
+    indice.remover(2)
+    indice.remover(2)
+    assert indice.top(10) == [(1, 90), (3, 0)]
+    assert len(indice) == 2
+    assert indice.versao == versao + 3
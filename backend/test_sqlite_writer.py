@@ -0,0 +1,106 @@
+"""Testes do escritor único do SQLite (group commit, replay e timeout).
+
+Rodar a partir de `backend/`: `python -m pytest test_sqlite_writer.py`
+"""
+import threading
+import time
+
+import pytest
+from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine, insert, select
+
+from app import sqlite_writer
+from app.sqlite_writer import SQLiteWriter
+
+metadata = MetaData()
+itens = Table("itens", metadata, Column("id", Integer, primary_key=True), Column("nome", String, unique=True))
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'writer.db'}", connect_args={"check_same_thread": False})
+    metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def writer(engine):
+    writer = SQLiteWriter(max_lote=64, engine=engine)
+    writer.iniciar()
+    yield writer
+    writer.parar()
+
+
+def _nomes(engine):
+    with engine.connect() as conn:
+        return sorted(conn.execute(select(itens.c.nome)).scalars())
+
+
+def _inserir(nome):
+    return lambda session: session.execute(insert(itens).values(nome=nome)).inserted_primary_key[0]
+
+
+def test_escritas_concorrentes_com_uma_falha(engine, writer):
+    liberar = threading.Event()
+    # segura a thread escritora para que as escritas seguintes se acumulem em um lote
+    bloqueio = threading.Thread(target=writer.submeter, args=(lambda session: liberar.wait(5),))
+    bloqueio.start()
+    while writer.transacoes == 0:
+        time.sleep(0.01)
+
+    resultados, erros = {}, {}
+
+    def escrever(nome):
+        try:
+            resultados[nome] = writer.submeter(_inserir(nome))
+        except Exception as e:
+            erros[nome] = e
+
+    # "dup" aparece duas vezes: a segunda viola a unicidade e derruba o lote
+    nomes = [f"n{i}" for i in range(30)] + ["dup", "dup"]
+    threads = [threading.Thread(target=escrever, args=(nome,)) for nome in nomes]
+    for t in threads:
+        t.start()
+    while writer._fila.qsize() < len(nomes):
+        time.sleep(0.01)
+    liberar.set()
+    for t in threads + [bloqueio]:
+        t.join()
+
+    # o lote falho foi refeito um a um: só a escrita duplicada falhou
+    assert list(erros) == ["dup"]
+    assert _nomes(engine) == sorted(set(nomes))
+    assert len(set(resultados.values())) == len(resultados) == 31
+    # bloqueio + o lote com as 32 escritas (refeito uma a uma)
+    assert writer.lotes == 2
+    assert writer.transacoes == 33
+
+
+def test_timeout_cancela_transacao_ainda_na_fila(engine, writer, monkeypatch):
+    monkeypatch.setattr(sqlite_writer, "SQLITE_WRITER_TIMEOUT", 0.1)
+    liberar = threading.Event()
+    bloqueio = threading.Thread(target=writer.submeter, args=(lambda session: liberar.wait(5),))
+    bloqueio.start()
+    while writer.transacoes == 0:
+        time.sleep(0.01)
+
+    with pytest.raises(TimeoutError):
+        writer.submeter(_inserir("atrasada"))
+    liberar.set()
+    bloqueio.join()
+    writer.submeter(_inserir("depois"))
+
+    # a transação cancelada nunca chega ao banco
+    assert _nomes(engine) == ["depois"]
+
+
+def test_timeout_espera_transacao_em_execucao(engine, writer, monkeypatch):
+    monkeypatch.setattr(sqlite_writer, "SQLITE_WRITER_TIMEOUT", 0.05)
+
+    def lenta(session):
+        time.sleep(0.3)
+        return _inserir("lenta")(session)
+
+    # já pega pela thread escritora: o resultado real é devolvido, sem erro
+    assert writer.submeter(lenta) == 1
+    assert _nomes(engine) == ["lenta"]
@@ -0,0 +1,29 @@
+"""Testes da autenticação do canal de tempo real (/stream).
+
+Rodar a partir de `backend/`: `python -m pytest test_stream.py`
+"""
+from starlette.requests import Request
+
+from app.auth import authenticate_request
+
+
+def _requisicao(caminho: str, token: str) -> Request:
+    return Request({"type": "http", "method": "GET", "path": caminho, "query_string": f"token={token}".encode(), "headers": []})
+
+
+def test_stream_so_aceita_o_token_curto_na_url(client, novo_usuario):
+    user, headers = novo_usuario("stream")
+    login = headers["Authorization"].removeprefix("Bearer ")
+
+    r = client.post("/stream/token", headers=headers)
+    assert r.status_code == 200, r.text
+    token = r.json()["token"]
+
+    # o token do login não vale na query string
+    assert client.get("/stream", params={"token": login}).status_code == 401
+    # o token curto não vale no header, nem fora do /stream
+    assert client.get("/users/me", headers={"Authorization": f"Bearer {token}"}).status_code == 401
+    assert client.get("/users/me", params={"token": token}).status_code == 401
+
+    assert authenticate_request(_requisicao("/stream", token))["sub"] == user["username"]
+    assert authenticate_request(_requisicao("/api/stream", token))["sub"] == user["username"]
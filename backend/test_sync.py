@@ -0,0 +1,75 @@
+"""Testes da sincronização offline idempotente (POST /rewards/sync).
+
+Rodar a partir de `backend/`: `python -m pytest test_sync.py`
+"""
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from app.database import engine
+from app.main import MAX_ENTRADAS_SYNC
+from app.models import XPHistory
+
+LOTE = [
+    {"idempotency_key": "t-90", "tipo": "tempo", "minutos": 90},
+    {"idempotency_key": "t-30", "tipo": "tempo", "minutos": 30},
+    {"idempotency_key": "d-1", "tipo": "desafio", "pontos": 25, "nome_desafio": "Leitura"},
+]
+
+
+def _linhas_historico(user_id: int) -> int:
+    with Session(engine) as session:
+        return session.exec(select(func.count(XPHistory.id)).where(XPHistory.user_id == user_id)).one()
+
+
+def test_reenviar_o_lote_nao_conta_de_novo(client, novo_usuario):
+    user, headers = novo_usuario("sync")
+
+    r = client.post("/rewards/sync", json={"entradas": LOTE}, headers=headers)
+    assert r.status_code == 200, r.text
+    primeira = r.json()
+    assert (primeira["aplicadas"], primeira["ignoradas"], primeira["pontos_ganhos"]) == (3, 0, 35)
+    assert (primeira["pontos_totais"], primeira["tempo_sem_tela_minutos"], primeira["desafios_completados"]) == (35, 120, 1)
+    # a entrada de 30 minutos (0 pontos) também deixa o recibo da chave
+    assert _linhas_historico(user["id"]) == 3
+
+    r = client.post("/rewards/sync", json={"entradas": LOTE}, headers=headers)
+    repetida = r.json()
+    assert (repetida["aplicadas"], repetida["ignoradas"], repetida["pontos_ganhos"]) == (0, 3, 0)
+    assert (repetida["pontos_totais"], repetida["tempo_sem_tela_minutos"], repetida["desafios_completados"]) == (35, 120, 1)
+    assert _linhas_historico(user["id"]) == 3
+
+    perfil = client.get("/users/me", headers=headers).json()
+    assert (perfil["pontos"], perfil["xp_total"], perfil["tempo_sem_tela_minutos"]) == (35, 35, 120)
+    # o histórico visível não mostra o recibo de 0 XP
+    assert sorted(h["xp_amount"] for h in client.get("/users/me/xp_history", headers=headers).json()) == [10, 25]
+
+
+def test_lote_parcialmente_repetido_aplica_so_as_novas(client, novo_usuario):
+    user, headers = novo_usuario("sync")
+    client.post("/rewards/sync", json={"entradas": LOTE[:1]}, headers=headers)
+
+    novas = [
+        LOTE[0],
+        {"idempotency_key": "d-2", "tipo": "desafio", "pontos": 5},
+        # chave repetida dentro do mesmo lote conta uma vez
+        {"idempotency_key": "d-2", "tipo": "desafio", "pontos": 5},
+    ]
+    r = client.post("/rewards/sync", json={"entradas": novas}, headers=headers).json()
+    assert (r["aplicadas"], r["ignoradas"], r["pontos_ganhos"], r["pontos_totais"]) == (1, 2, 5, 15)
+    assert _linhas_historico(user["id"]) == 2
+
+
+def test_lote_acima_do_limite_e_recusado(client, novo_usuario):
+    user, headers = novo_usuario("sync")
+    entradas = [
+        {"idempotency_key": f"d-{i}", "tipo": "desafio", "pontos": 1} for i in range(MAX_ENTRADAS_SYNC + 1)
+    ]
+
+    r = client.post("/rewards/sync", json={"entradas": entradas}, headers=headers)
+    assert r.status_code == 400
+    assert _linhas_historico(user["id"]) == 0
+    assert client.get("/users/me", headers=headers).json()["pontos"] == 0
+
+    r = client.post("/rewards/sync", json={"entradas": entradas[:MAX_ENTRADAS_SYNC]}, headers=headers)
+    assert r.status_code == 200
+    assert r.json()["aplicadas"] == MAX_ENTRADAS_SYNC
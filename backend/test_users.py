@@ -0,0 +1,53 @@
+"""Testes das rotas de conta do usuário (/users/me).
+
+Rodar a partir de `backend/`: `python -m pytest test_users.py`
+"""
+from sqlmodel import Session, select
+
+from app.database import engine
+from app.models import XPHistory
+
+
+def test_remover_usuario_com_evento_membership_e_historico(client, novo_usuario):
+    dono, h_dono = novo_usuario("dono")
+    participante, h_participante = novo_usuario("participante")
+
+    comunidade = client.post("/communities/", json={"slug": f"c-{dono['id']}", "name": "Clube"}, headers=h_dono).json()
+    evento = client.post("/events/", json={"title": "Trilha", "xp_reward": 30}, headers=h_dono).json()
+    for headers in (h_dono, h_participante):
+        assert client.post(f"/communities/{comunidade['id']}/join", headers=headers).status_code == 200
+        assert client.post(f"/events/{evento['id']}/attend", headers=headers).status_code == 200
+    assert client.post("/rewards/complete-challenge", json={"pontos": 20}, headers=h_dono).status_code == 200
+
+    r = client.delete("/users/me", headers=h_dono)
+    assert r.status_code == 204, r.text
+
+    assert client.get(f"/users/{dono['id']}", headers=h_participante).status_code == 404
+    assert client.get(f"/events/{evento['id']}", headers=h_participante).status_code == 404
+    restante = client.get(f"/communities/{comunidade['id']}", headers=h_participante).json()
+    assert restante["member_count"] == 1
+    assert restante["owner_id"] is None
+    # o XP do participante continua, sem a referência ao evento removido
+    perfil = client.get("/users/me", headers=h_participante).json()
+    assert perfil["pontos"] == 30
+    with Session(engine) as session:
+        historico = session.exec(select(XPHistory).where(XPHistory.user_id == participante["id"])).all()
+        assert [(h.type, h.xp_amount, h.event_id) for h in historico] == [("event", 30, None)]
+        assert session.exec(select(XPHistory).where(XPHistory.user_id == dono["id"])).all() == []
+
+
+def test_email_em_uso_com_outra_caixa_responde_409(client, novo_usuario):
+    outro, _ = novo_usuario("email")
+    _, headers = novo_usuario("email")
+    em_uso = outro["email"].upper()
+
+    r = client.put("/profiles/me", json={"email": em_uso}, headers=headers)
+    assert r.status_code == 409, r.text
+    r = client.put("/users/me", params={"email": em_uso}, headers=headers)
+    assert r.status_code == 409, r.text
+    r = client.put("/profiles/me", json={"email": "sem-arroba"}, headers=headers)
+    assert r.status_code == 400
+
+    r = client.put("/profiles/me", json={"email": "Novo.Email@example.com", "name": "Novo"}, headers=headers)
+    assert r.status_code == 200, r.text
+    assert (r.json()["email"], r.json()["name"]) == ("Novo.Email@example.com", "Novo")